@@ -18,13 +18,16 @@ Long description of module's purpose
     'version': '0.1',
 
     # any module necessary for this one to work correctly
-    'depends': ['report_xlsx'],
+    'depends': ['report_xlsx', 'stock'],
 
     # always loaded
     'data': [
         'security/ir.model.access.csv',
+        'data/ir_cron.xml',
+        'data/ir_actions_server.xml',
         # 'views/views.xml',
         'reports/pallet_kilos_xlsx_report.xml',
+        'wizard/report_wizard_views.xml',
     ],
     # only loaded in demonstration mode
     'demo': [
@@ -1,3 +1,6 @@
 # -*- coding: utf-8 -*-
 
+from . import warehouse_capacity
 from . import models
+from . import report_snapshot
+from . import daily_balance
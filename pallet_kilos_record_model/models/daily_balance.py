@@ -0,0 +1,245 @@
+from odoo import models, fields, api
+from odoo.tools import SQL
+from odoo.tools.sql import create_unique_index
+
+from ..tools.billing import compute_billing
+from ..tools.daily_series import add_rolling_stats, carry_forward, fill_days
+from ..tools.report_time import report_day_sql
+
+# Day of a ledger record, in the time of the reports
+LEDGER_DAY = report_day_sql(SQL('line.create_date'))
+
+
+class DailyBalance(models.Model):
+    """Moves and closing balances of one owner in one warehouse for one day,
+    aggregated from the ledger and kept up to date by its create, write and
+    unlink, so that reports and dashboards read one row per day."""
+    _name = 'pallet_kilos_record_model.daily_balance'
+    _description = 'Pallet/Kilos Daily Balance'
+    _order = 'day, warehouse_id, owner_id'
+
+    warehouse_id = fields.Many2one('stock.warehouse', 'Warehouse', readonly=True, index=True)
+    owner_id = fields.Many2one('res.partner', 'Owner', readonly=True, index=True)
+    day = fields.Date(required=True, readonly=True, index=True)
+    record_count = fields.Integer(readonly=True)
+    last_date = fields.Datetime('Last Record Date', readonly=True)
+    pallets_received = fields.Float(readonly=True)
+    pallets_withdrawn = fields.Float(readonly=True)
+    kilos_received = fields.Float(readonly=True)
+    kilos_withdrawn = fields.Float(readonly=True)
+    balance_pallets = fields.Float('Owner Balance in Pallets', readonly=True, group_operator=False)
+    balance_kilos = fields.Float('Owner Balance in Kilos', readonly=True, group_operator=False)
+    warehouse_balance_pallets = fields.Float('Warehouse Balance in Pallets', readonly=True, group_operator=False)
+    warehouse_balance_kilos = fields.Float('Warehouse Balance in Kilos', readonly=True, group_operator=False)
+
+    def init(self):
+        create_unique_index(
+            self.env.cr, 'pallet_kilos_record_model_daily_balance_key_uniq', self._table,
+            ['COALESCE(warehouse_id, 0)', 'COALESCE(owner_id, 0)', 'day'],
+        )
+        self.env.cr.execute(SQL(
+            'SELECT COUNT(*) = 0 OR bool_or(last_date IS NULL) FROM %s', SQL.identifier(self._table),
+        ))
+        if self.env.cr.fetchone()[0]:
+            self._rebuild_daily_balances()
+
+    def _insert_daily_balances(self, where):
+        """Aggregate the ledger records matching ``where`` (on alias ``line``),
+        updating the days already aggregated: a concurrent refresh of the same day
+        waits for the first one on the unique index, then is retried as a
+        serialization failure instead of failing as a unique violation."""
+        ledger = self.env['pallet_kilos_record_model.pallet_kilos_record_model']
+        self.env.cr.execute(SQL(
+            """
+            INSERT INTO %(table)s (
+                warehouse_id, owner_id, day, record_count, last_date,
+                pallets_received, pallets_withdrawn, kilos_received, kilos_withdrawn,
+                balance_pallets, balance_kilos, warehouse_balance_pallets, warehouse_balance_kilos,
+                create_uid, write_uid, create_date, write_date)
+            SELECT line.warehouse, line.owner_id, %(day)s, COUNT(*), MAX(line.create_date),
+                   COALESCE(SUM(line.pallets_received), 0), COALESCE(SUM(line.pallets_withdrawn), 0),
+                   COALESCE(SUM(line.kilos_received), 0), COALESCE(SUM(line.kilos_withdrawn), 0),
+                   (array_agg(line.total_balance_in_pallets ORDER BY line.create_date DESC, line.id DESC))[1],
+                   (array_agg(line.total_balance_in_kilos ORDER BY line.create_date DESC, line.id DESC))[1],
+                   (array_agg(line.overall_pallets ORDER BY line.create_date DESC, line.id DESC))[1],
+                   (array_agg(line.overall_kilos ORDER BY line.create_date DESC, line.id DESC))[1],
+                   %(uid)s, %(uid)s, now() at time zone 'UTC', now() at time zone 'UTC'
+              FROM %(ledger)s line
+             WHERE %(where)s
+             GROUP BY line.warehouse, line.owner_id, %(day)s
+            ON CONFLICT ((COALESCE(warehouse_id, 0)), (COALESCE(owner_id, 0)), day) DO UPDATE
+               SET record_count = EXCLUDED.record_count,
+                   last_date = EXCLUDED.last_date,
+                   pallets_received = EXCLUDED.pallets_received,
+                   pallets_withdrawn = EXCLUDED.pallets_withdrawn,
+                   kilos_received = EXCLUDED.kilos_received,
+                   kilos_withdrawn = EXCLUDED.kilos_withdrawn,
+                   balance_pallets = EXCLUDED.balance_pallets,
+                   balance_kilos = EXCLUDED.balance_kilos,
+                   warehouse_balance_pallets = EXCLUDED.warehouse_balance_pallets,
+                   warehouse_balance_kilos = EXCLUDED.warehouse_balance_kilos,
+                   write_uid = EXCLUDED.write_uid,
+                   write_date = EXCLUDED.write_date
+            """,
+            table=SQL.identifier(self._table),
+            ledger=SQL.identifier(ledger._table),
+            day=LEDGER_DAY,
+            uid=self.env.uid,
+            where=where,
+        ))
+
+    @api.model
+    def _refresh_daily_balances(self, keys):
+        """Recompute the days of ``keys``, a collection of (warehouse id, owner
+        id, day) tuples, 0 standing for no warehouse or owner."""
+        if not keys:
+            return
+        ledger = self.env['pallet_kilos_record_model.pallet_kilos_record_model']
+        ledger.flush_model()
+        warehouse_ids, owner_ids, days = zip(*keys)
+        keys_query = SQL(
+            'SELECT * FROM unnest(%s::int[], %s::int[], %s::date[])',
+            list(warehouse_ids), list(owner_ids), list(days),
+        )
+        self._insert_daily_balances(SQL(
+            '(COALESCE(line.warehouse, 0), COALESCE(line.owner_id, 0), %s) IN (%s)', LEDGER_DAY, keys_query,
+        ))
+        # days left without any record
+        self.env.cr.execute(SQL(
+            """
+            DELETE FROM %(table)s balance
+             WHERE (COALESCE(balance.warehouse_id, 0), COALESCE(balance.owner_id, 0), balance.day) IN (%(keys)s)
+               AND NOT EXISTS (
+                   SELECT 1 FROM %(ledger)s line
+                    WHERE COALESCE(line.warehouse, 0) = COALESCE(balance.warehouse_id, 0)
+                      AND COALESCE(line.owner_id, 0) = COALESCE(balance.owner_id, 0)
+                      AND %(day)s = balance.day)
+            """,
+            table=SQL.identifier(self._table),
+            ledger=SQL.identifier(ledger._table),
+            keys=keys_query,
+            day=LEDGER_DAY,
+        ))
+        self.invalidate_model()
+
+    @api.model
+    def _rebuild_daily_balances(self):
+        """Recompute all the days from the ledger."""
+        self.env['pallet_kilos_record_model.pallet_kilos_record_model'].flush_model()
+        self.env.cr.execute(SQL('DELETE FROM %s', SQL.identifier(self._table)))
+        self._insert_daily_balances(SQL('TRUE'))
+        self.invalidate_model()
+
+    @api.model
+    def get_daily_balances(self, warehouse_ids=None, owner_ids=None, date_from=None, date_to=None):
+        """Daily rows for dashboards, sorted by day, optionally restricted to
+        some warehouses and owners and to a range of days (included)."""
+        domain = []
+        if warehouse_ids:
+            domain.append(('warehouse_id', 'in', warehouse_ids))
+        if owner_ids:
+            domain.append(('owner_id', 'in', owner_ids))
+        if date_from:
+            domain.append(('day', '>=', date_from))
+        if date_to:
+            domain.append(('day', '<=', date_to))
+        return self.search_read(domain, [
+            'warehouse_id', 'owner_id', 'day', 'record_count', 'last_date',
+            'pallets_received', 'pallets_withdrawn', 'kilos_received', 'kilos_withdrawn',
+            'balance_pallets', 'balance_kilos', 'warehouse_balance_pallets', 'warehouse_balance_kilos',
+        ])
+
+    @api.model
+    def _get_warehouse_capacities(self, warehouse):
+        """Max Pallets and Max Kilograms (KG) variables of ``warehouse``, by
+        balance field, None when not set up."""
+        capacities = self.env['pallet_kilos_record_model.warehouse_capacity'].get_capacities(warehouse.id)
+        return {
+            'warehouse_balance_pallets': capacities['pallets'],
+            'warehouse_balance_kilos': capacities['kilos'],
+        }
+
+    @api.model
+    def get_rolling_capacity(self, warehouse_id, windows=(7, 30, 90), date_from=None, date_to=None):
+        """Daily closing balances of a warehouse with their rolling averages and
+        peaks over ``windows`` days, and their rates of the warehouse capacity,
+        see ``add_rolling_stats``. The windows reach before ``date_from``."""
+        self.check_access_rights('read')
+        warehouse = self.env['stock.warehouse'].browse(warehouse_id)
+        where = SQL('warehouse_id = %s', warehouse.id)
+        if date_to:
+            where = SQL('%s AND day <= %s', where, fields.Date.to_date(date_to))
+        self.flush_model()
+        # closing balances of the warehouse: those of its last record of the day
+        self.env.cr.execute(SQL(
+            """
+            SELECT DISTINCT ON (day) day, warehouse_balance_pallets, warehouse_balance_kilos
+              FROM %s
+             WHERE %s
+             ORDER BY day, last_date DESC, id DESC
+            """,
+            SQL.identifier(self._table), where,
+        ))
+        keys = ['warehouse_balance_pallets', 'warehouse_balance_kilos']
+        rows = list(fill_days(self.env.cr.dictfetchall(), carry_forward(keys)))
+        add_rolling_stats(rows, keys, windows, self._get_warehouse_capacities(warehouse))
+        if date_from:
+            date_from = fields.Date.to_date(date_from)
+            rows = [row for row in rows if row['day'] >= date_from]
+        return rows
+
+    @api.model
+    def get_billing(self, date_from, date_to, owner_ids=None):
+        """Holding and handling charges of each owner from ``date_from`` to
+        ``date_to`` (included), see ``compute_billing``, for invoicing. The
+        balances of an owner are its closing ones of each day, all warehouses
+        together; owners without any balance are left out.
+
+        :param owner_ids: owners to bill, all by default
+        :return: list of dicts, with the ``owner_id`` and the charges
+        """
+        self.check_access_rights('read')
+        date_from, date_to = fields.Date.to_date(date_from), fields.Date.to_date(date_to)
+        where = SQL('owner_id IS NOT NULL')
+        if owner_ids:
+            where = SQL('%s AND owner_id = ANY(%s)', where, list(owner_ids))
+        self.flush_model()
+        table = SQL.identifier(self._table)
+        # balances before the period
+        self.env.cr.execute(SQL(
+            """
+            SELECT DISTINCT ON (owner_id) owner_id, balance_pallets, balance_kilos
+              FROM %s
+             WHERE %s AND day < %s
+             ORDER BY owner_id, day DESC, last_date DESC, id DESC
+            """,
+            table, where, date_from,
+        ))
+        openings = {row['owner_id']: row for row in self.env.cr.dictfetchall()}
+        # one row per owner and day of the period, all warehouses together
+        self.env.cr.execute(SQL(
+            """
+            SELECT owner_id, day,
+                   SUM(pallets_received) AS pallets_received, SUM(pallets_withdrawn) AS pallets_withdrawn,
+                   (array_agg(balance_pallets ORDER BY last_date DESC, id DESC))[1] AS balance_pallets,
+                   (array_agg(balance_kilos ORDER BY last_date DESC, id DESC))[1] AS balance_kilos
+              FROM %s
+             WHERE %s AND day BETWEEN %s AND %s
+             GROUP BY owner_id, day
+             ORDER BY owner_id, day
+            """,
+            table, where, date_from, date_to,
+        ))
+        daily_rows = {}
+        for row in self.env.cr.dictfetchall():
+            daily_rows.setdefault(row['owner_id'], []).append(row)
+        owners = self.env['res.partner'].browse(sorted(set(openings) | set(daily_rows)))
+        result = []
+        for owner in owners:
+            billing = compute_billing(
+                date_from, date_to, daily_rows.get(owner.id, []), openings.get(owner.id),
+                owner.x_studio_holding_rate, owner.x_studio_handling_rate,
+            )
+            billing['owner_id'] = owner.id
+            result.append(billing)
+        return result
@@ -1,6 +1,29 @@
 # -*- coding: utf-8 -*-
 
 from odoo import models, fields, api
+from odoo.tools import SQL
+from odoo.tools.sql import create_index
+
+from ..tools.report_time import REPORT_UTC_OFFSET
+
+# Fields aggregated in pallet_kilos_record_model.daily_balance
+DAILY_BALANCE_FIELDS = {
+    'owner_id', 'warehouse', 'create_date',
+    'pallets_received', 'pallets_withdrawn', 'kilos_received', 'kilos_withdrawn',
+    'total_balance_in_pallets', 'total_balance_in_kilos', 'overall_pallets', 'overall_kilos',
+}
+
+# Running balances by partition field: balance field -> (received, withdrawn)
+RUNNING_BALANCES = {
+    'owner_id': {
+        'total_balance_in_pallets': ('pallets_received', 'pallets_withdrawn'),
+        'total_balance_in_kilos': ('kilos_received', 'kilos_withdrawn'),
+    },
+    'warehouse': {
+        'overall_pallets': ('pallets_received', 'pallets_withdrawn'),
+        'overall_kilos': ('kilos_received', 'kilos_withdrawn'),
+    },
+}
 
 
 class pallet_kilos_record_model(models.Model):
@@ -25,11 +48,229 @@ class pallet_kilos_record_model(models.Model):
 
     @api.model
     def _max_pallets(self):
-        return self.env['x_inventory_static_var'].search(['&', ('x_studio_use_case', '=', 'XLSX Variables'), ('x_name', 'ilike', 'Max Pallets')], limit=1)
+        return self.env['pallet_kilos_record_model.warehouse_capacity'].get_capacity_variable('pallets')
     @api.model
     def _max_kg(self):
-        return self.env['x_inventory_static_var'].search(['&', ('x_studio_use_case', '=', 'XLSX Variables'), ('x_name', 'ilike', 'Max Kilograms')], limit=1)
+        return self.env['pallet_kilos_record_model.warehouse_capacity'].get_capacity_variable('kilos')
         
     max_pallets = fields.Many2one('x_inventory_static_var', 'Max Pallets', default=_max_pallets)
-    max_pallets = fields.Many2one('x_inventory_static_var', 'Max Kilograms', default=_max_kg)
+    max_kg = fields.Many2one('x_inventory_static_var', 'Max Kilograms', default=_max_kg)
+
+    def init(self):
+        # reports and recomputations read the ledger by owner or warehouse on a period
+        create_index(self.env.cr, 'pallet_kilos_record_model_owner_create_date_index', self._table, ['owner_id', 'create_date'])
+        create_index(self.env.cr, 'pallet_kilos_record_model_warehouse_create_date_index', self._table, ['warehouse', 'create_date'])
+        # and on a period only, for all owners and warehouses
+        create_index(self.env.cr, 'pallet_kilos_record_model_create_date_index', self._table, ['create_date'])
+
+    def _get_daily_balance_keys(self):
+        """Keys of the daily balances the records are aggregated in."""
+        return {
+            (record.warehouse.id or 0, record.owner_id.id or 0, (record.create_date + REPORT_UTC_OFFSET).date())
+            for record in self
+        }
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env['pallet_kilos_record_model.daily_balance']._refresh_daily_balances(records._get_daily_balance_keys())
+        return records
+
+    def write(self, vals):
+        if not DAILY_BALANCE_FIELDS.intersection(vals):
+            return super().write(vals)
+        keys = self._get_daily_balance_keys()
+        result = super().write(vals)
+        self.env['pallet_kilos_record_model.daily_balance']._refresh_daily_balances(keys | self._get_daily_balance_keys())
+        return result
+
+    def unlink(self):
+        keys = self._get_daily_balance_keys()
+        result = super().unlink()
+        self.env['pallet_kilos_record_model.daily_balance']._refresh_daily_balances(keys)
+        return result
+
+    def _recompute_running_balance(self, partition, balances, date_from=None, partition_ids=None):
+        """Rewrite the ``balances`` (see ``RUNNING_BALANCES``) of the records of
+        each ``partition`` value created from ``date_from``, in one window
+        function pass. They start from the balances of the last record before
+        ``date_from`` in the partition, or 0. Records without a partition value
+        are left alone, and only the records whose balances change are written.
+
+        :return: ids of the written records
+        """
+        table = SQL.identifier(self._table)
+        column = SQL.identifier(partition)
+        tail = SQL('%s IS NOT NULL', column)
+        if date_from:
+            tail = SQL('%s AND create_date >= %s', tail, date_from)
+        if partition_ids is not None:
+            tail = SQL('%s AND %s = ANY(%s)', tail, column, list(partition_ids))
+        previous = SQL('FALSE')
+        if date_from:
+            previous = SQL('%s = tail_partition.partition_id AND create_date < %s', column, date_from)
+        new_values = {
+            name: SQL('COALESCE(anchor.%s, 0) + tail.%s', SQL.identifier(name), SQL.identifier(name))
+            for name in balances
+        }
+        self.env.cr.execute(SQL(
+            """
+            WITH tail AS (
+                SELECT id, %(column)s AS partition_id, %(running)s
+                  FROM %(table)s
+                 WHERE %(tail)s
+                WINDOW w AS (PARTITION BY %(column)s ORDER BY create_date, id ROWS UNBOUNDED PRECEDING)
+            ), anchor AS (
+                SELECT tail_partition.partition_id, last_line.*
+                  FROM (SELECT DISTINCT partition_id FROM tail) tail_partition
+                  JOIN LATERAL (
+                      SELECT %(balances)s
+                        FROM %(table)s
+                       WHERE %(previous)s
+                       ORDER BY create_date DESC, id DESC
+                       LIMIT 1
+                  ) last_line ON TRUE
+            )
+            UPDATE %(table)s line
+               SET %(assignments)s, write_uid = %(uid)s, write_date = now() at time zone 'UTC'
+              FROM tail
+              LEFT JOIN anchor ON anchor.partition_id = tail.partition_id
+             WHERE line.id = tail.id AND (%(changed)s)
+            RETURNING line.id
+            """,
+            column=column,
+            table=table,
+            tail=tail,
+            previous=previous,
+            uid=self.env.uid,
+            balances=SQL(', ').join(SQL.identifier(name) for name in balances),
+            running=SQL(', ').join(
+                SQL('SUM(COALESCE(%s, 0) - COALESCE(%s, 0)) OVER w AS %s',
+                    SQL.identifier(received), SQL.identifier(withdrawn), SQL.identifier(name))
+                for name, (received, withdrawn) in balances.items()
+            ),
+            assignments=SQL(', ').join(
+                SQL('%s = %s', SQL.identifier(name), value) for name, value in new_values.items()
+            ),
+            changed=SQL(' OR ').join(
+                SQL('line.%s IS DISTINCT FROM %s', SQL.identifier(name), value) for name, value in new_values.items()
+            ),
+        ))
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    @api.model
+    def recompute_running_balances(self, date_from=None, owner_ids=None, warehouse_ids=None):
+        """Rebuild the owner balances (total_balance_in_*) and the warehouse
+        balances (overall_*) of the records created from ``date_from``, after
+        a backdated, corrected or deleted record, or an import.
+
+        :param date_from: earliest create_date to recompute, all by default
+        :param owner_ids: owners to recompute, all by default
+        :param warehouse_ids: warehouses to recompute, all by default
+        :return: number of records whose balances changed
+        """
+        self.check_access_rights('write')
+        self.flush_model()
+        partitions = {'owner_id': owner_ids, 'warehouse': warehouse_ids}
+        written_ids = set()
+        for partition, balances in RUNNING_BALANCES.items():
+            written_ids.update(self._recompute_running_balance(partition, balances, date_from, partitions[partition]))
+        written = self.browse(written_ids)
+        written.invalidate_recordset(list(DAILY_BALANCE_FIELDS - {'owner_id', 'warehouse', 'create_date'}) + ['write_uid', 'write_date'])
+        self.env['pallet_kilos_record_model.daily_balance']._refresh_daily_balances(written._get_daily_balance_keys())
+        return len(written)
+
+    def action_recompute_running_balances(self):
+        """Recompute the balances of the owners and warehouses of the records,
+        from the earliest of them."""
+        if not self:
+            return 0
+        return self.recompute_running_balances(
+            date_from=min(self.mapped('create_date')),
+            owner_ids=self.owner_id.ids,
+            warehouse_ids=self.warehouse.ids,
+        )
+
+    @api.model
+    def create_from_pickings(self, pickings):
+        """Create the ledger records of done receipts and deliveries in bulk.
+
+        The pallets (distinct packages) and kilos (quantity times product
+        weight) of each picking are summed from its move lines in one query,
+        and the records are created at once, dated when their picking was
+        validated, owned by the picking owner or else its partner. Pickings
+        that already have a record are skipped, so this can be run again on
+        the same pickings. The running balances are then recomputed from the
+        earliest new record.
 
+        :param pickings: ``stock.picking`` recordset
+        :return: the created records
+        """
+        if not pickings:
+            return self.browse()
+        self.env['stock.picking'].flush_model()
+        self.env['stock.move.line'].flush_model()
+        self.flush_model(['record_reference'])
+        # serialize concurrent ingestions of the same pickings
+        self.env.cr.execute(SQL(
+            'SELECT id FROM stock_picking WHERE id = ANY(%s) ORDER BY id FOR UPDATE', list(pickings.ids),
+        ))
+        self.env.cr.execute(SQL(
+            """
+            SELECT picking.id, picking.name, picking.date_done,
+                   COALESCE(picking.owner_id, picking.partner_id) AS owner_id,
+                   picking_type.warehouse_id, picking_type.code,
+                   COUNT(DISTINCT CASE WHEN picking_type.code = 'incoming'
+                                       THEN move_line.result_package_id ELSE move_line.package_id END) AS pallets,
+                   COALESCE(SUM(move_line.quantity_product_uom * product.weight), 0) AS kilos
+              FROM stock_picking picking
+              JOIN stock_picking_type picking_type ON picking_type.id = picking.picking_type_id
+              LEFT JOIN stock_move_line move_line ON move_line.picking_id = picking.id
+              LEFT JOIN product_product product ON product.id = move_line.product_id
+             WHERE picking.id = ANY(%s)
+               AND picking.state = 'done'
+               AND picking_type.code IN ('incoming', 'outgoing')
+               AND NOT EXISTS (SELECT 1 FROM %s line WHERE line.record_reference = picking.id)
+             GROUP BY picking.id, picking_type.id
+             ORDER BY picking.date_done, picking.id
+            """,
+            list(pickings.ids), SQL.identifier(self._table),
+        ))
+        rows = self.env.cr.dictfetchall()
+        if not rows:
+            return self.browse()
+        vals_list = []
+        for row in rows:
+            incoming = row['code'] == 'incoming'
+            vals_list.append({
+                'report_no': row['name'],
+                'record_reference': row['id'],
+                'owner_id': row['owner_id'],
+                'warehouse': row['warehouse_id'],
+                'pallets_received': row['pallets'] if incoming else 0,
+                'pallets_withdrawn': 0 if incoming else row['pallets'],
+                'kilos_received': row['kilos'] if incoming else 0,
+                'kilos_withdrawn': 0 if incoming else row['kilos'],
+            })
+        records = self.create(vals_list)
+        keys = records._get_daily_balance_keys()
+        # date the records when their picking was done, like manual entries
+        self.flush_model()
+        self.env.cr.execute(SQL(
+            """
+            UPDATE %s line SET create_date = picking.date_done
+              FROM stock_picking picking
+             WHERE picking.id = line.record_reference AND line.id = ANY(%s)
+            """,
+            SQL.identifier(self._table), records.ids,
+        ))
+        records.invalidate_recordset(['create_date'])
+        self.env['pallet_kilos_record_model.daily_balance']._refresh_daily_balances(
+            keys | records._get_daily_balance_keys()
+        )
+        self.recompute_running_balances(
+            date_from=min(row['date_done'] for row in rows),
+            owner_ids=records.owner_id.ids,
+            warehouse_ids=records.warehouse.ids,
+        )
+        return records
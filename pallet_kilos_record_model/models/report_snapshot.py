@@ -0,0 +1,166 @@
+import datetime
+import logging
+import threading
+
+from odoo import models, fields, api
+from odoo.osv import expression
+
+from odoo.addons.report_xlsx.report.report_abstract_xlsx import RecordStream
+
+from ..tools.report_time import REPORT_UTC_OFFSET
+
+_logger = logging.getLogger(__name__)
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# Report data a snapshot can be served for: the records and their period
+SNAPSHOT_DATA_KEYS = {'context', 'report_xlsx_domain', 'date_from', 'date_to'}
+
+
+class ReportSnapshot(models.Model):
+    """Workbook pre-rendered overnight for the records of one owner or warehouse
+    created before ``cutoff``. Downloads asking for exactly these records over
+    the same period, still unchanged, get the stored file instead of a new
+    rendering, whether they select the records or print them from the wizard."""
+    _name = 'pallet_kilos_record_model.report_snapshot'
+    _description = 'Pre-rendered Pallet/Kilos XLSX Report'
+    _order = 'cutoff desc'
+
+    report_id = fields.Many2one('ir.actions.report', required=True, ondelete='cascade', index=True)
+    scope_field = fields.Char(required=True, help="Field of the records grouped in this snapshot, e.g. owner_id.")
+    scope_id = fields.Integer(required=True, help="Value of the scope field of the records.")
+    cutoff = fields.Datetime(required=True, help="The snapshot covers the records created before this date.")
+    record_count = fields.Integer()
+    fingerprint = fields.Char(help="Data fingerprint of the report when it was rendered.")
+    period_from = fields.Date(help="First day of the period printed, if the report prints one.")
+    period_to = fields.Date(help="Last day of the period printed, if the report prints one.")
+    attachment_id = fields.Many2one('ir.attachment', ondelete='set null')
+
+    _sql_constraints = [
+        ('scope_uniq', 'unique(report_id, scope_field, scope_id)', 'One snapshot per report and scope.'),
+    ]
+
+    @api.model
+    def _get_snapshot_cutoff(self):
+        """Start of the current day in the time of the reports: snapshots cover
+        yesterday and before."""
+        local_now = fields.Datetime.now() + REPORT_UTC_OFFSET
+        return datetime.datetime.combine(local_now.date(), datetime.time.min) - REPORT_UTC_OFFSET
+
+    @api.model
+    def _find_snapshot(self, report_model, records, data):
+        """Snapshot of ``report_model`` that can be served for ``records``, a
+        recordset or a ``RecordStream`` of the wizard and domain prints.
+
+        They must be exactly the records of its scope created before its cutoff,
+        printed on the period it was rendered on, and their report fingerprint
+        must not have changed since. Reports with other options are always
+        rendered.
+        """
+        scope_field = report_model._get_snapshot_scope_field()
+        if not scope_field or set(data or {}) - SNAPSHOT_DATA_KEYS:
+            return self.browse()
+        if isinstance(records, RecordStream):
+            Records, domain = records.model, records.domain
+        elif isinstance(records, models.BaseModel) and records:
+            Records, domain = records.browse(), [('id', 'in', records.ids)]
+        else:
+            return self.browse()
+        groups = Records.read_group(domain, [scope_field], [scope_field])
+        if len(groups) != 1 or not groups[0][scope_field]:
+            return self.browse()
+        scope_id = groups[0][scope_field][0]
+        count = groups[0]['%s_count' % scope_field]
+        snapshot = self.sudo().search([
+            ('report_id.report_name', '=', report_model._name[len('report.'):]),
+            ('scope_field', '=', scope_field),
+            ('scope_id', '=', scope_id),
+        ], limit=1)
+        if not snapshot.attachment_id or count != snapshot.record_count:
+            return self.browse()
+        # same number of records as the snapshot, all in its scope and before its cutoff
+        if Records.search_count(expression.AND([domain, [('create_date', '<', snapshot.cutoff)]])) != count:
+            return self.browse()
+        if Records.search_count([(scope_field, '=', scope_id), ('create_date', '<', snapshot.cutoff)]) != count:
+            return self.browse()
+        if isinstance(records, RecordStream):
+            records = Records.search(domain)
+        if report_model._get_snapshot_period(records, data or {}) != (snapshot.period_from, snapshot.period_to):
+            return self.browse()
+        if str(report_model._get_report_fingerprint(records, data)) != snapshot.fingerprint:
+            return self.browse()
+        return snapshot
+
+    @api.model
+    def _get_snapshot_reports(self):
+        """XLSX reports that are pre-rendered, with their scope field."""
+        reports = self.env['ir.actions.report'].search([('report_type', '=', 'xlsx')])
+        result = []
+        for report in reports:
+            report_model = self.env.get('report.%s' % report.report_name)
+            if report_model is None or not hasattr(report_model, '_get_snapshot_scope_field'):
+                continue
+            scope_field = report_model.with_context(active_model=report.model)._get_snapshot_scope_field()
+            if scope_field:
+                result.append((report, scope_field))
+        return result
+
+    @api.model
+    def _cron_render_snapshots(self):
+        """Render the reports of each owner or warehouse up to the start of the
+        day. Snapshots whose records did not change only get their cutoff moved."""
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        cutoff = self._get_snapshot_cutoff()
+        for report, scope_field in self._get_snapshot_reports():
+            Records = self.env[report.model]
+            report_model = self.env['report.%s' % report.report_name].with_context(active_model=report.model)
+            groups = Records.read_group(
+                [('create_date', '<', cutoff), (scope_field, '!=', False)], [scope_field], [scope_field],
+            )
+            for group in groups:
+                scope_id = group[scope_field][0]
+                try:
+                    self._render_snapshot(report, report_model, scope_field, scope_id, cutoff)
+                except Exception:
+                    _logger.exception('Snapshot of report %s for %s %s failed', report.report_name, scope_field, scope_id)
+                    if auto_commit:
+                        self.env.cr.rollback()
+                    continue
+                if auto_commit:
+                    self.env.cr.commit()
+
+    def _render_snapshot(self, report, report_model, scope_field, scope_id, cutoff):
+        records = self.env[report.model].search([(scope_field, '=', scope_id), ('create_date', '<', cutoff)])
+        data = report_model._get_snapshot_data(cutoff)
+        fingerprint = str(report_model._get_report_fingerprint(records, data))
+        period_from, period_to = report_model._get_snapshot_period(records, data)
+        snapshot = self.search([
+            ('report_id', '=', report.id), ('scope_field', '=', scope_field), ('scope_id', '=', scope_id),
+        ])
+        values = {
+            'cutoff': cutoff, 'record_count': len(records), 'fingerprint': fingerprint,
+            'period_from': period_from, 'period_to': period_to,
+        }
+        if (snapshot and snapshot.fingerprint == fingerprint and snapshot.record_count == len(records)
+                and (snapshot.period_from, snapshot.period_to) == (period_from, period_to)):
+            snapshot.write(values)
+            return snapshot
+        content = self.env['ir.actions.report'].with_context(
+            report_xlsx_save_attachment=False, pallet_kilos_snapshot_refresh=True,
+        )._render_xlsx(report.report_name, records.ids, data)[0]
+        if not snapshot:
+            snapshot = self.create(dict(values, report_id=report.id, scope_field=scope_field, scope_id=scope_id))
+        else:
+            snapshot.attachment_id.unlink()
+            snapshot.write(values)
+        snapshot.attachment_id = self.env['ir.attachment'].create({
+            'name': report._get_xlsx_filename(records.ids),
+            'raw': content,
+            'res_model': self._name,
+            'res_id': snapshot.id,
+            'mimetype': XLSX_MIMETYPE,
+        })
+        return snapshot
+
+    def unlink(self):
+        self.attachment_id.unlink()
+        return super().unlink()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, api, tools
+from odoo.exceptions import UserError
+
+CAPACITY_MODEL = 'x_inventory_static_var'
+# Capacity variables (x_inventory_static_var.x_name) by key
+CAPACITY_VARIABLES = {
+    'pallets': 'Max Pallets',
+    'kilos': 'Max Kilograms (KG)',
+}
+
+
+class WarehouseCapacity(models.AbstractModel):
+    _name = 'pallet_kilos_record_model.warehouse_capacity'
+    _description = 'Warehouse Capacity Variables'
+
+    @api.model
+    @tools.ormcache('warehouse_id')
+    def _get_capacity_variables(self, warehouse_id):
+        """Capacity variables of a warehouse, or of any warehouse when
+        ``warehouse_id`` is None, as ``{key: (variable id, value)}``. Cached
+        until the variables change, see ``IrModel._instanciate``."""
+        domain = [('x_studio_use_case', '=', 'XLSX Variables'), ('x_name', 'in', list(CAPACITY_VARIABLES.values()))]
+        if warehouse_id is not None:
+            domain.append(('x_studio_warehouse', '=', warehouse_id))
+        variables = {}
+        for variable in self.env[CAPACITY_MODEL].sudo().search(domain, order='id'):
+            variables.setdefault(variable.x_name, (variable.id, variable.x_studio_float_value))
+        return tools.frozendict({
+            key: variables[name] for key, name in CAPACITY_VARIABLES.items() if name in variables
+        })
+
+    @api.model
+    def get_capacity_variable(self, key, warehouse_id=None):
+        """Capacity variable record of a warehouse, empty when not set up."""
+        variable_id = self._get_capacity_variables(warehouse_id).get(key, (None, None))[0]
+        return self.env[CAPACITY_MODEL].browse(variable_id)
+
+    @api.model
+    def get_capacities(self, warehouse_id):
+        """Capacity values of a warehouse by key, None when not set up."""
+        variables = self._get_capacity_variables(warehouse_id)
+        return {key: variables[key][1] if key in variables else None for key in CAPACITY_VARIABLES}
+
+    @api.model
+    def check_capacities(self, warehouse):
+        """Capacity values of ``warehouse`` by key, raise when one of them is
+        not set up, as capacity rates are computed against them."""
+        capacities = self.get_capacities(warehouse.id)
+        missing = [CAPACITY_VARIABLES[key] for key, value in capacities.items() if not value]
+        if missing:
+            raise UserError(
+                "The capacity of warehouse %s is not set up: add the %s variables (XLSX Variables use case)."
+                % (warehouse.display_name, ', '.join(missing))
+            )
+        return capacities
+
+
+class IrModel(models.Model):
+    _inherit = 'ir.model'
+
+    def _instanciate(self, model_data):
+        """The capacity variables are a Studio model, without Python class to
+        extend: add the invalidation of the capacity cache to its class."""
+        model_class = super()._instanciate(model_data)
+        if model_data['model'] != CAPACITY_MODEL:
+            return model_class
+
+        class CapacityVariable(model_class):
+
+            def _clear_capacity_cache(self):
+                """Drop the cached capacities of the warehouses of the
+                variables, and of any warehouse, when capacity variables are
+                among them: only ``_get_capacity_variables`` is cleared here,
+                other workers clear their cache at the end of the request."""
+                variables = self.sudo().filtered(lambda variable: variable.x_name in CAPACITY_VARIABLES.values())
+                if not variables:
+                    return
+                capacity = self.env['pallet_kilos_record_model.warehouse_capacity']
+                cache, key, _counter = type(capacity)._get_capacity_variables.__cache__.lru(capacity)
+                for warehouse_id in set(variables.x_studio_warehouse.ids) | {None}:
+                    try:
+                        cache.pop(key + (warehouse_id,))
+                    except KeyError:
+                        pass
+                self.env.registry.cache_invalidated.add('default')
+
+            @api.model_create_multi
+            def create(self, vals_list):
+                records = super().create(vals_list)
+                records._clear_capacity_cache()
+                return records
+
+            def write(self, vals):
+                self._clear_capacity_cache()
+                result = super().write(vals)
+                self._clear_capacity_cache()
+                return result
+
+            def unlink(self):
+                self._clear_capacity_cache()
+                return super().unlink()
+
+        return CapacityVariable
@@ -1,2 +1,3 @@
+from . import report_abstract_xlsx
 from . import pallet_kilos_xlsx
-from . import daily_inventory_xlsx
\ No newline at end of file
+from . import daily_inventory_xlsx
@@ -1,258 +1,279 @@
-from odoo import models
 import datetime
+
+from odoo import models
+from operator import itemgetter
 from xlsxwriter.workbook import Workbook
 import logging
 from odoo.exceptions import ValidationError, UserError
+from odoo.tools import SQL
+
+from odoo.addons.report_xlsx.report.report_abstract_xlsx import RecordStream, XlsxColumn
+
+from ..tools.report_time import REPORT_UTC_OFFSET
+from ..tools.daily_series import ONE_DAY, add_rolling_stats, aggregate_days, carry_forward, fill_days
+
 _logger = logging.getLogger(__name__)
 
+DAILY_SUM_KEYS = ('pallets_received', 'pallets_withdrawn', 'kilos_received', 'kilos_withdrawn')
+DAILY_BALANCE_KEYS = ('overall_pallets', 'overall_kilos')
+# Day windows of the rolling capacity sheet, see _get_rolling_windows
+ROLLING_WINDOWS = (7, 30, 90)
+
 class DailyInventoryXlsx(models.AbstractModel):
     _name = 'report.pallet_kilos_record_model.daily_inventory_report_xlsx'
-    _inherit = 'report.report_xlsx.abstract'
+    _inherit = 'report.pallet_kilos_record_model.abstract_xlsx'
+
+    def is_streaming_report(self):
+        """Rows are written top to bottom, so the report can run in constant memory."""
+        return True
+
+    def is_cacheable_report(self):
+        return True
+
+    def is_replica_report(self):
+        return True
+
+    def _get_snapshot_scope_field(self):
+        return 'warehouse'
+
+    def _get_report_fingerprint(self, objs, data):
+        """Warehouse names and the capacity variables are printed too. Read in
+        SQL, without loading the records."""
+        if not objs:
+            return None
+        objs.flush_model(['warehouse'])
+        self.env['stock.warehouse'].flush_model(['write_date'])
+        self.env.cr.execute(SQL(
+            """
+            SELECT COALESCE(array_agg(DISTINCT warehouse.id), '{}'), MAX(warehouse.write_date)
+              FROM %s line
+              JOIN stock_warehouse warehouse ON warehouse.id = line.warehouse
+             WHERE line.id = ANY(%s)
+            """,
+            SQL.identifier(objs._table), objs.ids,
+        ))
+        warehouse_ids, last_write_date = self.env.cr.fetchone()
+        capacity = self.env['pallet_kilos_record_model.warehouse_capacity']
+        return (
+            super()._get_report_fingerprint(objs, data),
+            last_write_date,
+            [(warehouse_id, sorted(capacity.get_capacities(warehouse_id).items())) for warehouse_id in sorted(warehouse_ids)],
+        )
+
+    def _get_report_fields(self):
+        return [
+            'create_date', 'warehouse', 'warehouse.name', 'owner_id', 'report_no',
+            'pallets_received', 'pallets_withdrawn', 'overall_pallets',
+            'kilos_received', 'kilos_withdrawn', 'overall_kilos',
+        ]
 
     @staticmethod
-    def generate_header(sheet, sorted_lines, formats):
-        sheet.write(0, 0, 'DAILY VIFEL INVENTORY', formats[0])
-        sheet.write(1, 0, 'Warehouse: ' + sorted_lines[0].warehouse.name, formats[0])
+    def generate_header(sheet, warehouse_name, formats):
+        sheet.write(0, 0, 'DAILY VIFEL INVENTORY', formats['header'])
+        sheet.write(1, 0, 'Warehouse: ' + warehouse_name, formats['header'])
         # Add table header
 
+    def _get_table_columns(self):
+        """Columns of the daily warehouse table."""
+        return [
+            XlsxColumn('Date', 'create_date', 'date', width=21.5),
+            XlsxColumn('Pallets Received', 'pallets_received', 'float', 'sum', 21.5),
+            XlsxColumn('Pallets Withdrawn', 'pallets_withdrawn', 'float', 'sum', 21.5),
+            XlsxColumn('Balance in Pallets', 'overall_pallets', 'float', width=21.5),
+            XlsxColumn('Kilos Received', 'kilos_received', 'float', 'sum', 21.5),
+            XlsxColumn('Kilos Withdrawn', 'kilos_withdrawn', 'float', 'sum', 21.5),
+            XlsxColumn('Balance in Kilos', 'overall_kilos', 'float', width=21.5),
+            XlsxColumn('Average Pallets', 'average_pallets', 'float', width=21.5),
+            XlsxColumn('Capacity Rate (Pallets)', 'capacity_rate_pallets', 'percent', width=21.5),
+            XlsxColumn('Average Kilos', 'average_kilos', 'float', width=21.5),
+            XlsxColumn('Capacity Rate (Kilos)', 'capacity_rate_kilos', 'percent', width=21.5),
+        ]
+
     @staticmethod
-    def generateTableHeader(sheet, row_index, format):
-        tableHeaders = [
-            'Date', 'Pallets Received', 'Pallets Withdrawn', 'Balance in Pallets', 
-            'Kilos Received', 'Kilos Withdrawn', 'Balance in Kilos', 
-            'Average Pallets', 'Capacity Rate (Pallets)', 
-            'Average Kilos', 'Capacity Rate (Kilos)'
+    def _iter_table_rows(daily_lines, max_pallets, max_kg):
+        """Add the running averages and capacity rates to the daily lines,
+        against the ``max_pallets`` and ``max_kg`` capacity values."""
+        total_pallets = total_kilos = 0
+        for day_index, line in enumerate(daily_lines, start=1):
+            total_pallets += line['overall_pallets']
+            total_kilos += line['overall_kilos']
+            average_pallets = total_pallets / day_index
+            average_kilos = total_kilos / day_index
+            yield dict(
+                line,
+                average_pallets=average_pallets,
+                average_kilos=average_kilos,
+                capacity_rate_pallets=average_pallets / max_pallets,
+                capacity_rate_kilos=average_kilos / max_kg,
+            )
+
+    def _get_rolling_windows(self, data):
+        """Day windows of the rolling averages and peaks, ``rolling_windows``
+        in the report data or 7, 30 and 90 days."""
+        return tuple((data or {}).get('rolling_windows') or ROLLING_WINDOWS)
+
+    def _get_rolling_columns(self, windows):
+        """Columns of the rolling capacity table, see ``add_rolling_stats``."""
+        def value(key):
+            return lambda row: row.get(key)
+
+        columns = [
+            XlsxColumn('Date', 'day', 'date', width=21.5),
+            XlsxColumn('Balance in Pallets', 'overall_pallets', 'float', width=21.5),
+            XlsxColumn('Balance in Kilos', 'overall_kilos', 'float', width=21.5),
         ]
-        
-        col_index = 0
-        for headerText in tableHeaders:
-            sheet.write(row_index, col_index, headerText, format)
-            col_index += 1
+        for key, unit in [('overall_pallets', 'Pallets'), ('overall_kilos', 'Kilos')]:
+            for window in windows:
+                columns += [
+                    XlsxColumn('%d-Day Average %s' % (window, unit), value('%s_avg_%d' % (key, window)), 'float', width=21.5),
+                    XlsxColumn('%d-Day Capacity Rate (%s)' % (window, unit), value('%s_avg_rate_%d' % (key, window)), 'percent', width=21.5),
+                    XlsxColumn('%d-Day Peak Rate (%s)' % (window, unit), value('%s_peak_rate_%d' % (key, window)), 'percent', width=21.5),
+                ]
+        return columns
+
+    def generate_rolling_sheet(self, workbook, warehouse_name, daily_lines, max_pallets, max_kg, windows):
+        """Companion sheet of a warehouse: rolling averages and peaks of its
+        balances against its capacity, and its highest balances."""
+        formats = self._get_formats(workbook)
+        capacities = {
+            'overall_pallets': max_pallets,
+            'overall_kilos': max_kg,
+        }
+        rows = add_rolling_stats([dict(line) for line in daily_lines], list(capacities), windows, capacities)
+        sheet = workbook.add_worksheet('Rolling ' + warehouse_name)
+        sheet.write(0, 0, 'ROLLING CAPACITY', formats['header'])
+        sheet.write(1, 0, 'Warehouse: ' + warehouse_name, formats['header'])
+        for row_index, (key, label) in enumerate([('overall_pallets', 'Peak Pallets'), ('overall_kilos', 'Peak Kilos')], start=2):
+            peak = max(rows, key=itemgetter(key), default=None)
+            if peak is None:
+                continue
+            sheet.write(row_index, 0, label, formats['header'])
+            sheet.write(row_index, 1, peak[key], formats['float'])
+            if capacities[key]:
+                sheet.write(row_index, 2, peak[key] / capacities[key], formats['percent'])
+            sheet.write(row_index, 3, peak['day'], formats['date'])
+        self._write_table(
+            workbook, sheet, self._get_rolling_columns(windows), rows,
+            first_row=5, header_format='table_header',
+        )
 
     @staticmethod
-    def fill_missing_dates(arr):
-        """
-        Fills missing dates in an array of date-balance dictionaries and retains balance.
-        
-        Args:
-            arr (list): A list of dictionaries or model instances with 'create_date' (string in YYYY-MM-DD HH:MM:SS format)
-                        and 'balance' keys.
-        
-        Returns:
-            list: A new list with dictionaries for each date, including missing dates,
-                  with balance carried forward from the last recorded date.
-        """
-        
-        # Convert model instances to dictionaries if needed
-        def to_dict(item):
-            if isinstance(item, dict):
-                return item
-            else:
-                return {
-                    'create_date': item.create_date,
-                    'overall_pallets': item.overall_pallets,
-                    'overall_kilos': item.overall_kilos,
-                    'pallets_withdrawn': item.pallets_withdrawn,
-                    'pallets_received': item.pallets_received,
-                    'kilos_received': item.kilos_received,
-                    'kilos_withdrawn': item.kilos_withdrawn,
-                    'report_no': item.report_no,
-                    'owner_id': item.owner_id.name
-                    # Add other attributes as needed
-                }
-        
-        arr = [to_dict(item) for item in arr]
-        
-        # Sort the array by create_date
-        sorted_lines = sorted(arr, key=lambda x: x['create_date'])
+    def _fill_daily_lines(days):
+        """Carry the closing balances forward over the days without lines."""
+        fill = carry_forward(DAILY_BALANCE_KEYS, DAILY_SUM_KEYS, defaults={'report_no': '', 'owner_id': ''})
+        for row in fill_days(days, fill):
+            row['create_date'] = row['day']
+            yield row
 
-        for line in sorted_lines:
-            line['create_date'] += datetime.timedelta(hours=8)
-        
-        # Get the start and end dates
-        start_date_str = sorted_lines[0]['create_date']
-        end_date_str = sorted_lines[-1]['create_date']
-        
-        # Convert start_date_str and end_date_str to datetime.date objects if they are strings
-        if isinstance(start_date_str, str):
-            start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d %H:%M:%S').date()
-        else:
-            start_date = start_date_str.date()
-        
-        if isinstance(end_date_str, str):
-            end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d %H:%M:%S').date()
+    @classmethod
+    def _iter_daily_lines(cls, lines):
+        """One row per day (in UTC+8) from the first line to the last: the sums
+        of the moves and the closing warehouse balances, carried forward over
+        the days without lines. ``lines`` must be sorted by create_date."""
+        days = aggregate_days(
+            lines, 'create_date', REPORT_UTC_OFFSET,
+            sum_keys=DAILY_SUM_KEYS, last_keys=DAILY_BALANCE_KEYS, first_keys=('report_no', 'owner_id'),
+        )
+        return cls._fill_daily_lines(days)
+
+    @classmethod
+    def _iter_balance_days(cls, balances):
+        """Same rows as ``_iter_daily_lines``, from the daily balances of one
+        warehouse (one per owner and day): the closing warehouse balances are
+        those of the owner with the last record of the day."""
+        balances = sorted(balances, key=itemgetter('day', 'last_date'))
+        lines = (
+            dict(
+                {key: balance[key] for key in DAILY_SUM_KEYS},
+                day=balance['day'],
+                overall_pallets=balance['warehouse_balance_pallets'],
+                overall_kilos=balance['warehouse_balance_kilos'],
+            )
+            for balance in balances
+        )
+        days = aggregate_days(lines, 'day', sum_keys=DAILY_SUM_KEYS, last_keys=DAILY_BALANCE_KEYS)
+        return cls._fill_daily_lines(days)
+
+    def _get_warehouse_periods(self, lines):
+        """``{warehouse id: (first day, last day)}`` when ``lines`` are all the
+        records of their warehouses over whole days, as printed from the wizard
+        by warehouse and period or pre-rendered by warehouse, None otherwise."""
+        if isinstance(lines, RecordStream):
+            Ledger, domain = lines.model, lines.domain
         else:
-            end_date = end_date_str.date()
-        
-        # Create an empty list to store the complete data
-        previous_balance_pallet = None
-        previous_balance_kilos = None
-        complete_data = []
-        
-        current_date = start_date
-        while current_date <= end_date:
-            found_record = False
-            
-            for item in sorted_lines:
-                item_date = item['create_date']
-                if isinstance(item_date, datetime.datetime):
-                    item_date = item_date.date()
-                
-                if item_date == current_date:
-                    # Check if the last entry in complete_data has the same date
-                    if complete_data and complete_data[-1]['create_date'].date() == current_date:
-                        last_entry = complete_data[-1]
-                        last_entry['pallets_received'] += item['pallets_received']
-                        last_entry['pallets_withdrawn'] += item['pallets_withdrawn']
-                        last_entry['kilos_received'] += item['kilos_received']
-                        last_entry['kilos_withdrawn'] += item['kilos_withdrawn']
-                        last_entry['overall_pallets'] = item['overall_pallets']
-                        last_entry['overall_kilos'] = item['overall_kilos']
-                        # You can add more fields to sum if necessary
-                    else:
-                        complete_data.append({
-                            'create_date': item['create_date'],
-                            'overall_pallets': item['overall_pallets'],
-                            'overall_kilos': item['overall_kilos'],
-                            'pallets_received': item['pallets_received'],
-                            'pallets_withdrawn': item['pallets_withdrawn'],
-                            'kilos_received': item['kilos_received'],
-                            'kilos_withdrawn': item['kilos_withdrawn'],
-                            'report_no': item['report_no'],
-                            'owner_id': item['owner_id']
-                        })
+            Ledger, domain = lines.browse(), [('id', 'in', lines.ids)]
+        groups = Ledger.read_group(
+            domain, ['first_date:min(create_date)', 'last_date:max(create_date)'], ['warehouse'],
+        )
+        periods = {}
+        for group in groups:
+            if not group['warehouse']:
+                return None
+            warehouse_id = group['warehouse'][0]
+            first_day = (group['first_date'] + REPORT_UTC_OFFSET).date()
+            last_day = (group['last_date'] + REPORT_UTC_OFFSET).date()
+            start = datetime.datetime.combine(first_day, datetime.time.min) - REPORT_UTC_OFFSET
+            end = datetime.datetime.combine(last_day + ONE_DAY, datetime.time.min) - REPORT_UTC_OFFSET
+            count = Ledger.search_count([
+                ('warehouse', '=', warehouse_id), ('create_date', '>=', start), ('create_date', '<', end),
+            ])
+            if count != group['warehouse_count']:
+                return None
+            periods[warehouse_id] = (first_day, last_day)
+        return periods
 
-                    previous_balance_pallet = item['overall_pallets']
-                    previous_balance_kilos = item['overall_kilos']
-                    found_record = True
-            
-            # If no record found for the current date, use previous_balance
-            if not found_record:
-                if previous_balance_pallet is not None and previous_balance_kilos is not None:
-                    # Create a datetime object with the current date and time from the previous date
-                    previous_date_with_time = datetime.datetime.strptime(current_date.strftime('%Y-%m-%d') + ' 23:59:59', '%Y-%m-%d %H:%M:%S')
-                    # Append the correct format
-                    complete_data.append({
-                        'create_date': previous_date_with_time,
-                        'overall_pallets': previous_balance_pallet,
-                        'overall_kilos': previous_balance_kilos,
-                        'pallets_withdrawn': 0,
-                        'pallets_received': 0,
-                        'kilos_withdrawn': 0,
-                        'kilos_received': 0,
-                        'report_no': '',
-                        'owner_id': ''
-                    })
-                else:
-                    # Handle the case where there's no initial balance
-                    complete_data.append({
-                        'create_date': datetime.datetime.combine(current_date, datetime.time.min),
-                        'overall_pallets': 0,
-                        'overall_kilos': 0,
-                        'pallets_withdrawn': 0,
-                        'pallets_received': 0,
-                        'kilos_withdrawn': 0,
-                        'kilos_received': 0,
-                        'report_no': '',
-                        'owner_id': ''
-                    })
-            
-            # Move to the next day
-            current_date += datetime.timedelta(days=1)
-        
-        return complete_data
+    def _get_daily_lines_by_warehouse(self, lines):
+        """``{warehouse id: (warehouse name, daily lines)}``: read one row per
+        owner and day from the daily balances for whole warehouses and periods,
+        replayed from the ledger records for other selections."""
+        periods = self._get_warehouse_periods(lines)
+        if periods is None:
+            lines_by_warehouse = {}
+            for line in self._iter_report_rows(lines):
+                lines_by_warehouse.setdefault(line['warehouse'], []).append(line)
+            return {
+                warehouse_id: (
+                    warehouse_lines[0]['warehouse.name'],
+                    list(self._iter_daily_lines(sorted(warehouse_lines, key=itemgetter('create_date')))),
+                )
+                for warehouse_id, warehouse_lines in lines_by_warehouse.items()
+            }
+        ledger = lines.model if isinstance(lines, RecordStream) else lines
+        daily_lines = {}
+        for warehouse_id, (first_day, last_day) in periods.items():
+            with self._xlsx_phase('fetch') as stats:
+                balances = ledger.env['pallet_kilos_record_model.daily_balance'].get_daily_balances(
+                    warehouse_ids=[warehouse_id], date_from=first_day, date_to=last_day,
+                )
+                if stats:
+                    stats.rows += len(balances)
+                name = ledger.env['stock.warehouse'].browse(warehouse_id).name
+            daily_lines[warehouse_id] = (name, list(self._iter_balance_days(balances)))
+        return daily_lines
 
     def generate_xlsx_report(self, workbook, data, lines):
-        header_format = workbook.add_format({'font_size': 12, 'align': 'vcenter', 'bold': True, 'text_wrap': True})
-        table_header_format = workbook.add_format({'font_size': 12, 'align': 'vcenter', 'bold': True, 'text_wrap': True, 'border': 1})
-        normal_format = workbook.add_format({'font_size': 12, 'align': 'vcenter'})
-        float_format = workbook.add_format({'font_size': 12, 'align': 'vcenter', 'num_format': '#,##0.00'})
-        float_format_bold = workbook.add_format({'font_size': 12, 'align': 'vcenter', 'num_format': '#,##0.00', 'bold': True})
-        percent_format = workbook.add_format({'font_size': 12, 'align': 'vcenter', 'num_format': '0.00%', 'bold': True})
-        date_format = workbook.add_format({'num_format': 'mm-dd-yyyy'})
+        formats = self._get_formats(workbook)
+        columns = self._get_table_columns()
+        windows = self._get_rolling_windows(data)
         
-        # Initialize a dictionary to hold lists of lines grouped by warehouse name
-        lines_by_warehouse = {}
+        capacity = self.env['pallet_kilos_record_model.warehouse_capacity']
         
-        # Group lines by warehouse name
-        for line in lines:
-            warehouse_name = line.warehouse.name
-            if warehouse_name not in lines_by_warehouse:
-                lines_by_warehouse[warehouse_name] = []
-            lines_by_warehouse[warehouse_name].append(line)
+        daily_lines_by_warehouse = self._get_daily_lines_by_warehouse(lines)
         
-        for warehouse_name, warehouse_lines in lines_by_warehouse.items():
+        # Check every capacity before writing the first sheet
+        capacities = {
+            warehouse_id: capacity.check_capacities(self.env['stock.warehouse'].browse(warehouse_id))
+            for warehouse_id in daily_lines_by_warehouse
+        }
+        
+        for warehouse_id, (warehouse_name, daily_lines) in daily_lines_by_warehouse.items():
             sheet = workbook.add_worksheet(warehouse_name[:31])  # Sheet name cannot exceed 31 characters
-            sheet.set_column(0, 11, 21.5)
-            row_index = 4  # Starting row index
-            
-            sorted_lines = self.fill_missing_dates(warehouse_lines)
-            self.generate_header(sheet, warehouse_lines, [header_format, normal_format])
-            self.generateTableHeader(sheet, row_index-2, table_header_format)
-            
-            summation = {'total_pallets_received': 0, 'total_pallets_withdrawn': 0, 'total_kilos_received': 0, 'total_kilos_withdrawn': 0}
-            
-            total_pallets = 0
-            total_kilos = 0
-            variables = self.env['x_inventory_static_var'].search(
-                ['&', ('x_studio_use_case', '=', 'XLSX Variables'), ('x_name', 'in', ['Max Kilograms (KG)', 'Max Pallets']), ('x_studio_warehouse.name', '=', lines[0].warehouse.name)]
-            )
-    
-            max_kg = None
-            max_pallets = None
-            for var in variables:
-                if var.x_name == 'Max Kilograms (KG)':
-                    max_kg = var
-                elif var.x_name == 'Max Pallets':
-                    max_pallets = var
-
+            self.generate_header(sheet, warehouse_name, formats)
+            max_pallets = capacities[warehouse_id]['pallets']
+            max_kg = capacities[warehouse_id]['kilos']
 
-            total_pallets = total_kilos = 0
-    
-            for day_index, line in enumerate(sorted_lines, start=1):
-                total_pallets += line['overall_pallets']
-                total_kilos += line['overall_kilos']
-                average_pallets = total_pallets / day_index
-                average_kilos = total_kilos / day_index
-                
-                capacity_rate_pallets = (average_pallets / max_pallets.x_studio_float_value) * 100
-                capacity_rate_kilos = (average_kilos / max_kg.x_studio_float_value) * 100
-                
-                # Apply rounding rules for pallets capacity rate
-                # if capacity_rate_pallets - int(capacity_rate_pallets) >= 0.5:
-                #     capacity_rate_pallets = round(capacity_rate_pallets, 0)
-                # else:
-                #     capacity_rate_pallets = round(capacity_rate_pallets, 0)
-
-                # # Apply rounding rules for kilos capacity rate
-                # if capacity_rate_kilos - int(capacity_rate_kilos) >= 0.5:
-                #     capacity_rate_kilos = round(capacity_rate_kilos, 0)
-                # else:
-                #     capacity_rate_kilos = round(capacity_rate_kilos, 0)
-                    
-                sheet.write(row_index, 0, line['create_date'], date_format)
-                sheet.write(row_index, 1, line['pallets_received'], float_format)
-                sheet.write(row_index, 2, line['pallets_withdrawn'], float_format)
-                sheet.write(row_index, 3, line['overall_pallets'], float_format)
-                sheet.write(row_index, 4, line['kilos_received'], float_format)
-                sheet.write(row_index, 5, line['kilos_withdrawn'], float_format)
-                sheet.write(row_index, 6, line['overall_kilos'], float_format)
-                sheet.write(row_index, 7, average_pallets, float_format)
-                sheet.write(row_index, 8, capacity_rate_pallets / 100, percent_format)  # Dividing by 100 to convert to percentage format
-                sheet.write(row_index, 9, average_kilos, float_format)
-                sheet.write(row_index, 10, capacity_rate_kilos / 100, percent_format)  # Dividing by 100 to convert to percentage format
-                
-                # Summing up various properties
-                summation['total_pallets_received'] += line['pallets_received']
-                summation['total_pallets_withdrawn'] += line['pallets_withdrawn']
-                summation['total_kilos_received'] += line['kilos_received']
-                summation['total_kilos_withdrawn'] += line['kilos_withdrawn']
-                
-                # Incrementing row index for the next line
-                row_index += 1
-            
-            # Write summation totals
-            sheet.write(row_index, 1, summation['total_pallets_received'], float_format_bold)
-            sheet.write(row_index, 2, summation['total_pallets_withdrawn'], float_format_bold)
-            sheet.write(row_index, 4, summation['total_kilos_received'], float_format_bold)
-            sheet.write(row_index, 5, summation['total_kilos_withdrawn'], float_format_bold)
+            self._write_table(
+                workbook, sheet, columns, self._iter_table_rows(daily_lines, max_pallets, max_kg),
+                first_row=3, header_format='table_header', total_format='float_bold',
+            )
+            self.generate_rolling_sheet(workbook, warehouse_name, daily_lines, max_pallets, max_kg, windows)
@@ -1,136 +1,236 @@
-from odoo import models
-import datetime
+from odoo import models, fields
+import itertools
+from operator import itemgetter
 from xlsxwriter.workbook import Workbook
 
+from odoo.tools import SQL
+
+from odoo.addons.report_xlsx.report.report_abstract_xlsx import RecordStream, XlsxColumn
+
+from ..tools.daily_series import ONE_DAY, fill_days
+from ..tools.report_time import REPORT_UTC_OFFSET, report_day_sql
+
 class PalletKilosXlsx(models.AbstractModel):
     _name = 'report.pallet_kilos_record_model.pallet_kilos_report_xlsx'
-    _inherit = 'report.report_xlsx.abstract'
-
-    def _define_formats(self, workbook):
-        """Define and return format objects."""
-        header_format = workbook.add_format({'font_size': 12, 'align': 'vcenter', 'bold': True, 'text_wrap': True})
-        table_header_format = workbook.add_format({'font_size': 12, 'align': 'vcenter', 'bold': True, 'text_wrap': True, 'border': 1})
-        normal_format = workbook.add_format({'font_size': 12, 'align': 'vcenter'})
-        float_format = workbook.add_format({'font_size': 12, 'align': 'vcenter', 'num_format': '#,##0.00'})
-        float_format_bold = workbook.add_format({'font_size': 12, 'align': 'vcenter', 'num_format': '#,##0.00', 'bold': True})
-        date_format = workbook.add_format({'num_format': 'mm/dd/yy'})
-        return header_format, table_header_format, normal_format, float_format, float_format_bold, date_format
-
-    def generate_header(self, sheet, sorted_records, formats):
+    _inherit = 'report.pallet_kilos_record_model.abstract_xlsx'
+
+    def is_streaming_report(self):
+        """Multi-year ledgers: render in constant memory and stream the file."""
+        return True
+
+    def is_cacheable_report(self):
+        return True
+
+    def is_replica_report(self):
+        return True
+
+    def _get_snapshot_scope_field(self):
+        return 'owner_id'
+
+    def _get_report_fingerprint(self, objs, data):
+        """Owner names and rates are printed too, so their changes count, and
+        so do the daily balances of the owners up to the last printed day,
+        which the billing sheet reads for all their records. Read in SQL,
+        without loading the records."""
+        if not objs:
+            return None
+        objs.flush_model(['owner_id', 'create_date'])
+        self.env['res.partner'].flush_model(['write_date'])
+        balances = self.env['pallet_kilos_record_model.daily_balance']
+        # billed up to the end of the report period, see generate_billing_sheet
+        date_to = fields.Date.to_date((data or {}).get('date_to'))
+        self.env.cr.execute(SQL(
+            """
+            WITH report_owner AS (
+                SELECT DISTINCT line.owner_id AS id FROM %(ledger)s line WHERE line.id = ANY(%(ids)s)
+            ), report_period AS (
+                SELECT COALESCE(%(date_to)s::date, MAX(%(day)s)) AS last_day FROM %(ledger)s line WHERE line.id = ANY(%(ids)s)
+            ), billed AS (
+                SELECT balance.write_date
+                  FROM %(balances)s balance, report_period
+                 WHERE balance.owner_id IN (SELECT id FROM report_owner)
+                   AND balance.day <= report_period.last_day
+            )
+            SELECT (SELECT MAX(partner.write_date) FROM res_partner partner WHERE partner.id IN (SELECT id FROM report_owner)),
+                   (SELECT COUNT(*) FROM billed),
+                   (SELECT MAX(write_date) FROM billed)
+            """,
+            ledger=SQL.identifier(objs._table),
+            ids=objs.ids,
+            date_to=date_to,
+            day=report_day_sql(SQL('line.create_date')),
+            balances=SQL.identifier(balances._table),
+        ))
+        return (
+            super()._get_report_fingerprint(objs, data),
+            self.env.cr.fetchone(),
+        )
+
+    def _get_snapshot_data(self, cutoff):
+        """Bill up to the last day before the cutoff, like the prints of the
+        wizard up to yesterday."""
+        last_day = (cutoff + REPORT_UTC_OFFSET).date() - ONE_DAY
+        return {'date_to': fields.Date.to_string(last_day)}
+
+    def _get_snapshot_period(self, records, data):
+        """Billing period, see ``generate_billing_sheet``: the dates of the
+        data, or the first and last printed days."""
+        date_from = fields.Date.to_date(data.get('date_from'))
+        date_to = fields.Date.to_date(data.get('date_to'))
+        if not (date_from and date_to):
+            records.flush_model(['create_date'])
+            self.env.cr.execute(SQL(
+                'SELECT MIN(%s), MAX(%s) FROM %s line WHERE line.id = ANY(%s)',
+                report_day_sql(SQL('line.create_date')), report_day_sql(SQL('line.create_date')),
+                SQL.identifier(records._table), records.ids,
+            ))
+            first_day, last_day = self.env.cr.fetchone()
+            date_from, date_to = date_from or first_day, date_to or last_day
+        return date_from, date_to
+
+    def _get_ledger_query(self, records):
+        """``records`` as a query on the ledger table, access rules included."""
+        if isinstance(records, RecordStream):
+            return records.model._search(records.domain)
+        return records._search([('id', 'in', records.ids)])
+
+    def _read_daily_ledger(self, records):
+        """Aggregate ``records`` into one row per owner and day (in UTC+8) in a
+        single query: the sums of the moves, the balances after the last record
+        of the day, the picking references (receiving reports apart) and the
+        owner's name and rates. Rows are sorted by owner name, then day."""
+        ledger = records.model if isinstance(records, RecordStream) else records
+        query = SQL(
+            """
+            SELECT partner.id AS owner_id,
+                   partner.name AS owner_name,
+                   COALESCE(partner.x_studio_holding_rate, 0) AS holding_rate,
+                   COALESCE(partner.x_studio_handling_rate, 0) AS handling_rate,
+                   %s AS day,
+                   COALESCE(string_agg(picking.name, ', ' ORDER BY line.create_date, line.id)
+                            FILTER (WHERE strpos(picking.name, 'RR') > 0), '') AS receiving,
+                   COALESCE(string_agg(picking.name, ', ' ORDER BY line.create_date, line.id)
+                            FILTER (WHERE strpos(picking.name, 'RR') = 0), '') AS withdrawal,
+                   COALESCE(SUM(line.pallets_received), 0) AS pallets_received,
+                   COALESCE(SUM(line.pallets_withdrawn), 0) AS pallets_withdrawn,
+                   COALESCE((array_agg(line.total_balance_in_pallets ORDER BY line.create_date DESC, line.id DESC))[1], 0)
+                       AS total_balance_in_pallets,
+                   COALESCE(SUM(line.kilos_received), 0) AS kilos_received,
+                   COALESCE(SUM(line.kilos_withdrawn), 0) AS kilos_withdrawn,
+                   COALESCE((array_agg(line.total_balance_in_kilos ORDER BY line.create_date DESC, line.id DESC))[1], 0)
+                       AS total_balance_in_kilos
+              FROM %s line
+              LEFT JOIN res_partner partner ON partner.id = line.owner_id
+              LEFT JOIN stock_picking picking ON picking.id = line.record_reference
+             WHERE line.id IN %s
+             GROUP BY partner.id, day
+             ORDER BY partner.name, partner.id, day
+            """,
+            report_day_sql(SQL('line.create_date')),
+            SQL.identifier(ledger._table),
+            self._get_ledger_query(records).subselect(),
+        )
+        with self._xlsx_phase('fetch') as stats:
+            ledger.env.cr.execute(query)
+            rows = ledger.env.cr.dictfetchall()
+            if stats:
+                stats.rows += len(rows)
+        return rows
+
+    def generate_header(self, sheet, daily_rows, formats):
         """Generate header section of the report."""
-        header_format, _, normal_format, _, _, _ = formats
-        sheet.write(0, 0, sorted_records[0].owner_id.name or '', header_format)
-        sheet.write(1, 0, 'BILLING DETAILS-HOLDING', normal_format)
-        start_date = sorted_records[0].create_date + datetime.timedelta(hours=8)
-        end_date = sorted_records[-1].create_date + datetime.timedelta(hours=8)
+        sheet.write(0, 0, daily_rows[0]['owner_name'] or '', formats['header'])
+        sheet.write(1, 0, 'BILLING DETAILS-HOLDING', formats['normal'])
+        start_date = daily_rows[0]['day']
+        end_date = daily_rows[-1]['day']
         date_range = start_date.strftime('%B %d, %Y') + ' - ' + end_date.strftime('%B %d, %Y')
         sheet.write(2, 0, date_range)
 
-    def generate_table_header(self, sheet, row_index, formats):
-        """Generate table header."""
-        _, table_header_format, _, _, _, _ = formats
-        table_headers = ['Date', 'Receiving Report No.', 'Withdrawal Report No.', 'Pallets Received', 'Pallets Withdrawn', 'Balance in Pallets', 'Kilos Received', 'Kilos Withdrawn', 'Balance in Kilos', 'HOLDING RATE/day/pallet', 'HANDLING RATE']
-        col_index = 0
-        for header_text in table_headers:
-            sheet.write(row_index, col_index, header_text, table_header_format)
-            col_index += 1
+    def _get_table_columns(self):
+        """Columns of the owner ledger table."""
+        return [
+            XlsxColumn('Date', 'day', 'date_short', width=23),
+            XlsxColumn('Receiving Report No.', 'receiving', 'normal', width=23),
+            XlsxColumn('Withdrawal Report No.', 'withdrawal', 'normal', width=23),
+            XlsxColumn('Pallets Received', 'pallets_received', 'float', 'sum', 23),
+            XlsxColumn('Pallets Withdrawn', 'pallets_withdrawn', 'float', 'sum', 23),
+            XlsxColumn('Balance in Pallets', 'total_balance_in_pallets', 'float', width=23),
+            XlsxColumn('Kilos Received', 'kilos_received', 'float', 'sum', 23),
+            XlsxColumn('Kilos Withdrawn', 'kilos_withdrawn', 'float', 'sum', 23),
+            XlsxColumn('Balance in Kilos', 'total_balance_in_kilos', 'float', width=23),
+            XlsxColumn('HOLDING RATE/day/pallet', 'holding_rate', 'float', width=23),
+            XlsxColumn('HANDLING RATE', 'handling_rate', 'float', width=23),
+        ]
+
+    def _iter_table_rows(self, daily_rows):
+        """The daily rows of an owner, and a blank row for each day without any."""
+        blank = {
+            'receiving': '', 'withdrawal': '',
+            'pallets_received': 0, 'pallets_withdrawn': 0, 'total_balance_in_pallets': 0,
+            'kilos_received': 0, 'kilos_withdrawn': 0, 'total_balance_in_kilos': 0,
+            'holding_rate': 0, 'handling_rate': 0,
+        }
+        return fill_days(daily_rows, lambda day, previous: dict(blank, day=day))
+
+    def _get_billing_columns(self):
+        """Columns of the billing summary table, see ``get_billing``."""
+        return [
+            XlsxColumn('Owner', 'owner_name', 'normal', width=30),
+            XlsxColumn('From', 'date_from', 'date_short', width=12),
+            XlsxColumn('To', 'date_to', 'date_short', width=12),
+            XlsxColumn('Pallet-Days', 'pallet_days', 'float', 'sum', 18),
+            XlsxColumn('Kilo-Days', 'kilo_days', 'float', 'sum', 18),
+            XlsxColumn('Pallets Handled', 'pallets_handled', 'float', 'sum', 18),
+            XlsxColumn('HOLDING RATE/day/pallet', 'holding_rate', 'float', width=23),
+            XlsxColumn('HANDLING RATE', 'handling_rate', 'float', width=18),
+            XlsxColumn('Holding Charge', 'holding_charge', 'float', 'sum', 18),
+            XlsxColumn('Handling Charge', 'handling_charge', 'float', 'sum', 18),
+            XlsxColumn('Total Charge', 'total_charge', 'float', 'sum', 18),
+        ]
+
+    def generate_billing_sheet(self, workbook, data, ledger_rows, formats, env=None):
+        """Summary sheet with the charges of the owners of the report over its
+        period: the dates of the report data, or its first and last days. The
+        balances of an owner are not kept by warehouse, so its charges cover
+        all its warehouses, even when the report is restricted to some. The
+        balances are read in ``env``, the environment of the printed records
+        (possibly on the replica, see ``_report_fetch_env``)."""
+        owner_names = {row['owner_id']: row['owner_name'] for row in ledger_rows if row['owner_id']}
+        if not owner_names:
+            return
+        date_from = fields.Date.to_date(data.get('date_from')) or min(row['day'] for row in ledger_rows)
+        date_to = fields.Date.to_date(data.get('date_to')) or max(row['day'] for row in ledger_rows)
+        with self._xlsx_phase('fetch') as stats:
+            billings = (env or self.env)['pallet_kilos_record_model.daily_balance'].get_billing(
+                date_from, date_to, list(owner_names),
+            )
+            if stats:
+                stats.rows += len(billings)
+        sheet = workbook.add_worksheet('Billing Summary')
+        sheet.write(0, 0, 'BILLING SUMMARY', formats['header'])
+        sheet.write(1, 0, date_from.strftime('%B %d, %Y') + ' - ' + date_to.strftime('%B %d, %Y'))
+        sheet.write(2, 0, 'Charges cover all the warehouses of each owner.', formats['normal'])
+        rows = [dict(billing, owner_name=owner_names[billing['owner_id']]) for billing in billings]
+        self._write_table(
+            workbook, sheet, self._get_billing_columns(), rows,
+            first_row=4, header_format='table_header', total_format='float_bold',
+        )
 
     def generate_xlsx_report(self, workbook, data, records):
         """Generate the entire XLSX report."""
-        formats = self._define_formats(workbook)
-        header_format, table_header_format, normal_format, float_format, float_format_bold, date_format = formats
-    
-        # Group records by owner
-        records_by_owner = {}
-        for record in records:
-            owner_name = record.owner_id.name or 'Unknown'
-            if owner_name not in records_by_owner:
-                records_by_owner[owner_name] = []
-            records_by_owner[owner_name].append(record)
-    
-        # Iterate over each owner and generate a separate sheet
-        for owner_name, owner_records in records_by_owner.items():
-            # Create a new worksheet for the owner
-            sheet = workbook.add_worksheet(owner_name)
-            sheet.set_column(0, 11, 23)
-            row_index = 5
-    
-            # Sort records by date
-            sorted_records = sorted(owner_records, key=lambda x: x.create_date)
-    
-            # Determine the oldest and latest date
-            oldest_date = sorted_records[0].create_date.date()
-            latest_date = sorted_records[-1].create_date.date()
-    
-            # Create a list of all dates between oldest_date and latest_date
-            date_list = [oldest_date + datetime.timedelta(days=x) for x in range((latest_date - oldest_date).days + 1)]
-    
-            # Prepare a lookup dictionary for records by date
-            records_by_date = {}
-            for record in sorted_records:
-                record_date = record.create_date.date()
-                if record_date not in records_by_date:
-                    records_by_date[record_date] = []
-                records_by_date[record_date].append(record)
-    
-            # Generate header and table header
-            self.generate_header(sheet, sorted_records, formats)
-            self.generate_table_header(sheet, row_index - 2, formats)
-    
-            # Initialize summation dictionary
-            summation = {'total_pallets_received': 0, 'total_pallets_withdrawn': 0, 'total_kilos_received': 0, 'total_kilos_withdrawn': 0}
-    
-            # Iterate over the full date range
-            for current_date in date_list:
-                # Get all records for the current date, or an empty list if none exist
-                records_for_date = records_by_date.get(current_date, [])
-    
-                # Write a row for each record on the current date
-                for line in records_for_date:
-                    # Ensure proper formatting and summation
-                    create_date = (current_date + datetime.timedelta(hours=8)) if current_date else ''
-                    sheet.write(row_index, 0, create_date, date_format)
-                    sheet.write(row_index, 1 if 'RR' in (line.record_reference.name if line.record_reference else '') else 2, line.record_reference.name if line else '', normal_format)
-                    sheet.write(row_index, 3, line.pallets_received or 0, float_format)
-                    sheet.write(row_index, 4, line.pallets_withdrawn or 0, float_format)
-                    sheet.write(row_index, 5, line.total_balance_in_pallets or 0, float_format)
-                    sheet.write(row_index, 6, line.kilos_received or 0, float_format)
-                    sheet.write(row_index, 7, line.kilos_withdrawn or 0, float_format)
-                    sheet.write(row_index, 8, line.total_balance_in_kilos or 0, float_format)
-                    sheet.write(row_index, 9, line.holding_rate or 0, float_format)
-                    sheet.write(row_index, 10, line.handling_rate or 0, float_format)
-    
-                    # Sum up various properties
-                    summation['total_pallets_received'] += line.pallets_received or 0
-                    summation['total_pallets_withdrawn'] += line.pallets_withdrawn or 0
-                    summation['total_kilos_received'] += line.kilos_received or 0
-                    summation['total_kilos_withdrawn'] += line.kilos_withdrawn or 0
-    
-                    # Increment row index
-                    row_index += 1
-    
-                # If no records for the current date, write a blank row
-                if not records_for_date:
-                    create_date = (current_date + datetime.timedelta(hours=8))
-                    sheet.write(row_index, 0, create_date, date_format)
-                    # Write blank data for the rest of the columns
-                    sheet.write(row_index, 1, '', normal_format)
-                    sheet.write(row_index, 3, 0, float_format)
-                    sheet.write(row_index, 4, 0, float_format)
-                    sheet.write(row_index, 5, 0, float_format)
-                    sheet.write(row_index, 6, 0, float_format)
-                    sheet.write(row_index, 7, 0, float_format)
-                    sheet.write(row_index, 8, 0, float_format)
-                    sheet.write(row_index, 9, 0, float_format)
-                    sheet.write(row_index, 10, 0, float_format)
-    
-                    # Increment row index
-                    row_index += 1
-    
-            # Write summation totals
-            sheet.write(row_index, 3, summation['total_pallets_received'], float_format_bold)
-            sheet.write(row_index, 4, summation['total_pallets_withdrawn'], float_format_bold)
-            sheet.write(row_index, 6, summation['total_kilos_received'], float_format_bold)
-            sheet.write(row_index, 7, summation['total_kilos_withdrawn'], float_format_bold)
-    
-            sheet.write(row_index + 3, 0, "GUARANTEED", header_format)
+        formats = self._get_formats(workbook)
+        columns = self._get_table_columns()
+        ledger_rows = self._read_daily_ledger(records)
+        ledger = records.model if isinstance(records, RecordStream) else records
+        self.generate_billing_sheet(workbook, data or {}, ledger_rows, formats, ledger.env)
+
+        # One sheet per owner
+        for owner_id, daily_rows in itertools.groupby(ledger_rows, key=itemgetter('owner_id')):
+            daily_rows = list(daily_rows)
+            sheet = workbook.add_worksheet(daily_rows[0]['owner_name'] or 'Unknown')
+            self.generate_header(sheet, daily_rows, formats)
+            sheet, row_index, totals = self._write_table(
+                workbook, sheet, columns, self._iter_table_rows(daily_rows),
+                first_row=4, header_format='table_header', total_format='float_bold',
+            )
+            sheet.write(row_index + 3, 0, "GUARANTEED", formats['header'])
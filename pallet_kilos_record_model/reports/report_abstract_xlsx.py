@@ -0,0 +1,48 @@
+from odoo import models
+
+
+class PalletKilosXlsxAbstract(models.AbstractModel):
+    _name = 'report.pallet_kilos_record_model.abstract_xlsx'
+    _inherit = 'report.report_xlsx.abstract'
+    _description = 'Pallet/Kilos XLSX Report Base'
+
+    def _get_xlsx_formats(self):
+        """Cell styles shared by the pallet/kilos workbooks."""
+        text = {'font_size': 12, 'align': 'vcenter'}
+        number = dict(text, num_format='#,##0.00')
+        return {
+            'header': dict(text, bold=True, text_wrap=True),
+            'table_header': dict(text, bold=True, text_wrap=True, border=1),
+            'normal': text,
+            'float': number,
+            'float_bold': dict(number, bold=True),
+            'percent': dict(text, num_format='0.00%', bold=True),
+            'date': {'num_format': 'mm-dd-yyyy'},
+            'date_short': {'num_format': 'mm/dd/yy'},
+        }
+
+    def _get_snapshot_scope_field(self):
+        """Field splitting the records into the snapshots rendered each night,
+        see ``pallet_kilos_record_model.report_snapshot``. None: no snapshots."""
+        return None
+
+    def _get_snapshot_data(self, cutoff):
+        """Report data the snapshots of ``cutoff`` are rendered with."""
+        return {}
+
+    def _get_snapshot_period(self, records, data):
+        """Period printed for ``records`` with ``data``: a snapshot is only
+        served for the period it was rendered on. (None, None) for reports that
+        print the same whatever the dates of the data."""
+        return None, None
+
+    def create_xlsx_report(self, docids, data):
+        """Serve the nightly snapshot when it covers exactly the records asked,
+        given by ids or by a domain."""
+        if self._get_snapshot_scope_field() and not self.env.context.get('pallet_kilos_snapshot_refresh'):
+            with self._xlsx_phase('snapshot'):
+                records = self._get_objs_for_report(docids, data)
+                snapshot = self.env['pallet_kilos_record_model.report_snapshot']._find_snapshot(self, records, data)
+            if snapshot:
+                return snapshot.attachment_id.raw, 'xlsx'
+        return super().create_xlsx_report(docids, data)
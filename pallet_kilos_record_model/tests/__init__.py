@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+
+# All the tests but test_daily_series and test_billing need the inventory Studio
+# customizations and are skipped without them, see common.InventoryStudioCase.
+from . import test_benchmark
+from . import test_daily_balance
+from . import test_daily_series
+from . import test_running_balance
+from . import test_ingestion
+from . import test_report_wizard
+from . import test_billing
+from . import test_warehouse_capacity
+from . import test_pallet_kilos_report
+from . import test_report_snapshot
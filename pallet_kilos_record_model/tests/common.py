@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from odoo.tests import common
+
+
+class InventoryStudioCase(common.TransactionCase):
+    """Base class of the tests needing the Studio customizations of the
+    inventory database, which this module relies on without defining them: the
+    rates of the owners (``x_studio_holding_rate``, ``x_studio_handling_rate``)
+    and the capacity variables (``x_inventory_static_var``). The tests are
+    skipped on databases without them."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        if 'x_inventory_static_var' not in cls.env or 'x_studio_holding_rate' not in cls.env['res.partner']._fields:
+            raise unittest.SkipTest('Inventory Studio customizations are not installed.')
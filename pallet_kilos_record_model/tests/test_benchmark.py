@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of the pallet/kilos XLSX reports on synthetic ledgers.
+
+Not part of the standard run, launch them with ``--test-tags benchmark``, on a
+database with the inventory Studio customizations (see ``InventoryStudioCase``).
+Environment variables:
+
+- ``PALLET_KILOS_BENCHMARK_SIZES``: comma separated ledger sizes, defaults to
+  ``1000``; e.g. ``1000,100000,1000000``.
+- ``PALLET_KILOS_BENCHMARK_BASELINES``: baselines file to check against,
+  defaults to ``benchmark_baselines.json`` next to this module.
+- ``PALLET_KILOS_BENCHMARK_UPDATE``: path of a file to write the measures to as
+  new baselines instead of checking them, e.g. to copy over
+  ``benchmark_baselines.json`` once reviewed. The addon itself is never written.
+
+Each report is rendered end to end, timing the fetch (batched reads), write
+(worksheet calls), close (workbook zip) and compute (everything else) phases
+under ``tracemalloc``, and fails when its total time or peak memory goes over
+``BASELINE_TOLERANCE`` times the stored baseline. Sizes without a baseline are
+reported as skipped: baselines are recorded on the reference database with
+``PALLET_KILOS_BENCHMARK_UPDATE`` and committed to ``benchmark_baselines.json``.
+"""
+import contextlib
+import json
+import logging
+import os
+import time
+import tracemalloc
+from collections import defaultdict
+from unittest.mock import patch
+
+from xlsxwriter.workbook import Workbook
+from xlsxwriter.worksheet import Worksheet
+
+from odoo.tests import tagged
+
+from .common import InventoryStudioCase
+
+_logger = logging.getLogger(__name__)
+
+BASELINES_PATH = os.environ.get('PALLET_KILOS_BENCHMARK_BASELINES') or os.path.join(
+    os.path.dirname(__file__), 'benchmark_baselines.json')
+UPDATE_PATH = os.environ.get('PALLET_KILOS_BENCHMARK_UPDATE')
+BASELINE_TOLERANCE = 1.5
+LEDGER_MODEL = 'pallet_kilos_record_model.pallet_kilos_record_model'
+REPORTS = [
+    'pallet_kilos_record_model.pallet_kilos_report_xlsx',
+    'pallet_kilos_record_model.daily_inventory_report_xlsx',
+]
+# Reports reading their data in a single aggregated query
+FETCH_METHODS = ['_read_daily_ledger']
+WRITE_METHODS = [
+    'write', 'write_row', 'write_column', 'write_string', 'write_number',
+    'write_blank', 'write_datetime', 'write_formula', 'write_boolean',
+]
+
+
+class PhaseTimer:
+    """Accumulate the wall time spent in named phases, ignoring re-entrant calls."""
+
+    def __init__(self):
+        self.timings = defaultdict(float)
+        self._running = set()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if name in self._running:
+            yield
+            return
+        self._running.add(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - start
+            self._running.discard(name)
+
+    def wrap(self, name, method):
+        timer = self
+
+        def timed(*args, **kwargs):
+            with timer.phase(name):
+                return method(*args, **kwargs)
+        return timed
+
+    def wrap_iterator(self, name, method):
+        timer = self
+
+        def timed(*args, **kwargs):
+            iterator = iter(method(*args, **kwargs))
+            while True:
+                with timer.phase(name):
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                yield item
+        return timed
+
+
+@tagged('-standard', '-at_install', 'post_install', 'benchmark')
+class TestReportBenchmark(InventoryStudioCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.owners = cls.env['res.partner'].create([
+            {'name': 'Benchmark Owner %03d' % i, 'x_studio_holding_rate': 10.0, 'x_studio_handling_rate': 2.5}
+            for i in range(60)
+        ])
+        cls.warehouses = cls.env['stock.warehouse'].create([
+            {'name': 'Benchmark Warehouse %d' % i, 'code': 'BW%d' % i}
+            for i in range(6)
+        ])
+        # referenced round robin by the ledger rows: receipts by the receptions,
+        # deliveries by the withdrawals
+        cls.receipts = cls.env['stock.picking'].create([
+            {'name': 'BENCH/RR/%05d' % i, 'picking_type_id': warehouse.in_type_id.id}
+            for i, warehouse in enumerate(cls.warehouses * 20)
+        ])
+        cls.deliveries = cls.env['stock.picking'].create([
+            {'name': 'BENCH/WR/%05d' % i, 'picking_type_id': warehouse.out_type_id.id}
+            for i, warehouse in enumerate(cls.warehouses * 20)
+        ])
+        cls.env['x_inventory_static_var'].create([
+            {
+                'x_name': name,
+                'x_studio_use_case': 'XLSX Variables',
+                'x_studio_warehouse': warehouse.id,
+                'x_studio_float_value': value,
+            }
+            for warehouse in cls.warehouses
+            for name, value in [('Max Pallets', 5000.0), ('Max Kilograms (KG)', 5000000.0)]
+        ])
+        with open(BASELINES_PATH) as baselines:
+            cls.baselines = json.load(baselines)
+
+    @classmethod
+    def tearDownClass(cls):
+        if UPDATE_PATH:
+            with open(UPDATE_PATH, 'w') as baselines:
+                json.dump(cls.baselines, baselines, indent=4, sort_keys=True)
+                baselines.write('\n')
+        super().tearDownClass()
+
+    def _generate_ledger(self, size, days=730):
+        """Insert ``size`` ledger rows spread over ``days`` days, round robin on
+        the benchmark owners, warehouses and pickings, in a single statement,
+        then aggregate them in the daily balances like the ORM would."""
+        self.env.cr.execute(
+            'DELETE FROM pallet_kilos_record_model_pallet_kilos_record_model WHERE owner_id = ANY(%s)',
+            [self.owners.ids],
+        )
+        self.env.cr.execute("""
+            INSERT INTO pallet_kilos_record_model_pallet_kilos_record_model (
+                report_no, owner_id, warehouse, record_reference,
+                pallets_received, pallets_withdrawn, total_balance_in_pallets, overall_pallets,
+                kilos_received, kilos_withdrawn, total_balance_in_kilos, overall_kilos,
+                create_uid, write_uid, create_date, write_date)
+            SELECT CASE WHEN n %% 3 = 0 THEN 'WR' ELSE 'RR' END || '/' || n,
+                   (%(owners)s::int[])[1 + n %% %(nb_owners)s],
+                   (%(warehouses)s::int[])[1 + n %% %(nb_warehouses)s],
+                   CASE WHEN n %% 3 = 0 THEN (%(deliveries)s::int[])[1 + n %% %(nb_pickings)s]
+                        ELSE (%(receipts)s::int[])[1 + n %% %(nb_pickings)s] END,
+                   CASE WHEN n %% 3 = 0 THEN 0 ELSE n %% 17 END,
+                   CASE WHEN n %% 3 = 0 THEN n %% 11 ELSE 0 END,
+                   n %% 997, n %% 4999,
+                   CASE WHEN n %% 3 = 0 THEN 0 ELSE (n %% 17) * 850.5 END,
+                   CASE WHEN n %% 3 = 0 THEN (n %% 11) * 850.5 ELSE 0 END,
+                   (n %% 997) * 850.5, (n %% 4999) * 850.5,
+                   %(uid)s, %(uid)s,
+                   now() at time zone 'UTC' - interval '1 second' * ((%(size)s - n)::bigint * %(seconds)s / %(size)s),
+                   now() at time zone 'UTC'
+              FROM generate_series(1, %(size)s) n
+            RETURNING id
+        """, {
+            'owners': self.owners.ids,
+            'nb_owners': len(self.owners),
+            'warehouses': self.warehouses.ids,
+            'nb_warehouses': len(self.warehouses),
+            'receipts': self.receipts.ids,
+            'deliveries': self.deliveries.ids,
+            'nb_pickings': len(self.receipts),
+            'uid': self.env.uid,
+            'size': size,
+            'seconds': days * 86400,
+        })
+        ids = [row[0] for row in self.env.cr.fetchall()]
+        self.env['pallet_kilos_record_model.daily_balance']._rebuild_daily_balances()
+        return self.env[LEDGER_MODEL].browse(ids)
+
+    def _run_report(self, report_name, records):
+        """Render ``report_name`` on ``records``, return its measures."""
+        report = self.env['report.%s' % report_name].with_context(active_model=LEDGER_MODEL)
+        report_class = self.env.registry['report.%s' % report_name]
+        timer = PhaseTimer()
+        patches = [
+            patch.object(report_class, '_iter_report_rows', timer.wrap_iterator('fetch', report_class._iter_report_rows)),
+            patch.object(Workbook, 'close', timer.wrap('close', Workbook.close)),
+        ] + [
+            patch.object(report_class, name, timer.wrap('fetch', getattr(report_class, name)))
+            for name in FETCH_METHODS if hasattr(report_class, name)
+        ] + [
+            patch.object(Worksheet, name, timer.wrap('write', getattr(Worksheet, name)))
+            for name in WRITE_METHODS
+        ]
+        self.env.invalidate_all()
+        queries = self.env.cr.sql_log_count
+        with contextlib.ExitStack() as stack:
+            for patcher in patches:
+                stack.enter_context(patcher)
+            tracemalloc.start()
+            start = time.perf_counter()
+            content = report.create_xlsx_report(records.ids, {})[0]
+            total = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        timings = timer.timings
+        return {
+            'seconds': total,
+            'fetch': timings['fetch'],
+            'write': timings['write'],
+            'close': timings['close'],
+            'compute': total - timings['fetch'] - timings['write'] - timings['close'],
+            'peak_mb': peak / 1024 / 1024,
+            'queries': self.env.cr.sql_log_count - queries,
+            'size_kb': len(content) / 1024,
+        }
+
+    def _check_baseline(self, report_name, size, measures):
+        key = '%s:%s' % (report_name, size)
+        if UPDATE_PATH:
+            self.baselines[key] = {name: round(measures[name], 3) for name in ('seconds', 'peak_mb', 'queries')}
+            return
+        baseline = self.baselines.get(key)
+        if not baseline:
+            # reported as skipped, not passed: nothing was checked
+            self.skipTest('No benchmark baseline for %s in %s, record one with PALLET_KILOS_BENCHMARK_UPDATE=<path>' % (
+                key, BASELINES_PATH))
+        for name in ('seconds', 'peak_mb', 'queries'):
+            self.assertLessEqual(
+                measures[name], baseline[name] * BASELINE_TOLERANCE,
+                '%s regressed on %s: %.3f against a baseline of %.3f' % (key, name, measures[name], baseline[name]),
+            )
+
+    def test_benchmark_reports(self):
+        sizes = [int(size) for size in os.environ.get('PALLET_KILOS_BENCHMARK_SIZES', '1000').split(',')]
+        for size in sizes:
+            records = self._generate_ledger(size)
+            for report_name in REPORTS:
+                with self.subTest(report=report_name, size=size):
+                    measures = self._run_report(report_name, records)
+                    _logger.info(
+                        'benchmark report=%s rows=%d seconds=%.3f fetch=%.3f compute=%.3f write=%.3f '
+                        'close=%.3f peak_mb=%.1f queries=%d size_kb=%.1f',
+                        report_name, size, measures['seconds'], measures['fetch'], measures['compute'],
+                        measures['write'], measures['close'], measures['peak_mb'], measures['queries'],
+                        measures['size_kb'],
+                    )
+                    self._check_baseline(report_name, size, measures)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from odoo.tests import common
+
+from ..tools.billing import compute_billing
+
+
+class TestBilling(common.BaseCase):
+
+    def _row(self, day, balance_pallets, received=0, withdrawn=0):
+        return {
+            'day': datetime.date(2024, 1, day),
+            'balance_pallets': balance_pallets,
+            'balance_kilos': balance_pallets * 10,
+            'pallets_received': received,
+            'pallets_withdrawn': withdrawn,
+        }
+
+    def test_carry_forward_balances(self):
+        rows = [self._row(2, 10, received=10), self._row(4, 6, withdrawn=4)]
+        billing = compute_billing(
+            datetime.date(2024, 1, 1), datetime.date(2024, 1, 5), rows,
+            opening={'balance_pallets': 2, 'balance_kilos': 20}, holding_rate=1.5, handling_rate=3,
+        )
+        # 2 (opening) + 10 + 10 (carried) + 6 + 6 (carried)
+        self.assertEqual(billing['days'], 5)
+        self.assertEqual(billing['pallet_days'], 34)
+        self.assertEqual(billing['kilo_days'], 340)
+        self.assertEqual(billing['pallets_handled'], 14)
+        self.assertEqual(billing['holding_charge'], 51)
+        self.assertEqual(billing['handling_charge'], 42)
+        self.assertEqual(billing['total_charge'], 93)
+
+    def test_rows_outside_period(self):
+        rows = [self._row(1, 4, received=4), self._row(9, 8, received=4)]
+        billing = compute_billing(datetime.date(2024, 1, 3), datetime.date(2024, 1, 4), rows, holding_rate=1)
+        self.assertEqual(billing['pallet_days'], 0)
+        self.assertEqual(billing['pallets_handled'], 0)
+        self.assertEqual(billing['total_charge'], 0)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests import tagged
+
+from .common import InventoryStudioCase
+
+LEDGER_MODEL = 'pallet_kilos_record_model.pallet_kilos_record_model'
+
+
+@tagged('post_install', '-at_install')
+class TestDailyBalance(InventoryStudioCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.owner = cls.env['res.partner'].create({'name': 'Daily Balance Owner'})
+        cls.warehouse = cls.env['stock.warehouse'].create({'name': 'Daily Balance Warehouse', 'code': 'DBW'})
+        cls.Balance = cls.env['pallet_kilos_record_model.daily_balance']
+
+    def _balances(self):
+        return self.Balance.search([('owner_id', '=', self.owner.id)])
+
+    def test_incremental_update(self):
+        received, withdrawn = self.env[LEDGER_MODEL].create([
+            {
+                'owner_id': self.owner.id, 'warehouse': self.warehouse.id,
+                'pallets_received': 10, 'kilos_received': 8000,
+                'total_balance_in_pallets': 10, 'total_balance_in_kilos': 8000,
+                'overall_pallets': 110, 'overall_kilos': 88000,
+            },
+            {
+                'owner_id': self.owner.id, 'warehouse': self.warehouse.id,
+                'pallets_withdrawn': 4, 'kilos_withdrawn': 3000,
+                'total_balance_in_pallets': 6, 'total_balance_in_kilos': 5000,
+                'overall_pallets': 106, 'overall_kilos': 85000,
+            },
+        ])
+        balance = self._balances()
+        self.assertEqual(len(balance), 1)
+        self.assertEqual(balance.record_count, 2)
+        self.assertEqual((balance.pallets_received, balance.pallets_withdrawn), (10, 4))
+        self.assertEqual((balance.balance_pallets, balance.balance_kilos), (6, 5000))
+        self.assertEqual((balance.warehouse_balance_pallets, balance.warehouse_balance_kilos), (106, 85000))
+
+        withdrawn.write({'pallets_withdrawn': 5, 'total_balance_in_pallets': 5})
+        balance = self._balances()
+        self.assertEqual((balance.pallets_withdrawn, balance.balance_pallets), (5, 5))
+
+        withdrawn.unlink()
+        balance = self._balances()
+        self.assertEqual((balance.record_count, balance.balance_pallets), (1, 10))
+
+        received.unlink()
+        self.assertFalse(self._balances())
+
+    def test_refresh_existing_day(self):
+        record = self.env[LEDGER_MODEL].create({
+            'owner_id': self.owner.id, 'warehouse': self.warehouse.id,
+            'pallets_received': 5, 'total_balance_in_pallets': 5,
+        })
+        balance = self._balances()
+        balance_id = balance.id
+        self.env.cr.execute('UPDATE %s SET pallets_received = 0 WHERE id = %%s' % balance._table, [balance_id])
+        self.Balance._refresh_daily_balances(record._get_daily_balance_keys())
+        balance = self._balances()
+        # updated in place, not deleted and inserted again
+        self.assertEqual(balance.id, balance_id)
+        self.assertEqual(balance.pallets_received, 5)
+
+    def test_get_daily_balances(self):
+        self.env[LEDGER_MODEL].create({
+            'owner_id': self.owner.id, 'warehouse': self.warehouse.id,
+            'pallets_received': 3, 'total_balance_in_pallets': 3,
+        })
+        rows = self.Balance.get_daily_balances(owner_ids=self.owner.ids)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['warehouse_id'][0], self.warehouse.id)
+        self.assertEqual(rows[0]['balance_pallets'], 3)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from odoo.tests import common
+
+from ..tools.daily_series import (
+    add_rolling_stats, aggregate_days, carry_forward, fill_days, rolling_averages, rolling_maximums,
+)
+from ..tools.report_time import REPORT_UTC_OFFSET as OFFSET
+
+
+class TestDailySeries(common.BaseCase):
+
+    def _line(self, date, received=0, balance=0):
+        return {'create_date': datetime.datetime.fromisoformat(date), 'received': received, 'balance': balance}
+
+    def test_aggregate_and_fill(self):
+        lines = [
+            self._line('2024-01-01 01:00:00', 5, 5),
+            self._line('2024-01-01 17:00:00', 2, 7),  # 01:00 on the 2nd in UTC+8
+            self._line('2024-01-02 10:00:00', None, 4),
+            self._line('2024-01-05 02:00:00', 1, 5),
+        ]
+        days = aggregate_days(lines, offset=OFFSET, sum_keys=['received'], last_keys=['balance'])
+        rows = list(fill_days(days, carry_forward(['balance'], ['received'])))
+        self.assertEqual(
+            [(row['day'].day, row['received'], row['balance']) for row in rows],
+            [(1, 5, 5), (2, 2, 4), (3, 0, 4), (4, 0, 4), (5, 1, 5)],
+        )
+
+    def test_fill_bounds(self):
+        start, end = datetime.date(2024, 1, 1), datetime.date(2024, 1, 4)
+        rows = [{'day': datetime.date(2024, 1, 2), 'balance': 3}]
+        filled = list(fill_days(rows, carry_forward(['balance']), start=start, end=end))
+        self.assertEqual([row['balance'] for row in filled], [0, 3, 3, 3])
+        self.assertEqual(filled[-1]['day'], end)
+        self.assertEqual(list(fill_days([], carry_forward(['balance']))), [])
+
+    def test_lazy(self):
+        def rows():
+            yield {'day': datetime.date(2024, 1, 1)}
+            raise AssertionError('read too far')
+        self.assertEqual(next(fill_days(rows(), carry_forward([])))['day'], datetime.date(2024, 1, 1))
+
+    def test_rolling_stats(self):
+        values = [4, 0, 8, 2, 6]
+        rows = add_rolling_stats([{'balance': value} for value in values], ['balance'], [1, 3], {'balance': 8})
+        self.assertEqual([row['balance_avg_3'] for row in rows], [4, 2, 4, 10 / 3, 16 / 3])
+        self.assertEqual([row['balance_peak_3'] for row in rows], [4, 4, 8, 8, 8])
+        self.assertEqual([row['balance_avg_1'] for row in rows], values)
+        self.assertEqual(rows[2]['balance_peak_rate_3'], 1)
+        self.assertEqual(rolling_averages([], 7), [])
+        self.assertEqual(rolling_maximums([1, None, 0], 2), [1, 1, 0])
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests import tagged
+
+from .common import InventoryStudioCase
+
+LEDGER_MODEL = 'pallet_kilos_record_model.pallet_kilos_record_model'
+
+
+@tagged('post_install', '-at_install')
+class TestIngestion(InventoryStudioCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.owner = cls.env['res.partner'].create({'name': 'Ingestion Owner'})
+        cls.product = cls.env['product.product'].create({'name': 'Frozen Goods', 'type': 'product', 'weight': 2.5})
+        cls.warehouse = cls.env['stock.warehouse'].search([('company_id', '=', cls.env.company.id)], limit=1)
+
+    def _receipt(self, quantity, packages):
+        picking_type = self.warehouse.in_type_id
+        picking = self.env['stock.picking'].create({
+            'picking_type_id': picking_type.id,
+            'partner_id': self.owner.id,
+            'location_id': self.env.ref('stock.stock_location_suppliers').id,
+            'location_dest_id': picking_type.default_location_dest_id.id,
+            'move_ids': [(0, 0, {
+                'name': self.product.name,
+                'product_id': self.product.id,
+                'product_uom_qty': quantity,
+                'product_uom': self.product.uom_id.id,
+                'location_id': self.env.ref('stock.stock_location_suppliers').id,
+                'location_dest_id': picking_type.default_location_dest_id.id,
+            })],
+        })
+        picking.action_confirm()
+        move = picking.move_ids
+        move.move_line_ids.unlink()
+        per_package = quantity / packages
+        self.env['stock.move.line'].create([{
+            'move_id': move.id,
+            'picking_id': picking.id,
+            'product_id': self.product.id,
+            'product_uom_id': self.product.uom_id.id,
+            'location_id': move.location_id.id,
+            'location_dest_id': move.location_dest_id.id,
+            'quantity': per_package,
+            'result_package_id': self.env['stock.quant.package'].create({}).id,
+        } for __ in range(packages)])
+        move.picked = True
+        picking._action_done()
+        return picking
+
+    def test_create_from_pickings(self):
+        pickings = self._receipt(40, 2) | self._receipt(10, 1)
+        Ledger = self.env[LEDGER_MODEL]
+        records = Ledger.create_from_pickings(pickings)
+        self.assertEqual(len(records), 2)
+        first = records.filtered(lambda record: record.record_reference == pickings[0])
+        self.assertEqual((first.pallets_received, first.kilos_received), (2, 100))
+        self.assertEqual(first.owner_id, self.owner)
+        self.assertEqual(first.warehouse, self.warehouse)
+        self.assertEqual(first.create_date, pickings[0].date_done)
+        self.assertEqual(records.sorted('id')[-1].total_balance_in_pallets, 3)
+        # idempotent
+        self.assertFalse(Ledger.create_from_pickings(pickings))
+        self.assertEqual(Ledger.search_count([('record_reference', 'in', pickings.ids)]), 2)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from odoo.tests import tagged
+
+from .common import InventoryStudioCase
+
+LEDGER_MODEL = 'pallet_kilos_record_model.pallet_kilos_record_model'
+REPORT_NAME = 'pallet_kilos_record_model.pallet_kilos_report_xlsx'
+
+
+@tagged('post_install', '-at_install')
+class TestPalletKilosReport(InventoryStudioCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.owner = cls.env['res.partner'].create({
+            'name': 'Report Owner', 'x_studio_holding_rate': 10.0, 'x_studio_handling_rate': 2.0,
+        })
+        warehouse = cls.env['stock.warehouse'].search([('company_id', '=', cls.env.company.id)], limit=1)
+        cls.receipt = cls.env['stock.picking'].create({'name': 'WH/RR/00001', 'picking_type_id': warehouse.in_type_id.id})
+        cls.delivery = cls.env['stock.picking'].create({'name': 'WH/OUT/00001', 'picking_type_id': warehouse.out_type_id.id})
+        cls.records = cls.env[LEDGER_MODEL].create([
+            {
+                'owner_id': cls.owner.id, 'warehouse': warehouse.id, 'record_reference': cls.receipt.id,
+                'pallets_received': 10, 'kilos_received': 1000,
+                'total_balance_in_pallets': 10, 'total_balance_in_kilos': 1000,
+            },
+            {
+                'owner_id': cls.owner.id, 'warehouse': warehouse.id, 'record_reference': cls.delivery.id,
+                'pallets_withdrawn': 4, 'kilos_withdrawn': 400,
+                'total_balance_in_pallets': 6, 'total_balance_in_kilos': 600,
+            },
+            {
+                'owner_id': cls.owner.id, 'warehouse': warehouse.id, 'record_reference': cls.receipt.id,
+                'pallets_received': 2, 'kilos_received': 200,
+                'total_balance_in_pallets': 8, 'total_balance_in_kilos': 800,
+            },
+        ])
+        # two moves on March 1st and one on March 3rd (UTC+8)
+        dates = ['2024-03-01 01:00:00', '2024-03-01 02:00:00', '2024-03-02 20:00:00']
+        for record, date in zip(cls.records, dates):
+            cls.env.cr.execute('UPDATE %s SET create_date = %%s WHERE id = %%s' % record._table, [date, record.id])
+        cls.records.invalidate_recordset(['create_date'])
+        cls.env['pallet_kilos_record_model.daily_balance']._rebuild_daily_balances()
+
+    def test_daily_rows(self):
+        report = self.env['report.' + REPORT_NAME]
+        rows = report._read_daily_ledger(self.records)
+        self.assertEqual([row['day'] for row in rows], [datetime.date(2024, 3, 1), datetime.date(2024, 3, 3)])
+        first, last = rows
+        self.assertEqual(first['owner_id'], self.owner.id)
+        self.assertEqual(first['receiving'], 'WH/RR/00001')
+        self.assertEqual(first['withdrawal'], 'WH/OUT/00001')
+        self.assertEqual((first['pallets_received'], first['pallets_withdrawn']), (10, 4))
+        self.assertEqual((first['total_balance_in_pallets'], first['total_balance_in_kilos']), (6, 600))
+        self.assertEqual((last['receiving'], last['withdrawal']), ('WH/RR/00001', ''))
+        self.assertEqual(last['total_balance_in_pallets'], 8)
+        self.assertEqual(last['holding_rate'], 10.0)
+        # March 2nd is filled with a blank row
+        table_rows = list(report._iter_table_rows(rows))
+        self.assertEqual([row['day'].day for row in table_rows], [1, 2, 3])
+        self.assertEqual(table_rows[1]['pallets_received'], 0)
+
+    def test_fingerprint_billing(self):
+        report = self.env['report.' + REPORT_NAME]
+        fingerprint = report._get_report_fingerprint(self.records[:1], {})
+        # after the printed days: not billed
+        late = self.env[LEDGER_MODEL].create({
+            'owner_id': self.owner.id, 'warehouse': self.records[0].warehouse.id,
+            'pallets_received': 1, 'total_balance_in_pallets': 9,
+        })
+        self.assertEqual(report._get_report_fingerprint(self.records[:1], {}), fingerprint)
+        # on a printed day: billed on the summary sheet, though not printed
+        self.env.cr.execute(
+            "UPDATE %s SET create_date = '2024-02-28 20:00:00' WHERE id = %%s" % late._table, [late.id],
+        )
+        late.invalidate_recordset(['create_date'])
+        self.env['pallet_kilos_record_model.daily_balance']._rebuild_daily_balances()
+        self.assertNotEqual(report._get_report_fingerprint(self.records[:1], {}), fingerprint)
+
+    def test_render(self):
+        content, report_type = self.env['ir.actions.report']._render(REPORT_NAME, self.records.ids, {})
+        self.assertEqual(report_type, 'xlsx')
+        self.assertTrue(content)
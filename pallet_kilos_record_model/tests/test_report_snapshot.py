@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import datetime
+from unittest.mock import patch
+
+from odoo.tests import tagged
+
+from ..tools.report_time import REPORT_UTC_OFFSET
+from .common import InventoryStudioCase
+
+LEDGER_MODEL = 'pallet_kilos_record_model.pallet_kilos_record_model'
+
+
+@tagged('post_install', '-at_install')
+class TestReportSnapshot(InventoryStudioCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Snapshot = cls.env['pallet_kilos_record_model.report_snapshot']
+        cls.report = cls.env.ref('pallet_kilos_record_model.pallet_kilos_inventory')
+        cls.report_model = cls.env['report.%s' % cls.report.report_name].with_context(active_model=LEDGER_MODEL)
+        cls.owner = cls.env['res.partner'].create({'name': 'Snapshot Owner'})
+        cls.records = cls.env[LEDGER_MODEL].create([
+            {'owner_id': cls.owner.id, 'pallets_received': 5, 'total_balance_in_pallets': 5},
+            {'owner_id': cls.owner.id, 'pallets_withdrawn': 2, 'total_balance_in_pallets': 3},
+        ])
+        # created yesterday, so that later writes change their write date
+        cls.cutoff = cls.Snapshot._get_snapshot_cutoff()
+        yesterday = cls.cutoff - datetime.timedelta(days=1)
+        cls.env.cr.execute(
+            'UPDATE %s SET create_date = %%s, write_date = %%s WHERE id IN %%s' % cls.records._table,
+            [yesterday, yesterday, tuple(cls.records.ids)],
+        )
+        cls.records.invalidate_recordset(['create_date', 'write_date'])
+        cls.env['pallet_kilos_record_model.daily_balance']._rebuild_daily_balances()
+
+    def _render(self, cutoff=None):
+        return self.Snapshot._render_snapshot(
+            self.report, self.report_model, 'owner_id', self.owner.id, cutoff or self.cutoff,
+        )
+
+    def test_find_snapshot(self):
+        snapshot = self._render()
+        self.assertTrue(snapshot.attachment_id)
+        self.assertEqual(snapshot.record_count, 2)
+        self.assertEqual(self.Snapshot._find_snapshot(self.report_model, self.records, {}), snapshot)
+        # not exactly its scope, or with options
+        self.assertFalse(self.Snapshot._find_snapshot(self.report_model, self.records[:1], {}))
+        self.assertFalse(self.Snapshot._find_snapshot(self.report_model, self.records, {'date_from': '2024-01-01'}))
+
+    def _domain_data(self, domain, date_to):
+        return {
+            'report_xlsx_domain': {'model': LEDGER_MODEL, 'domain': domain},
+            'date_to': date_to.isoformat(),
+        }
+
+    def test_find_snapshot_wizard(self):
+        snapshot = self._render()
+        yesterday = (self.cutoff + REPORT_UTC_OFFSET).date() - datetime.timedelta(days=1)
+        self.assertEqual((snapshot.period_from, snapshot.period_to), (yesterday, yesterday))
+        # printed from the wizard up to yesterday: the owner and the period of the snapshot
+        data = self._domain_data([('owner_id', '=', self.owner.id)], yesterday)
+        stream = self.report_model._get_objs_for_report(None, data)
+        self.assertEqual(self.Snapshot._find_snapshot(self.report_model, stream, data), snapshot)
+        # another period, or not a single owner
+        data = self._domain_data([('owner_id', '=', self.owner.id)], yesterday + datetime.timedelta(days=1))
+        stream = self.report_model._get_objs_for_report(None, data)
+        self.assertFalse(self.Snapshot._find_snapshot(self.report_model, stream, data))
+        other = self.env[LEDGER_MODEL].create({'owner_id': self.env.user.partner_id.id, 'pallets_received': 1})
+        data = self._domain_data([('id', 'in', (self.records | other).ids)], yesterday)
+        stream = self.report_model._get_objs_for_report(None, data)
+        self.assertFalse(self.Snapshot._find_snapshot(self.report_model, stream, data))
+
+    def test_records_after_cutoff(self):
+        snapshot = self._render()
+        late = self.env[LEDGER_MODEL].create({'owner_id': self.owner.id, 'pallets_received': 1})
+        self.assertFalse(self.Snapshot._find_snapshot(self.report_model, self.records | late, {}))
+        snapshot.cutoff = self.cutoff - datetime.timedelta(days=2)
+        self.assertFalse(self.Snapshot._find_snapshot(self.report_model, self.records, {}))
+
+    def test_records_of_today(self):
+        snapshot = self._render()
+        # after the cutoff: not in the snapshot, and not billed in it either
+        self.env[LEDGER_MODEL].create({'owner_id': self.owner.id, 'pallets_received': 1, 'total_balance_in_pallets': 4})
+        self.assertEqual(self.Snapshot._find_snapshot(self.report_model, self.records, {}), snapshot)
+
+    def test_record_edit(self):
+        self._render()
+        self.records[0].pallets_received = 6
+        self.assertFalse(self.Snapshot._find_snapshot(self.report_model, self.records, {}))
+
+    def test_render_moves_cutoff(self):
+        snapshot = self._render()
+        attachment = snapshot.attachment_id
+        next_cutoff = self.cutoff + datetime.timedelta(days=1)
+        # nothing changed: same file, later cutoff
+        with patch.object(type(self.report_model), '_get_snapshot_data', return_value={}):
+            self.assertEqual(self._render(next_cutoff), snapshot)
+        self.assertEqual(snapshot.cutoff, next_cutoff)
+        self.assertEqual(snapshot.attachment_id, attachment)
+        # an edited record: rendered again
+        self.records[1].pallets_withdrawn = 3
+        with patch.object(type(self.report_model), '_get_snapshot_data', return_value={}):
+            self._render(next_cutoff)
+        self.assertNotEqual(snapshot.attachment_id, attachment)
+        self.assertFalse(attachment.exists())
+        # billed one more day: rendered again
+        attachment = snapshot.attachment_id
+        self._render(next_cutoff)
+        self.assertEqual(snapshot.period_to, (self.cutoff + REPORT_UTC_OFFSET).date())
+        self.assertNotEqual(snapshot.attachment_id, attachment)
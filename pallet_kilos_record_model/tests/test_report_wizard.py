@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from odoo.tests import tagged
+
+from .common import InventoryStudioCase
+
+
+@tagged('post_install', '-at_install')
+class TestReportWizard(InventoryStudioCase):
+
+    def test_print(self):
+        owner = self.env['res.partner'].create({'name': 'Wizard Owner'})
+        wizard = self.env['pallet_kilos_record_model.report_wizard'].create({
+            'date_from': datetime.date(2024, 3, 1),
+            'date_to': datetime.date(2024, 3, 31),
+            'owner_ids': [(6, 0, owner.ids)],
+        })
+        self.assertEqual(wizard._get_domain(), [
+            ('create_date', '>=', '2024-02-29 16:00:00'),
+            ('create_date', '<', '2024-03-31 16:00:00'),
+            ('owner_id', 'in', owner.ids),
+        ])
+        action = wizard.action_print()
+        self.assertEqual(action['report_name'], 'pallet_kilos_record_model.pallet_kilos_report_xlsx')
+        self.assertEqual(action['data']['report_xlsx_domain']['domain'], wizard._get_domain())
+        # rendered in the background, like when printed from the list
+        self.assertEqual(action['xlsx_async'], wizard.report_id.xlsx_async)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from odoo.tests import tagged
+
+from .common import InventoryStudioCase
+
+LEDGER_MODEL = 'pallet_kilos_record_model.pallet_kilos_record_model'
+
+
+@tagged('post_install', '-at_install')
+class TestRunningBalance(InventoryStudioCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.owner = cls.env['res.partner'].create({'name': 'Running Balance Owner'})
+        cls.warehouse = cls.env['stock.warehouse'].create({'name': 'Running Balance Warehouse', 'code': 'RBW'})
+        cls.records = cls.env[LEDGER_MODEL].create([
+            {'owner_id': cls.owner.id, 'warehouse': cls.warehouse.id, 'pallets_received': 10, 'kilos_received': 100},
+            {'owner_id': cls.owner.id, 'warehouse': cls.warehouse.id, 'pallets_withdrawn': 3, 'kilos_withdrawn': 30},
+            {'owner_id': cls.owner.id, 'warehouse': cls.warehouse.id, 'pallets_received': 5, 'kilos_received': 50},
+        ])
+        cls.start = datetime.datetime(2024, 1, 1)
+        for day, record in enumerate(cls.records):
+            cls.env.cr.execute(
+                'UPDATE pallet_kilos_record_model_pallet_kilos_record_model SET create_date = %s WHERE id = %s',
+                [cls.start + datetime.timedelta(days=day), record.id],
+            )
+        cls.records.invalidate_recordset(['create_date'])
+
+    def test_full_recompute(self):
+        count = self.records.recompute_running_balances(owner_ids=self.owner.ids, warehouse_ids=self.warehouse.ids)
+        self.assertEqual(count, 3)
+        self.assertEqual(self.records.mapped('total_balance_in_pallets'), [10, 7, 12])
+        self.assertEqual(self.records.mapped('total_balance_in_kilos'), [100, 70, 120])
+        self.assertEqual(self.records.mapped('overall_pallets'), [10, 7, 12])
+        balance = self.env['pallet_kilos_record_model.daily_balance'].search([
+            ('owner_id', '=', self.owner.id), ('day', '=', datetime.date(2024, 1, 3)),
+        ])
+        self.assertEqual(balance.balance_pallets, 12)
+        # nothing changed, nothing written
+        self.assertEqual(self.records.recompute_running_balances(owner_ids=self.owner.ids), 0)
+
+    def test_tail_recompute(self):
+        self.records.recompute_running_balances(owner_ids=self.owner.ids, warehouse_ids=self.warehouse.ids)
+        # correct the first record and pretend it had an opening balance
+        self.records[0].write({'total_balance_in_pallets': 40})
+        self.records[1].write({'pallets_withdrawn': 1})
+        self.records[1].action_recompute_running_balances()
+        self.assertEqual(self.records.mapped('total_balance_in_pallets'), [40, 39, 44])
+        self.assertEqual(self.records.mapped('overall_pallets'), [10, 9, 14])
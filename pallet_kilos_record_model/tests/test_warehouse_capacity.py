@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import datetime
+import io
+from operator import itemgetter
+
+import xlsxwriter
+
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from .common import InventoryStudioCase
+
+LEDGER_MODEL = 'pallet_kilos_record_model.pallet_kilos_record_model'
+
+
+@tagged('post_install', '-at_install')
+class TestWarehouseCapacity(InventoryStudioCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.warehouse = cls.env['stock.warehouse'].create({'name': 'Capacity Warehouse', 'code': 'CAPW'})
+        cls.max_pallets = cls.env['x_inventory_static_var'].create({
+            'x_name': 'Max Pallets',
+            'x_studio_use_case': 'XLSX Variables',
+            'x_studio_warehouse': cls.warehouse.id,
+            'x_studio_float_value': 500.0,
+        })
+        cls.Capacity = cls.env['pallet_kilos_record_model.warehouse_capacity']
+
+    def test_cached_until_changed(self):
+        self.assertEqual(self.Capacity.get_capacities(self.warehouse.id), {'pallets': 500.0, 'kilos': None})
+        with self.assertQueryCount(0):
+            self.Capacity.get_capacities(self.warehouse.id)
+        self.max_pallets.x_studio_float_value = 800.0
+        self.assertEqual(self.Capacity.get_capacities(self.warehouse.id)['pallets'], 800.0)
+        self.env['x_inventory_static_var'].create({
+            'x_name': 'Max Kilograms (KG)',
+            'x_studio_use_case': 'XLSX Variables',
+            'x_studio_warehouse': self.warehouse.id,
+            'x_studio_float_value': 400000.0,
+        })
+        self.assertEqual(self.Capacity.check_capacities(self.warehouse), {'pallets': 800.0, 'kilos': 400000.0})
+        self.max_pallets.unlink()
+        self.assertIsNone(self.Capacity.get_capacities(self.warehouse.id)['pallets'])
+
+    def test_other_variables(self):
+        self.Capacity.get_capacities(self.warehouse.id)
+        # variables of other use cases and other models leave the cache alone
+        self.env['x_inventory_static_var'].create({
+            'x_name': 'Dock Doors',
+            'x_studio_use_case': 'XLSX Variables',
+            'x_studio_warehouse': self.warehouse.id,
+            'x_studio_float_value': 4.0,
+        })
+        self.warehouse.name = 'Capacity Warehouse 2'
+        with self.assertQueryCount(0):
+            self.Capacity.get_capacities(self.warehouse.id)
+
+    def test_missing_capacity(self):
+        with self.assertRaisesRegex(UserError, 'Max Kilograms'):
+            self.Capacity.check_capacities(self.warehouse)
+        lines = self.env[LEDGER_MODEL].create({'warehouse': self.warehouse.id, 'pallets_received': 1, 'overall_pallets': 1})
+        report = self.env['report.pallet_kilos_record_model.daily_inventory_report_xlsx']
+        with self.assertRaisesRegex(UserError, 'Capacity Warehouse'):
+            report.generate_xlsx_report(xlsxwriter.Workbook(io.BytesIO(), {'in_memory': True}), {}, lines)
+
+    def test_daily_lines_from_balances(self):
+        owners = self.env['res.partner'].create([{'name': 'Capacity Owner 1'}, {'name': 'Capacity Owner 2'}])
+        lines = self.env[LEDGER_MODEL].create([
+            {'warehouse': self.warehouse.id, 'owner_id': owners[0].id, 'pallets_received': 10, 'overall_pallets': 10},
+            {'warehouse': self.warehouse.id, 'owner_id': owners[1].id, 'pallets_received': 5, 'overall_pallets': 15},
+            {'warehouse': self.warehouse.id, 'owner_id': owners[0].id, 'pallets_withdrawn': 4, 'overall_pallets': 11},
+        ])
+        # two moves on March 1st and one on March 3rd (UTC+8)
+        dates = ['2024-03-01 01:00:00', '2024-03-01 02:00:00', '2024-03-02 20:00:00']
+        for line, date in zip(lines, dates):
+            self.env.cr.execute('UPDATE %s SET create_date = %%s WHERE id = %%s' % line._table, [date, line.id])
+        lines.invalidate_recordset(['create_date'])
+        self.env['pallet_kilos_record_model.daily_balance']._rebuild_daily_balances()
+        report = self.env['report.pallet_kilos_record_model.daily_inventory_report_xlsx']
+        # the whole warehouse: read from the daily balances, as replayed from the ledger
+        self.assertEqual(
+            report._get_warehouse_periods(lines),
+            {self.warehouse.id: (datetime.date(2024, 3, 1), datetime.date(2024, 3, 3))},
+        )
+        name, daily_lines = report._get_daily_lines_by_warehouse(lines)[self.warehouse.id]
+        self.assertEqual(name, 'Capacity Warehouse')
+        rows = sorted(report._iter_report_rows(lines), key=itemgetter('create_date'))
+        keys = itemgetter('day', 'pallets_received', 'pallets_withdrawn', 'overall_pallets')
+        self.assertEqual([keys(line) for line in daily_lines], [keys(line) for line in report._iter_daily_lines(rows)])
+        self.assertEqual([line['overall_pallets'] for line in daily_lines], [15, 15, 11])
+        # part of a day only: replayed
+        self.assertIsNone(report._get_warehouse_periods(lines[1:]))
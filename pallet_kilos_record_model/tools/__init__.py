@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+
+from . import report_time
+from . import daily_series
+from . import billing
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Holding and handling charges of an owner over a period, from its daily
+closing balances, in one pass over day-indexed arrays."""
+
+
+def compute_billing(date_from, date_to, daily_rows, opening=None, holding_rate=0.0, handling_rate=0.0):
+    """Bill the days from ``date_from`` to ``date_to`` (included).
+
+    :param daily_rows: dicts with the ``day``, the closing ``balance_pallets``
+        and ``balance_kilos`` and the ``pallets_received`` and
+        ``pallets_withdrawn`` of the days having moves, in the period
+    :param opening: dict with the ``balance_pallets`` and ``balance_kilos``
+        before the period, carried over its first days
+    :param holding_rate: charge per pallet and day
+    :param handling_rate: charge per pallet received or withdrawn
+    :return: dict with the ``pallet_days`` and ``kilo_days`` (sums of the
+        daily balances, the days without moves keeping the previous one), the
+        ``pallets_handled`` and the ``holding_charge``, ``handling_charge`` and
+        ``total_charge``
+    """
+    size = (date_to - date_from).days + 1
+    pallets = [None] * size
+    kilos = [None] * size
+    handled = [0.0] * size
+    for row in daily_rows:
+        index = (row['day'] - date_from).days
+        if 0 <= index < size:
+            pallets[index] = row['balance_pallets'] or 0
+            kilos[index] = row['balance_kilos'] or 0
+            handled[index] = (row['pallets_received'] or 0) + (row['pallets_withdrawn'] or 0)
+    last_pallets = (opening or {}).get('balance_pallets') or 0
+    last_kilos = (opening or {}).get('balance_kilos') or 0
+    pallet_days = kilo_days = 0.0
+    for index in range(size):
+        if pallets[index] is not None:
+            last_pallets, last_kilos = pallets[index], kilos[index]
+        pallet_days += last_pallets
+        kilo_days += last_kilos
+    pallets_handled = sum(handled)
+    holding_charge = pallet_days * (holding_rate or 0)
+    handling_charge = pallets_handled * (handling_rate or 0)
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'days': size,
+        'pallet_days': pallet_days,
+        'kilo_days': kilo_days,
+        'pallets_handled': pallets_handled,
+        'holding_rate': holding_rate or 0,
+        'handling_rate': handling_rate or 0,
+        'holding_charge': holding_charge,
+        'handling_charge': handling_charge,
+        'total_charge': holding_charge + handling_charge,
+    }
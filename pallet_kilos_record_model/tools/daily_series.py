@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Single pass helpers turning ledger lines into one row per calendar day.
+
+All of them take and return iterators, so that a report can write each day as
+soon as it is produced:
+
+- ``iter_day_buckets`` groups lines sorted by date into (day, lines) pairs,
+- ``aggregate_days`` sums some keys of each bucket and keeps the last value of
+  others (closing balances),
+- ``fill_days`` inserts a row for each day missing between the rows, made by a
+  fill function such as ``carry_forward``,
+- ``add_rolling_stats`` adds rolling averages and peaks over day windows to a
+  complete daily series.
+"""
+import collections
+import datetime
+import itertools
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def _to_day(value, offset=None):
+    if offset:
+        value += offset
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+def iter_day_buckets(lines, date_key='create_date', offset=None):
+    """Group ``lines``, sorted by ``date_key``, by day.
+
+    :param offset: timedelta added to the dates before taking their day, to
+        bucket UTC datetimes by local day
+    :return: iterator of (date, list of lines) pairs, one per day having lines
+    """
+    buckets = itertools.groupby(lines, key=lambda line: _to_day(line[date_key], offset))
+    for day, day_lines in buckets:
+        yield day, list(day_lines)
+
+
+def aggregate_days(lines, date_key='create_date', offset=None, sum_keys=(), last_keys=(), first_keys=()):
+    """One row per day of ``lines`` (sorted by ``date_key``) with the ``day``,
+    the sums of ``sum_keys`` (None counting as 0), the values of ``last_keys``
+    on the last line of the day and of ``first_keys`` on the first one."""
+    for day, day_lines in iter_day_buckets(lines, date_key, offset):
+        row = {'day': day}
+        for key in first_keys:
+            row[key] = day_lines[0][key]
+        for key in sum_keys:
+            row[key] = sum(line[key] or 0 for line in day_lines)
+        for key in last_keys:
+            row[key] = day_lines[-1][key]
+        yield row
+
+
+def fill_days(rows, fill, start=None, end=None, day_key='day'):
+    """Yield ``rows``, sorted by ``day_key`` with at most one row per day, and
+    a row for each missing day from ``start`` (by default the first row) to
+    ``end`` (by default the last row).
+
+    :param fill: function(day, previous row or None) returning the row of a
+        missing day
+    """
+    previous = None
+    expected = start
+    for row in rows:
+        day = row[day_key]
+        if expected is None:
+            expected = day
+        while expected < day:
+            previous = fill(expected, previous)
+            yield previous
+            expected += ONE_DAY
+        yield row
+        previous = row
+        expected = day + ONE_DAY
+    if end is not None and expected is not None:
+        while expected <= end:
+            previous = fill(expected, previous)
+            yield previous
+            expected += ONE_DAY
+
+
+def carry_forward(carried_keys, zero_keys=(), defaults=None, day_key='day'):
+    """Fill function for ``fill_days``: the values of ``carried_keys`` are
+    those of the previous day (0 before the first one), ``zero_keys`` are 0 and
+    the other keys are taken from ``defaults``."""
+    def fill(day, previous):
+        row = dict(defaults or {})
+        row[day_key] = day
+        for key in zero_keys:
+            row[key] = 0
+        for key in carried_keys:
+            row[key] = previous[key] if previous else 0
+        return row
+    return fill
+
+
+def rolling_averages(values, window):
+    """Average of the last ``window`` values at each position (of the values so
+    far while fewer), from prefix sums: O(len(values)) whatever the window."""
+    prefix = [0]
+    for value in values:
+        prefix.append(prefix[-1] + (value or 0))
+    return [
+        (prefix[index] - prefix[max(0, index - window)]) / min(window, index)
+        for index in range(1, len(prefix))
+    ]
+
+
+def rolling_maximums(values, window):
+    """Maximum of the last ``window`` values at each position, keeping the
+    candidates in a decreasing deque: O(len(values)) whatever the window."""
+    values = [value or 0 for value in values]
+    candidates = collections.deque()
+    maximums = []
+    for index, value in enumerate(values):
+        while candidates and values[candidates[-1]] <= value:
+            candidates.pop()
+        candidates.append(index)
+        if candidates[0] <= index - window:
+            candidates.popleft()
+        maximums.append(values[candidates[0]])
+    return maximums
+
+
+def add_rolling_stats(rows, keys, windows, capacities=None):
+    """Add to each of ``rows`` (one per day) the rolling averages and peaks of
+    ``keys`` over each of ``windows`` days, as ``<key>_avg_<window>`` and
+    ``<key>_peak_<window>``. When ``capacities`` gives the capacity of a key,
+    also add them as rates of the capacity, ``<key>_avg_rate_<window>`` and
+    ``<key>_peak_rate_<window>``. Return the rows."""
+    capacities = capacities or {}
+    for key in keys:
+        values = [row[key] for row in rows]
+        capacity = capacities.get(key)
+        for window in windows:
+            averages = rolling_averages(values, window)
+            peaks = rolling_maximums(values, window)
+            for row, average, peak in zip(rows, averages, peaks):
+                row['%s_avg_%d' % (key, window)] = average
+                row['%s_peak_%d' % (key, window)] = peak
+                if capacity:
+                    row['%s_avg_rate_%d' % (key, window)] = average / capacity
+                    row['%s_peak_rate_%d' % (key, window)] = peak / capacity
+    return rows
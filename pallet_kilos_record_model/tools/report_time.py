@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""Time of the reports: dates are printed, and records grouped by day, in UTC+8."""
+import datetime
+
+from odoo.tools import SQL
+
+REPORT_UTC_OFFSET = datetime.timedelta(hours=8)
+
+
+def report_day_sql(column):
+    """SQL date of ``column``, a UTC timestamp, in the time of the reports."""
+    return SQL('(%s + make_interval(secs => %s))::date', column, REPORT_UTC_OFFSET.total_seconds())
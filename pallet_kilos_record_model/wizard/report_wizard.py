@@ -0,0 +1,56 @@
+import datetime
+
+from odoo import models, fields, api
+from odoo.exceptions import ValidationError
+
+from ..tools.report_time import REPORT_UTC_OFFSET
+
+LEDGER_MODEL = 'pallet_kilos_record_model.pallet_kilos_record_model'
+
+
+class PalletKilosReportWizard(models.TransientModel):
+    """Print a pallet/kilos report on a period, warehouses and owners. The
+    filters are sent as a domain, so the report searches the matching records
+    itself (see ``RecordStream``) instead of receiving the selected ids."""
+    _name = 'pallet_kilos_record_model.report_wizard'
+    _description = 'Pallet/Kilos XLSX Report Wizard'
+
+    report_id = fields.Many2one(
+        'ir.actions.report', 'Report', required=True,
+        domain=[('model', '=', LEDGER_MODEL), ('report_type', '=', 'xlsx')],
+        default=lambda self: self.env.ref('pallet_kilos_record_model.pallet_kilos_inventory', raise_if_not_found=False),
+    )
+    date_from = fields.Date('From', required=True, default=lambda self: fields.Date.today().replace(day=1))
+    date_to = fields.Date('To', required=True, default=fields.Date.today)
+    warehouse_ids = fields.Many2many('stock.warehouse', string='Warehouses', help="All warehouses when empty.")
+    owner_ids = fields.Many2many('res.partner', string='Owners', help="All owners when empty.")
+
+    @api.constrains('date_from', 'date_to')
+    def _check_dates(self):
+        for wizard in self:
+            if wizard.date_from > wizard.date_to:
+                raise ValidationError("The start date must be before the end date.")
+
+    def _get_domain(self):
+        """Ledger records of the period (days in UTC+8) and filters."""
+        self.ensure_one()
+        start = datetime.datetime.combine(self.date_from, datetime.time.min) - REPORT_UTC_OFFSET
+        end = datetime.datetime.combine(self.date_to + datetime.timedelta(days=1), datetime.time.min) - REPORT_UTC_OFFSET
+        domain = [
+            ('create_date', '>=', fields.Datetime.to_string(start)),
+            ('create_date', '<', fields.Datetime.to_string(end)),
+        ]
+        if self.warehouse_ids:
+            domain.append(('warehouse', 'in', self.warehouse_ids.ids))
+        if self.owner_ids:
+            domain.append(('owner_id', 'in', self.owner_ids.ids))
+        return domain
+
+    def action_print(self):
+        self.ensure_one()
+        data = {
+            'report_xlsx_domain': {'model': LEDGER_MODEL, 'domain': self._get_domain()},
+            'date_from': fields.Date.to_string(self.date_from),
+            'date_to': fields.Date.to_string(self.date_to),
+        }
+        return self.report_id.report_action(None, data=data)
@@ -4,48 +4,116 @@
 
 import json
 import logging
+import os
 
 from werkzeug.urls import url_decode
+from werkzeug.wsgi import wrap_file
 
 from odoo.http import (
+    Response,
+    Stream,
     content_disposition,
     request,
     route,
     serialize_exception as _serialize_exception,
 )
 from odoo.tools import html_escape
-from odoo.tools.safe_eval import safe_eval, time
 
 from odoo.addons.web.controllers.report import ReportController
 
+from ..tools.render_stats import RenderStats
+
 _logger = logging.getLogger(__name__)
 
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+XLSX_STREAM_CHUNK_SIZE = 64 * 1024
+
 
 class ReportController(ReportController):
+    def _make_xlsx_response(self, xlsx, headers=None, content_type=XLSX_CONTENT_TYPE):
+        """Build the download response for a rendered workbook.
+
+        ``xlsx`` is either the file content or, for streaming reports, a rewound
+        file object which is sent in chunks and closed once the response is done.
+        """
+        headers = [("Content-Type", content_type)] + list(headers or [])
+        if isinstance(xlsx, bytes):
+            headers.append(("Content-Length", len(xlsx)))
+            return request.make_response(xlsx, headers=headers)
+        size = xlsx.seek(0, os.SEEK_END)
+        xlsx.seek(0)
+        headers.append(("Content-Length", size))
+        return Response(
+            wrap_file(request.httprequest.environ, xlsx, XLSX_STREAM_CHUNK_SIZE),
+            headers=headers,
+            direct_passthrough=True,
+        )
+
+    def _get_xlsx_etag_headers(self, etag):
+        # the file depends on the user: only their browser may keep it, and it
+        # must check with us that it is still fresh before using it
+        return [("ETag", f'"{etag}"'), ("Cache-Control", "private, no-cache")]
+
+    def _parse_xlsx_url(self, url, context=None):
+        """Split a ``/report/xlsx/...`` url into the report name, the comma
+        separated docids and the keyword arguments of ``report_routes``."""
+        reportname = url.split("/report/xlsx/")[1].split("?")[0]
+        docids = None
+        if "/" in reportname:
+            reportname, docids = reportname.split("/")
+        if docids:
+            # Generic report:
+            return reportname, docids, {"context": context}
+        # Particular report:
+        data = dict(
+            url_decode(url.split("?")[1]).items()
+        )  # decoding the args represented in JSON
+        if "context" in data:
+            context, data_context = json.loads(context or "{}"), json.loads(
+                data.pop("context")
+            )
+            context = json.dumps({**context, **data_context})
+        return reportname, None, dict(data, context=context)
+
+    def _get_xlsx_report_args(self, docids=None, **data):
+        """Decode the ``report_routes`` arguments into docids, data and context."""
+        context = dict(request.env.context)
+        if docids:
+            docids = [int(i) for i in docids.split(",")]
+        if data.get("options"):
+            data.update(json.loads(data.pop("options")))
+        if data.get("context"):
+            data["context"] = json.loads(data["context"])
+            context.update(data["context"])
+        return docids, data, context
+
     @route()
     def report_routes(self, reportname, docids=None, converter=None, **data):
         if converter == "xlsx":
             report = request.env["ir.actions.report"]._get_report_from_name(reportname)
-            context = dict(request.env.context)
-            if docids:
-                docids = [int(i) for i in docids.split(",")]
-            if data.get("options"):
-                data.update(json.loads(data.pop("options")))
-            if data.get("context"):
-                data["context"] = json.loads(data["context"])
-                context.update(data["context"])
+            docids, data, context = self._get_xlsx_report_args(docids, **data)
+            # fingerprint the data once, for the ETag and the result cache
+            cache_key = report.with_context(**context)._get_xlsx_cache_key(
+                reportname, docids, data
+            )
+            etag = cache_key and report._get_xlsx_etag(
+                reportname, docids, cache_key=cache_key
+            )
+            if etag and request.httprequest.if_none_match.contains(etag):
+                return Response(status=304, headers=self._get_xlsx_etag_headers(etag))
+            stats = RenderStats(request.env.cr)
+            context.update(
+                report_xlsx_stream=True,
+                report_xlsx_stats=stats,
+                report_xlsx_cache_key=cache_key,
+            )
             xlsx = report.with_context(**context)._render_xlsx(
                 reportname, docids, data=data
             )[0]
-            xlsxhttpheaders = [
-                (
-                    "Content-Type",
-                    "application/vnd.openxmlformats-"
-                    "officedocument.spreadsheetml.sheet",
-                ),
-                ("Content-Length", len(xlsx)),
-            ]
-            return request.make_response(xlsx, headers=xlsxhttpheaders)
+            headers = [("Server-Timing", stats.server_timing())]
+            if etag:
+                headers += self._get_xlsx_etag_headers(etag)
+            return self._make_xlsx_response(xlsx, headers=headers)
         return super().report_routes(reportname, docids, converter, **data)
 
     @route()
@@ -54,42 +122,17 @@ class ReportController(ReportController):
         url, report_type = requestcontent[0], requestcontent[1]
         if report_type == "xlsx":
             try:
-                reportname = url.split("/report/xlsx/")[1].split("?")[0]
-                docids = None
-                if "/" in reportname:
-                    reportname, docids = reportname.split("/")
-                if docids:
-                    # Generic report:
-                    response = self.report_routes(
-                        reportname, docids=docids, converter="xlsx", context=context
-                    )
-                else:
-                    # Particular report:
-                    data = dict(
-                        url_decode(url.split("?")[1]).items()
-                    )  # decoding the args represented in JSON
-                    if "context" in data:
-                        context, data_context = json.loads(context or "{}"), json.loads(
-                            data.pop("context")
-                        )
-                        context = json.dumps({**context, **data_context})
-                    response = self.report_routes(
-                        reportname, converter="xlsx", context=context, **data
-                    )
+                reportname, docids, kwargs = self._parse_xlsx_url(url, context)
+                response = self.report_routes(
+                    reportname, docids=docids, converter="xlsx", **kwargs
+                )
 
                 report = request.env["ir.actions.report"]._get_report_from_name(
                     reportname
                 )
-                filename = "%s.%s" % (report.name, "xlsx")
-
-                if docids:
-                    ids = [int(x) for x in docids.split(",")]
-                    obj = request.env[report.model].browse(ids)
-                    if report.print_report_name and not len(obj) > 1:
-                        report_name = safe_eval(
-                            report.print_report_name, {"object": obj, "time": time}
-                        )
-                        filename = "%s.%s" % (report_name, "xlsx")
+                filename = report._get_xlsx_filename(
+                    docids and [int(x) for x in docids.split(",")]
+                )
                 if not response.headers.get("Content-Disposition"):
                     response.headers.add(
                         "Content-Disposition", content_disposition(filename)
@@ -102,3 +145,119 @@ class ReportController(ReportController):
                 return request.make_response(html_escape(json.dumps(error)))
         else:
             return super().report_download(data, context=context, token=token)
+
+    @route(
+        "/report/xlsx_zip/<reportname>/<docids>",
+        type="http",
+        auth="user",
+        methods=["POST"],
+    )
+    def report_xlsx_zip(self, reportname, docids, context=None, attachments=None):
+        """Download one workbook per record in a ZIP archive.
+
+        :param attachments: "1" to also save each workbook on its record, "0" not
+            to, by default as set up on the report
+        """
+        report = request.env["ir.actions.report"]._get_report_from_name(reportname)
+        docids, data, context = self._get_xlsx_report_args(docids, context=context)
+        save_attachments = {"1": True, "0": False}.get(attachments)
+        archive = report.with_context(**context)._render_xlsx_batch(
+            docids, data, save_attachments=save_attachments
+        )
+        return self._make_xlsx_response(
+            archive,
+            headers=[
+                ("Content-Disposition", content_disposition(f"{report.name}.zip"))
+            ],
+            content_type="application/zip",
+        )
+
+    @route(
+        "/report/xlsx_domain/<reportname>",
+        type="http",
+        auth="user",
+        methods=["POST"],
+    )
+    def report_xlsx_domain(
+        self,
+        reportname,
+        domain="[]",
+        date_field=None,
+        date_from=None,
+        date_to=None,
+        group_by=None,
+        **data,
+    ):
+        """Download the report of the records matching a domain.
+
+        Unlike ``report_routes``, the records are not listed in the url but
+        searched chunk after chunk while the report is written, see
+        ``RecordStream``.
+
+        :param domain: JSON domain on the model of the report
+        :param date_field: date field filtered between ``date_from`` and
+            ``date_to`` (included), when given
+        :param group_by: field to walk the records group after group
+        """
+        report = request.env["ir.actions.report"]._get_report_from_name(reportname)
+        if report.report_type != "xlsx":
+            raise request.not_found()
+        __, data, context = self._get_xlsx_report_args(**data)
+        data["report_xlsx_domain"] = {
+            "model": report.model,
+            "domain": json.loads(domain),
+            "date_field": date_field,
+            "date_from": date_from,
+            "date_to": date_to,
+            "group_by": group_by,
+        }
+        stats = RenderStats(request.env.cr)
+        context.update(report_xlsx_stream=True, report_xlsx_stats=stats)
+        report = report.with_context(**context)
+        xlsx = report._render_xlsx(reportname, None, data=data)[0]
+        return self._make_xlsx_response(
+            xlsx,
+            headers=[
+                ("Server-Timing", stats.server_timing()),
+                (
+                    "Content-Disposition",
+                    content_disposition(report._get_xlsx_filename()),
+                ),
+            ],
+        )
+
+    @route("/report/xlsx/job", type="json", auth="user")
+    def report_xlsx_job_create(self, data, context=None):
+        """Queue the rendering of an xlsx report url, see ``report_download``.
+
+        :return: id of the ``report.xlsx.job`` to poll
+        """
+        url = json.loads(data)[0]
+        reportname, docids, kwargs = self._parse_xlsx_url(url, context)
+        report = request.env["ir.actions.report"]._get_report_from_name(reportname)
+        docids, data, context = self._get_xlsx_report_args(docids, **kwargs)
+        job = request.env["report.xlsx.job"].create_job(
+            report,
+            docids,
+            data,
+            context,
+            report._get_xlsx_filename(docids),
+        )
+        return job.id
+
+    @route("/report/xlsx/job/<int:job_id>", type="json", auth="user")
+    def report_xlsx_job_status(self, job_id):
+        # searched, not browsed: jobs of other users are not found either
+        job = request.env["report.xlsx.job"].search([("id", "=", job_id)])
+        if not job:
+            raise request.not_found()
+        return {"state": job.state, "error": job.error}
+
+    @route("/report/xlsx/job/<int:job_id>/download", type="http", auth="user")
+    def report_xlsx_job_download(self, job_id, **kwargs):
+        job = request.env["report.xlsx.job"].search([("id", "=", job_id)])
+        if not job or job.state != "done" or not job.attachment_id:
+            raise request.not_found()
+        return Stream.from_attachment(job.sudo().attachment_id).get_response(
+            as_attachment=True
+        )
@@ -1,13 +1,51 @@
 # Copyright 2015 ACSONE SA/NV (<http://acsone.eu>)
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
+import hashlib
 import logging
+import multiprocessing
+import os
+import runpy
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+from tempfile import SpooledTemporaryFile
 
-from odoo import api, exceptions, fields, models
+import odoo
+from odoo import api, exceptions, fields, models, tools
+from odoo.tools import config
 from odoo.tools.safe_eval import safe_eval, time
 
+from ..tools.render_stats import RenderStats
+from ..tools.result_cache import get_result_cache
+from .report_xlsx_job import XLSX_MIMETYPE
+
 _logger = logging.getLogger(__name__)
 
+# ZIP archives stay in memory up to this size, then spill to a temp file
+XLSX_ZIP_SPOOL_MAX_SIZE = 32 * 1024 * 1024
+# Name prefix of the attachments sharing cached results between workers
+XLSX_CACHE_ATTACHMENT_PREFIX = "report_xlsx_cache/"
+# Run at the start of the batch render processes, see _render_xlsx_batch
+XLSX_BATCH_BOOTSTRAP = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "tools", "batch_bootstrap.py"
+)
+
+
+def _render_xlsx_batch_process(dbname, uid, context, report_id, docid, data):
+    """Render the workbook of record ``docid`` in a batch render process, see
+    ``ReportAction._render_xlsx_batch``. Its transaction is rolled back: the
+    caller saves what has to be."""
+    threading.current_thread().dbname = dbname
+    with odoo.registry(dbname).cursor() as cr:
+        try:
+            env = api.Environment(cr, uid, context)
+            report = env["ir.actions.report"].browse(report_id)
+            return report._render_xlsx_batch_record(docid, data)
+        finally:
+            cr.rollback()
+
 
 class ReportAction(models.Model):
     _inherit = "ir.actions.report"
@@ -15,47 +53,322 @@ class ReportAction(models.Model):
     report_type = fields.Selection(
         selection_add=[("xlsx", "XLSX")], ondelete={"xlsx": "set default"}
     )
+    xlsx_async = fields.Boolean(
+        string="Render in Background",
+        help="Render the XLSX report in a background job instead of the HTTP "
+        "request, and download it once ready.",
+    )
+
+    xlsx_zip = fields.Boolean(
+        string="One Workbook per Record",
+        help="When printed on several records, download one XLSX file per record "
+        "in a ZIP archive.",
+    )
+
+    def _get_readable_fields(self):
+        return super()._get_readable_fields() | {"xlsx_async", "xlsx_zip"}
+
+    def report_action(self, docids, data=None, config=True):
+        action = super().report_action(docids, data=data, config=config)
+        if self.report_type == "xlsx" and action.get("type") == "ir.actions.report":
+            # returned by a button, not read: add the flags the web client reads
+            action.update(xlsx_async=self.xlsx_async, xlsx_zip=self.xlsx_zip)
+        return action
 
     @api.model
     def _render_xlsx(self, report_ref, docids, data):
         report_sudo = self._get_report(report_ref)
         report_model_name = "report.%s" % report_sudo.report_name
-        report_model = self.env[report_model_name]
-        ret = (
-            report_model.with_context(active_model=report_sudo.model)
+        stats = self.env.context.get("report_xlsx_stats") or RenderStats(self.env.cr)
+        # already computed by the caller, see _get_xlsx_cache_key
+        cache_key = self.env.context.get("report_xlsx_cache_key")
+        report_model = (
+            self.env[report_model_name]
+            .with_context(
+                active_model=report_sudo.model,
+                report_xlsx_stats=stats,
+                report_xlsx_cache_key=None,
+            )
             .sudo(False)
-            .create_xlsx_report(docids, data)  # noqa
         )
+        cache = content = None
+        if report_model.is_cacheable_report():
+            with stats.phase("cache"):
+                cache = get_result_cache(self.env.cr.dbname)
+                if cache_key is None:
+                    cache_key = report_model._get_report_cache_key(docids, data)
+                if cache_key is not None:
+                    content = cache.get(cache_key)
+                if cache_key is not None and content is None:
+                    # rendered by another worker process
+                    content = self._get_shared_xlsx_result(cache, cache_key)
+                    if content is not None:
+                        cache.set(cache_key, content)
+        if content is not None:
+            _logger.debug("XLSX report %s served from cache", report_model_name)
+            ret = content, "xlsx"
+            stats.size = len(content)
+        else:
+            ret = report_model.create_xlsx_report(docids, data)  # noqa
+            if cache and cache_key and ret and isinstance(ret, (tuple, list)):
+                with stats.phase("cache"):
+                    self._cache_xlsx_result(cache, cache_key, ret[0])
         if ret and isinstance(ret, (tuple, list)):  # data, "xlsx"
-            report_sudo.save_xlsx_report_attachment(docids, ret[0])
+            with stats.phase("attachment"):
+                report_sudo.save_xlsx_report_attachment(docids, ret[0])
+        _logger.info("XLSX report %s rendered: %s", report_sudo.report_name, stats)
         return ret
 
+    @api.model
+    def _cache_xlsx_result(self, cache, cache_key, content):
+        if hasattr(content, "read"):  # streamed, only cache it when small enough
+            size = content.seek(0, 2)
+            if size > cache.max_bytes:
+                content.seek(0)
+                return
+            content.seek(0)
+            content, stream = content.read(), content
+            stream.seek(0)
+        if len(content) > cache.max_bytes:
+            return
+        cache.set(cache_key, content)
+        self.env["ir.attachment"].sudo().create(
+            {
+                "name": self._get_xlsx_cache_name(cache_key),
+                "raw": content,
+                "res_model": self._name,
+                "mimetype": XLSX_MIMETYPE,
+            }
+        )
+
+    @api.model
+    def _get_xlsx_cache_name(self, cache_key):
+        return (
+            XLSX_CACHE_ATTACHMENT_PREFIX
+            + hashlib.sha1(repr(cache_key).encode()).hexdigest()
+        )
+
+    @api.model
+    def _get_shared_xlsx_result(self, cache, cache_key):
+        """Result cached by any worker process of the database: the in-process
+        cache is backed by attachments, kept as long as its entries."""
+        attachment = (
+            self.env["ir.attachment"]
+            .sudo()
+            .search(
+                [
+                    ("name", "=", self._get_xlsx_cache_name(cache_key)),
+                    ("res_model", "=", self._name),
+                    (
+                        "create_date",
+                        ">=",
+                        fields.Datetime.now() - timedelta(seconds=cache.max_age),
+                    ),
+                ],
+                order="id desc",
+                limit=1,
+            )
+        )
+        return attachment.raw if attachment else None
+
+    @api.autovacuum
+    def _gc_xlsx_result_cache(self):
+        """Remove the shared cached results older than the cache maximum age."""
+        max_age = get_result_cache(self.env.cr.dbname).max_age
+        self.env["ir.attachment"].sudo().search(
+            [
+                ("name", "=like", XLSX_CACHE_ATTACHMENT_PREFIX + "%"),
+                ("res_model", "=", self._name),
+                (
+                    "create_date",
+                    "<",
+                    fields.Datetime.now() - timedelta(seconds=max_age),
+                ),
+            ]
+        ).unlink()
+
+    @api.model
+    def _get_xlsx_cache_key(self, report_ref, docids, data=None):
+        """Result cache key of the file that ``_render_xlsx`` would return,
+        computed without rendering. Pass it to ``_render_xlsx`` in the
+        ``report_xlsx_cache_key`` context key so it is not computed twice.
+
+        :return: tuple, or None when the report can't be fingerprinted
+        """
+        report_sudo = self._get_report(report_ref)
+        report_model = (
+            self.env["report.%s" % report_sudo.report_name]
+            .with_context(active_model=report_sudo.model)
+            .sudo(False)
+        )
+        if not report_model.is_cacheable_report():
+            return None
+        return report_model._get_report_cache_key(docids, data)
+
+    @api.model
+    def _get_xlsx_etag(self, report_ref, docids, data=None, cache_key=None):
+        """Entity tag of the file that ``_render_xlsx`` would return, derived
+        from its result cache key. Only cacheable reports, whose key includes a
+        fingerprint of their data, have one.
+
+        :return: string, or None when the report can't be fingerprinted
+        """
+        if cache_key is None:
+            cache_key = self._get_xlsx_cache_key(report_ref, docids, data)
+        if cache_key is None:
+            return None
+        return hashlib.sha1(repr(cache_key).encode()).hexdigest()
+
+    @api.model
+    def get_xlsx_cache_stats(self):
+        """Hit/miss counters of the XLSX result cache of this database."""
+        return get_result_cache(self.env.cr.dbname).stats()
+
     @api.model
     def _get_report_from_name(self, report_name):
-        res = super()._get_report_from_name(report_name)
-        if res:
-            return res
-        report_obj = self.env["ir.actions.report"]
-        qwebtypes = ["xlsx"]
-        conditions = [
-            ("report_type", "in", qwebtypes),
-            ("report_name", "=", report_name),
-        ]
+        report_id = self._get_report_id_from_name(report_name)
         context = self.env["res.users"].context_get()
-        return report_obj.with_context(**context).search(conditions, limit=1)
+        report_obj = self.env["ir.actions.report"].with_context(**context)
+        return report_obj.sudo().browse(report_id)
+
+    @api.model
+    @tools.ormcache("report_name")
+    def _get_report_id_from_name(self, report_name):
+        """Id of the report named ``report_name``, memoized in the registry cache.
+        ``ir.actions`` clears that cache whenever an action is created, written
+        or deleted, so renamed or new reports are found right away."""
+        report = super()._get_report_from_name(report_name)
+        if not report:
+            report_obj = self.env["ir.actions.report"].sudo()
+            qwebtypes = ["xlsx"]
+            conditions = [
+                ("report_type", "in", qwebtypes),
+                ("report_name", "=", report_name),
+            ]
+            report = report_obj.search(conditions, limit=1)
+        return report.id
+
+    def _get_xlsx_filename(self, docids=None):
+        """File name of the report, from its print name for a single record."""
+        self.ensure_one()
+        filename = "%s.%s" % (self.name, "xlsx")
+        if docids:
+            obj = self.env[self.model].browse(docids)
+            if self.print_report_name and not len(obj) > 1:
+                report_name = safe_eval(
+                    self.print_report_name, {"object": obj, "time": time}
+                )
+                filename = "%s.%s" % (report_name, "xlsx")
+        return filename
+
+    def _render_xlsx_batch(
+        self, docids, data=None, save_attachments=None, workers=None
+    ):
+        """Render one workbook per record and return them as a ZIP archive.
+
+        Records are rendered concurrently by ``workers`` processes (server
+        option ``report_xlsx_batch_workers``, 4 by default), spawned for the
+        batch, each rendering with its own cursor and committing nothing. The
+        workbooks are saved as attachments on the current cursor once the
+        archive is complete, so a failed render or archive saves none.
+
+        :param save_attachments: save each workbook as an attachment of its
+            record: ``True`` always, ``False`` never, ``None`` when the report
+            is set up to (``attachment`` field)
+        :return: rewound spooled temporary file of the ZIP archive
+        """
+        self.ensure_one()
+        workers = workers or int(config.get("report_xlsx_batch_workers") or 4)
+        if save_attachments is None:
+            save_attachments = bool(self.attachment)
+        context = {
+            key: value
+            for key, value in self.env.context.items()
+            if key not in ("report_xlsx_stats", "report_xlsx_stream")
+        }
+        context["report_xlsx_save_attachment"] = False
+        contents = {}
+
+        def collect(docid, content):
+            if save_attachments:
+                contents[docid] = content
+            return docid, (self._get_xlsx_filename([docid]), content)
+
+        if workers <= 1 or len(docids) <= 1:
+            render = self.with_context(**context)._render_xlsx_batch_record
+            archive = self._zip_xlsx_batch(
+                collect(docid, render(docid, data)) for docid in docids
+            )
+        else:
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(docids)),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=runpy.run_path,
+                initargs=(XLSX_BATCH_BOOTSTRAP, {"options": dict(config.options)}),
+            ) as pool:
+                args = (self.env.cr.dbname, self.env.uid, context, self.id)
+                futures = {
+                    pool.submit(_render_xlsx_batch_process, *args, docid, data): docid
+                    for docid in docids
+                }
+                archive = self._zip_xlsx_batch(
+                    collect(futures[future], future.result())
+                    for future in as_completed(futures)
+                )
+        report = self.with_context(report_xlsx_save_attachment=True)
+        for docid, content in contents.items():
+            report.save_xlsx_report_attachment([docid], content)
+        return archive
+
+    def _render_xlsx_batch_record(self, docid, data):
+        """Render the workbook of record ``docid``."""
+        content = self._render_xlsx(self.report_name, [docid], data)[0]
+        if hasattr(content, "read"):
+            with content:
+                content = content.read()
+        return content
+
+    def _zip_xlsx_batch(self, results):
+        file_data = SpooledTemporaryFile(max_size=XLSX_ZIP_SPOOL_MAX_SIZE)
+        names = set()
+        with zipfile.ZipFile(file_data, "w", zipfile.ZIP_DEFLATED) as archive:
+            for docid, (filename, content) in results:
+                filename = filename.replace("/", "_")
+                if filename in names:
+                    base, ext = os.path.splitext(filename)
+                    filename = f"{base} ({docid}){ext}"
+                names.add(filename)
+                archive.writestr(filename, content)
+        file_data.seek(0)
+        return file_data
 
     def save_xlsx_report_attachment(self, docids, report_contents):
-        """Save as attachment when the report is set up as such."""
+        """Save as attachment when the report is set up as such, or when forced
+        with the ``report_xlsx_save_attachment`` context key."""
         # Similar to ir.actions.report::_render_qweb_pdf in the base module.
-        if not self.attachment:
+        save_attachment = self.env.context.get("report_xlsx_save_attachment")
+        if save_attachment is None:
+            save_attachment = bool(self.attachment)
+        if not save_attachment:
             return
-        if len(docids) != 1:  # unlike PDFs, here we don't have multiple streams
+        if (
+            not docids or len(docids) != 1
+        ):  # unlike PDFs, here we don't have multiple streams
             _logger.warning(f"{self.name}: No records to save attachments onto.")
             return
         record = self.env[self.model].browse(docids)
-        attachment_name = safe_eval(self.attachment, {"object": record, "time": time})
+        if self.attachment:
+            attachment_name = safe_eval(
+                self.attachment, {"object": record, "time": time}
+            )
+        else:
+            attachment_name = self._get_xlsx_filename(docids)
         if not attachment_name:
             return  # same as for PDFs, get out silently when name fails
+        if hasattr(report_contents, "read"):  # streamed report, keep it rewound
+            report_contents.seek(0)
+            report_contents, stream = report_contents.read(), report_contents
+            stream.seek(0)
         attachment_values = {
             "name": attachment_name,
             "raw": report_contents,
@@ -0,0 +1,156 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import logging
+import threading
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+class ReportXlsxJob(models.Model):
+    """XLSX report rendered in the background by the cron workers, so that heavy
+    reports do not hold an HTTP worker nor run into the time limits of HTTP
+    requests: they run within the limits of the cron workers instead
+    (``limit_time_real_cron``). The web client polls the job state and
+    downloads the resulting attachment."""
+
+    _name = "report.xlsx.job"
+    _description = "Background XLSX Report Job"
+    _order = "id desc"
+
+    report_id = fields.Many2one(
+        "ir.actions.report", required=True, ondelete="cascade", readonly=True
+    )
+    user_id = fields.Many2one(
+        "res.users",
+        required=True,
+        ondelete="cascade",
+        readonly=True,
+        default=lambda self: self.env.user,
+    )
+    state = fields.Selection(
+        [
+            ("pending", "Pending"),
+            ("running", "Running"),
+            ("done", "Done"),
+            ("failed", "Failed"),
+        ],
+        default="pending",
+        required=True,
+        index=True,
+        readonly=True,
+    )
+    docids = fields.Json(readonly=True)
+    data = fields.Json(readonly=True)
+    context = fields.Json(readonly=True)
+    filename = fields.Char(readonly=True)
+    attachment_id = fields.Many2one("ir.attachment", readonly=True)
+    error = fields.Text(readonly=True)
+    date_start = fields.Datetime(readonly=True)
+    date_done = fields.Datetime(readonly=True)
+
+    @api.model
+    def create_job(self, report, docids, data, context, filename):
+        """Queue the rendering of ``report`` for the current user and wake the
+        cron up."""
+        job = self.sudo().create(
+            {
+                "report_id": report.id,
+                "user_id": self.env.uid,
+                "docids": docids,
+                "data": data,
+                "context": {
+                    key: value
+                    for key, value in context.items()
+                    if key != "report_xlsx_stream"
+                },
+                "filename": filename,
+            }
+        )
+        self.env.ref("report_xlsx.ir_cron_report_xlsx_job").sudo()._trigger()
+        return job.with_env(self.env)
+
+    def _render(self):
+        self.ensure_one()
+        report = (
+            self.env["ir.actions.report"]
+            .with_user(self.user_id)
+            .with_context(**(self.context or {}))
+        )
+        content = report._render_xlsx(
+            self.report_id.report_name, self.docids, self.data or {}
+        )[0]
+        return self.env["ir.attachment"].create(
+            {
+                "name": self.filename,
+                "raw": content,
+                "res_model": self._name,
+                "res_id": self.id,
+                "mimetype": XLSX_MIMETYPE,
+            }
+        )
+
+    def _process(self):
+        """Render the job, committing its state around the (long) rendering."""
+        self.ensure_one()
+        auto_commit = not getattr(threading.current_thread(), "testing", False)
+        self.write({"state": "running", "date_start": fields.Datetime.now()})
+        if auto_commit:
+            self.env.cr.commit()
+        try:
+            attachment = self._render()
+        except Exception as e:
+            _logger.exception("Background XLSX report job %s failed", self.id)
+            if auto_commit:
+                self.env.cr.rollback()
+            self.write({"state": "failed", "error": str(e)})
+        else:
+            self.write(
+                {
+                    "state": "done",
+                    "attachment_id": attachment.id,
+                    "date_done": fields.Datetime.now(),
+                }
+            )
+        if auto_commit:
+            self.env.cr.commit()
+
+    @api.model
+    def _cron_process_jobs(self, timeout=3600, keep_days=1):
+        """Render pending jobs one at a time, oldest first.
+
+        Rows are claimed with ``SKIP LOCKED`` so several cron workers can share
+        the queue. Jobs stuck in running state for more than ``timeout`` seconds
+        (killed worker) are marked as failed, and jobs older than ``keep_days``
+        are deleted along with their file.
+        """
+        now = fields.Datetime.now()
+        self.search(
+            [
+                ("state", "=", "running"),
+                ("date_start", "<", now - timedelta(seconds=timeout)),
+            ]
+        ).write({"state": "failed", "error": "Rendering was interrupted."})
+        self.search(
+            [
+                ("state", "in", ("done", "failed")),
+                ("create_date", "<", now - timedelta(days=keep_days)),
+            ]
+        ).unlink()
+        while True:
+            self.env.cr.execute(
+                """SELECT id FROM report_xlsx_job WHERE state = 'pending'
+                ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED"""
+            )
+            row = self.env.cr.fetchone()
+            if not row:
+                break
+            self.browse(row[0])._process()
+
+    def unlink(self):
+        self.attachment_id.sudo().unlink()
+        return super().unlink()
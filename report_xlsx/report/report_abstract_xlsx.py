@@ -1,18 +1,49 @@
 # Copyright 2015 ACSONE SA/NV (<http://acsone.eu>)
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
+import json
 import logging
 import re
+from contextlib import contextmanager
 from io import BytesIO
+from operator import itemgetter
+from tempfile import SpooledTemporaryFile
 
-from odoo import models
+from odoo import api, models, sql_db
+from odoo.osv import expression
+from odoo.tools import SQL, config, split_every
 
 _logger = logging.getLogger(__name__)
 
+# Records read per batch by _iter_report_rows
+REPORT_READ_CHUNK_SIZE = 1000
+# Excel limits on worksheet names and rows
+SHEETNAME_MAX_LENGTH = 31
+SHEET_MAX_ROWS = 1048576
+INVALID_SHEETNAME_CHARS = re.compile(r"[\[\]:*?/\\]")
+# Streamed workbooks stay in memory up to this size, then spill to a temp file
+XLSX_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
 try:
     import xlsxwriter
 
     class PatchedXlsxWorkbook(xlsxwriter.Workbook):
+        def __init__(self, filename=None, options=None):
+            super().__init__(filename, options)
+            self._interned_formats = {}
+            self._sheetnames_index = set()
+            self._sheetname_sequences = {}
+
+        def get_format(self, properties):
+            """Return the format having ``properties``, creating it only the first
+            time they are asked for in this workbook. Unlike ``add_format``, the
+            returned format is shared and must not be modified."""
+            key = tuple(sorted(properties.items()))
+            cell_format = self._interned_formats.get(key)
+            if cell_format is None:
+                cell_format = self._interned_formats[key] = self.add_format(properties)
+            return cell_format
+
         def _check_sheetname(self, sheetname, is_chartsheet=False):
             """We want to avoid duplicated sheet names exceptions the same following
             the same philosophy that Odoo implements overriding the main library
@@ -24,38 +55,63 @@ try:
             hard to debug the original issue. Even so, different names can become the
             same one as their strings are trimmed to those 31 character limit.
 
-            This way, once we come across with a duplicated, we set that final 3
-            characters with a sequence that we evaluate on the fly. So for instance:
+            This way, once we come across with a duplicated, we replace its final
+            characters with a sequence, logging a warning as for any truncated
+            name. So for instance:
 
             - 'Sheet name' will be 'Sheet name~01'
-            - The next 'Sheet name' will try to rename to 'Sheet name~01' as well and
-              then that will give us 'Sheet name~02'.
-            - And the next 'Sheet name' will try to rename to 'Sheet name~01' and then
-              to 'Sheet name~02' and finally it will be able to 'Sheet name~03'.
-            - An so on as many times as duplicated sheet names come to the workbook up
-              to 100 for each sheet name. We set such limit as we don't want to truncate
-              the strings too much and keeping in mind that this issue don't usually
-              ocurrs.
+            - The next 'Sheet name' will be 'Sheet name~02'.
+            - And so on, 'Sheet name~100' coming after 'Sheet name~99'.
+
+            The names in use and the last sequence given to each duplicated name are
+            indexed (case insensitive, like Excel), so that a free name is found in
+            constant time instead of scanning the worksheets for each candidate.
             """
-            try:
-                return super()._check_sheetname(sheetname, is_chartsheet=is_chartsheet)
-            except xlsxwriter.exceptions.DuplicateWorksheetName:
-                pattern = re.compile(r"~[0-9]{2}$")
-                duplicated_secuence = (
-                    re.search(pattern, sheetname) and int(sheetname[-2:]) or 0
-                )
-                # Only up to 100 duplicates
-                deduplicated_secuence = "~{:02d}".format(duplicated_secuence + 1)
-                if duplicated_secuence > 99:
-                    raise xlsxwriter.exceptions.DuplicateWorksheetName  # noqa: B904
-                if duplicated_secuence:
-                    sheetname = re.sub(pattern, deduplicated_secuence, sheetname)
-                elif len(sheetname) <= 28:
-                    sheetname += deduplicated_secuence
+            if is_chartsheet:
+                self.chartname_count += 1
+            else:
+                self.sheetname_count += 1
+            if not sheetname:
+                if is_chartsheet:
+                    sheetname = self.chart_name + str(self.chartname_count)
                 else:
-                    sheetname = sheetname[:28] + deduplicated_secuence
-            # Refeed the method until we get an unduplicated name
-            return self._check_sheetname(sheetname, is_chartsheet=is_chartsheet)
+                    sheetname = self.sheet_name + str(self.sheetname_count)
+            if len(sheetname) > SHEETNAME_MAX_LENGTH:
+                _logger.warning(
+                    "Sheet name %r truncated to %d characters: %r",
+                    sheetname,
+                    SHEETNAME_MAX_LENGTH,
+                    sheetname[:SHEETNAME_MAX_LENGTH],
+                )
+                sheetname = sheetname[:SHEETNAME_MAX_LENGTH]
+            if INVALID_SHEETNAME_CHARS.search(sheetname):
+                raise xlsxwriter.exceptions.InvalidWorksheetName(
+                    f"Invalid Excel character '[]:*?/\\' in sheetname '{sheetname}'."
+                )
+            if sheetname.startswith("'") or sheetname.endswith("'"):
+                raise xlsxwriter.exceptions.InvalidWorksheetName(
+                    f'Sheet name cannot start or end with an apostrophe "{sheetname}".'
+                )
+            if sheetname.lower() in self._sheetnames_index:
+                deduplicated = self._deduplicate_sheetname(sheetname)
+                _logger.warning(
+                    "Sheet name %r already used, renamed %r", sheetname, deduplicated
+                )
+                sheetname = deduplicated
+            self._sheetnames_index.add(sheetname.lower())
+            return sheetname
+
+        def _deduplicate_sheetname(self, sheetname):
+            key = sheetname.lower()
+            sequence = self._sheetname_sequences.get(key, 0)
+            while True:
+                sequence += 1
+                suffix = "~{:02d}".format(sequence)
+                candidate = sheetname[: SHEETNAME_MAX_LENGTH - len(suffix)] + suffix
+                if candidate.lower() not in self._sheetnames_index:
+                    break
+            self._sheetname_sequences[key] = sequence
+            return candidate
 
     # "Short string"
 
@@ -65,6 +121,96 @@ except ImportError:
     _logger.debug("Can not import xlsxwriter`.")
 
 
+class XlsxColumn:
+    """Column of a table written by ``ReportXlsxAbstract._write_table``.
+
+    :param header: header text
+    :param key: key of the value in the rows, or function of the row
+    :param format: name of the cell format, see ``_get_xlsx_formats``
+    :param aggregate: ``"sum"`` to write the total of the column below the table
+    :param width: column width
+    """
+
+    __slots__ = ("header", "key", "format", "aggregate", "width")
+
+    def __init__(self, header, key=None, format=None, aggregate=None, width=None):
+        self.header = header
+        self.key = key
+        self.format = format
+        self.aggregate = aggregate
+        self.width = width
+
+    def getter(self):
+        if callable(self.key):
+            return self.key
+        if self.key is None:
+            return lambda row: None
+        return itemgetter(self.key)
+
+
+def _runs(values):
+    """Group consecutive equal values: [(first index, last index, value)]."""
+    runs = []
+    for index, value in enumerate(values):
+        if runs and runs[-1][2] == value:
+            runs[-1][1] = index
+        else:
+            runs.append([index, index, value])
+    return runs
+
+
+class RecordStream:
+    """Records of ``model`` matching ``domain``, searched lazily in chunks.
+
+    Each chunk is searched after the last id of the previous one (keyset
+    pagination), so that a chunk costs the same whatever its position and the
+    ids of all the records are never held at once. With ``group_by``, the
+    records are walked group after group, in the order of the field values.
+
+    Iterating the stream yields single records, like a recordset;
+    ``ReportXlsxAbstract._iter_report_rows`` reads it chunk by chunk.
+    """
+
+    def __init__(self, model, domain, group_by=None, chunk_size=REPORT_READ_CHUNK_SIZE):
+        self.model = model
+        self.domain = domain
+        self.group_by = group_by
+        self.chunk_size = chunk_size
+
+    def _group_domains(self):
+        if not self.group_by:
+            return [self.domain]
+        groups = self.model.read_group(
+            self.domain, [], [self.group_by], orderby=self.group_by, lazy=False
+        )
+        return [group["__domain"] for group in groups]
+
+    def iter_chunks(self):
+        for domain in self._group_domains():
+            last_id = 0
+            while True:
+                records = self.model.search(
+                    expression.AND([domain, [("id", ">", last_id)]]),
+                    order="id",
+                    limit=self.chunk_size,
+                )
+                if not records:
+                    break
+                yield records
+                if len(records) < self.chunk_size:
+                    break
+                last_id = records[-1].id
+
+    def with_env(self, env):
+        return RecordStream(
+            self.model.with_env(env), self.domain, self.group_by, self.chunk_size
+        )
+
+    def __iter__(self):
+        for records in self.iter_chunks():
+            yield from records
+
+
 class ReportXlsxAbstract(models.AbstractModel):
     _name = "report.report_xlsx.abstract"
     _description = "Abstract XLSX Report"
@@ -81,8 +227,11 @@ class ReportXlsxAbstract(models.AbstractModel):
         :param data: dictionary of data, if present typically provided
             by qwebactionmanager for TransientModels.
         :param ids: list of integers, provided by overrides.
-        :return: recordset of active model for ids.
+        :return: recordset of active model for ids, or a ``RecordStream`` when
+            the records are given by a domain, see ``_get_report_stream``.
         """
+        if not docids and data and data.get("report_xlsx_domain"):
+            return self._get_report_stream(data["report_xlsx_domain"])
         if docids:
             ids = docids
         elif data and "context" in data:
@@ -91,6 +240,219 @@ class ReportXlsxAbstract(models.AbstractModel):
             ids = self.env.context.get("active_ids", [])
         return self.env[self.env.context.get("active_model")].browse(ids)
 
+    def _get_report_stream(self, options):
+        """Stream of the records to print given by a domain instead of ids.
+
+        :param options: dictionary with the ``model`` and ``domain`` of the
+            records, and optionally a ``date_field`` filtered between
+            ``date_from`` and ``date_to`` (included) and a ``group_by`` field.
+        """
+        model = self.env[options["model"]]
+        domain = list(options.get("domain") or [])
+        date_field = options.get("date_field")
+        if date_field and options.get("date_from"):
+            domain = expression.AND(
+                [domain, [(date_field, ">=", options["date_from"])]]
+            )
+        if date_field and options.get("date_to"):
+            domain = expression.AND([domain, [(date_field, "<=", options["date_to"])]])
+        return RecordStream(model, domain, group_by=options.get("group_by"))
+
+    def _get_report_fields(self):
+        """
+        Override to declare the fields read by ``generate_xlsx_report``, as
+        paths that may follow many2one fields, e.g. ``["date", "partner_id.name"]``.
+        :return: list of field paths
+        """
+        return []
+
+    def _iter_report_rows(self, objs, paths=None, chunk_size=REPORT_READ_CHUNK_SIZE):
+        """
+        Read the declared fields of ``objs`` in batches of ``chunk_size`` records,
+        one ``read`` per batch and per many2one level whatever the number of
+        records, and free the record cache after each batch.
+
+        :param objs: recordset, ``RecordStream``, or iterable of recordsets
+            (chunks)
+        :param paths: field paths, defaults to ``_get_report_fields()``
+        :return: iterator of dicts keyed by ``id``, the field paths and the
+            first field of each path (the raw id for many2one fields), in the
+            order of ``objs``
+        """
+        paths = paths or self._get_report_fields()
+        chunks = iter(self._iter_report_chunks(objs, chunk_size))
+        while True:
+            with self._xlsx_phase("fetch") as stats:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                rows = self._read_report_paths(chunk, paths)
+                chunk.invalidate_recordset()
+                if stats:
+                    stats.rows += len(rows)
+            yield from rows.values()
+
+    def _iter_report_chunks(self, objs, chunk_size=REPORT_READ_CHUNK_SIZE):
+        if isinstance(objs, models.BaseModel):
+            for ids in split_every(chunk_size, objs.ids):
+                yield objs.browse(ids)
+        elif isinstance(objs, RecordStream):
+            yield from objs.iter_chunks()
+        else:
+            yield from objs
+
+    def _read_report_paths(self, records, paths):
+        """Read ``paths`` on ``records``, return a dict of rows by record id."""
+        subpaths = {}
+        for path in paths:
+            name, __, subpath = path.partition(".")
+            subpaths.setdefault(name, [])
+            if subpath:
+                subpaths[name].append(subpath)
+        rows = {
+            values["id"]: values
+            for values in records.read([name for name in subpaths], load=None)
+        }
+        for name, names in subpaths.items():
+            if not names:
+                continue
+            field = records._fields[name]
+            if field.type != "many2one":
+                raise ValueError(
+                    f"Cannot prefetch {name}.{names[0]}: {name} is not a many2one"
+                )
+            # in the environment of the records, e.g. on the replica cursor
+            comodel = records.env[field.comodel_name]
+            related = self._read_report_paths(
+                comodel.browse({row[name] for row in rows.values() if row[name]}),
+                names,
+            )
+            for row in rows.values():
+                related_row = related.get(row[name], {})
+                for subpath in names:
+                    row[f"{name}.{subpath}"] = related_row.get(subpath, False)
+        return rows
+
+    @contextmanager
+    def _xlsx_phase(self, name):
+        """Account the enclosed code to phase ``name`` of the ``RenderStats``
+        given in context key ``report_xlsx_stats``, if any, and yield them."""
+        stats = self.env.context.get("report_xlsx_stats")
+        if not stats:
+            yield None
+            return
+        with stats.phase(name):
+            yield stats
+
+    def _get_xlsx_formats(self):
+        """
+        Override to declare the cell formats of the report by name.
+        :return: dict of xlsxwriter format properties by format name
+        """
+        return {}
+
+    def _get_formats(self, workbook):
+        """
+        Formats declared by ``_get_xlsx_formats``, created once per workbook
+        whatever the number of names or reports sharing the same properties.
+        Workbooks not created by this module have no ``get_format``: each
+        format is added to them instead.
+        :return: dict of formats by name
+        """
+        get_format = getattr(workbook, "get_format", workbook.add_format)
+        return {
+            name: get_format(properties)
+            for name, properties in self._get_xlsx_formats().items()
+        }
+
+    def _write_table(
+        self,
+        workbook,
+        sheet,
+        columns,
+        rows,
+        first_row=0,
+        header_format=None,
+        total_format=None,
+        max_rows=SHEET_MAX_ROWS,
+    ):
+        """
+        Write a table in a single pass: the column widths, the header row, one
+        row per item of ``rows`` and, when a column aggregates, a total row.
+        Cells are written with ``write_row``, one call per run of adjacent
+        columns sharing a format, so this also works in ``constant_memory``.
+
+        When the table reaches the last row of the sheet, it goes on in a new
+        sheet named after the first one, e.g. "Sheet (2)". The last row of the
+        full sheet holds the totals so far ("Carried forward"), and the new
+        sheet starts with the header row and the same totals ("Brought
+        forward").
+
+        :param columns: list of ``XlsxColumn``
+        :param rows: iterable of rows, consumed lazily
+        :param first_row: index of the header row
+        :param header_format: format name of the header row
+        :param total_format: format name of the total row
+        :param max_rows: number of rows of a sheet, Excel's limit by default
+        :return: tuple (sheet where the table ends, index of the first row after
+            the data, where the totals are written, dict of the totals by column
+            index)
+        """
+        formats = self._get_formats(workbook)
+        getters = [column.getter() for column in columns]
+        format_runs = [
+            (first, last + 1, formats.get(name))
+            for first, last, name in _runs([column.format for column in columns])
+        ]
+        sums = {
+            index: 0
+            for index, column in enumerate(columns)
+            if column.aggregate == "sum"
+        }
+
+        def write_header(sheet, row_index):
+            for first, last, width in _runs([column.width for column in columns]):
+                if width is not None:
+                    sheet.set_column(first, last, width)
+            sheet.write_row(
+                row_index,
+                0,
+                [column.header for column in columns],
+                formats.get(header_format),
+            )
+
+        def write_totals(sheet, row_index, label=None):
+            if label and sums and 0 not in sums:
+                sheet.write(row_index, 0, label, formats.get(total_format))
+            for index, total in sums.items():
+                sheet.write(row_index, index, total, formats.get(total_format))
+
+        with self._xlsx_phase("write"):
+            first_sheet, sheet_count = sheet, 1
+            write_header(sheet, first_row)
+            row_index = first_row + 1
+            for row in rows:
+                if row_index >= max_rows - 1:  # keep the last row for the totals
+                    write_totals(sheet, row_index, "Carried forward")
+                    sheet_count += 1
+                    suffix = " (%d)" % sheet_count
+                    sheet = workbook.add_worksheet(
+                        first_sheet.name[: SHEETNAME_MAX_LENGTH - len(suffix)] + suffix
+                    )
+                    write_header(sheet, 0)
+                    row_index = 1
+                    if sums:
+                        write_totals(sheet, row_index, "Brought forward")
+                        row_index += 1
+                values = [get(row) for get in getters]
+                for first, stop, cell_format in format_runs:
+                    sheet.write_row(row_index, first, values[first:stop], cell_format)
+                for index in sums:
+                    sums[index] += values[index] or 0
+                row_index += 1
+            write_totals(sheet, row_index)
+        return sheet, row_index, sums
+
     def _report_xlsx_currency_format(self, currency):
         """Get the format to be used in cells (symbol included).
         Used in account_financial_report addon"""
@@ -99,13 +461,43 @@ class ReportXlsxAbstract(models.AbstractModel):
         return f"{f'{s_before}'}#,##0.{'0' * currency.decimal_places}{f'{s_after}'}"
 
     def create_xlsx_report(self, docids, data):
-        objs = self._get_objs_for_report(docids, data)
-        file_data = BytesIO()
-        workbook = xlsxwriter.Workbook(file_data, self.get_workbook_options())
-        self.generate_xlsx_report(workbook, data, objs)
-        workbook.close()
+        """Render the workbook.
+
+        Streaming reports are written with xlsxwriter's ``constant_memory`` mode
+        into a spooled temporary file. When the caller accepts it (context key
+        ``report_xlsx_stream``) that file is returned as is, rewound, instead of
+        being read into a bytes object.
+
+        The records are read in ``_report_fetch_env``, on the read replica for
+        reports set up as such.
+        """
+        with self._xlsx_phase("fetch"):
+            objs = self._get_objs_for_report(docids, data)
+        with self._report_fetch_env() as fetch_env:
+            if fetch_env is not self.env:
+                objs = objs.with_env(fetch_env)
+            return self._create_xlsx_file(data, objs)
+
+    def _create_xlsx_file(self, data, objs):
+        streaming = self.is_streaming_report()
+        options = self.get_workbook_options()
+        if streaming:
+            options = dict(options, constant_memory=True)
+            file_data = SpooledTemporaryFile(max_size=XLSX_SPOOL_MAX_SIZE)
+        else:
+            file_data = BytesIO()
+        workbook = xlsxwriter.Workbook(file_data, options)
+        with self._xlsx_phase("generate"):
+            self.generate_xlsx_report(workbook, data, objs)
+        with self._xlsx_phase("close") as stats:
+            workbook.close()
+            if stats:
+                stats.size = file_data.tell()
         file_data.seek(0)
-        return file_data.read(), "xlsx"
+        if streaming and self.env.context.get("report_xlsx_stream"):
+            return file_data, "xlsx"
+        with file_data:
+            return file_data.read(), "xlsx"
 
     def get_workbook_options(self):
         """
@@ -114,5 +506,101 @@ class ReportXlsxAbstract(models.AbstractModel):
         """
         return {}
 
+    @contextmanager
+    def _report_fetch_env(self):
+        """Environment in which the records of the report are read.
+
+        When the ``report_xlsx_replica_dsn`` server option is set (a database
+        name or a ``postgresql://`` URI) and ``is_replica_report`` returns True,
+        it is bound to a read-only cursor on that database, e.g. a streaming
+        replica of the primary one, that is closed once the workbook is written.
+        Everything written back to the database (attachments, cache, jobs) stays
+        on the primary cursor.
+        """
+        dsn = config.get("report_xlsx_replica_dsn")
+        if not dsn or not self.is_replica_report():
+            yield self.env
+            return
+        cr = sql_db.db_connect(dsn, allow_uri=True).cursor()
+        stats = self.env.context.get("report_xlsx_stats")
+        if stats:
+            stats.add_cursor(cr)
+        try:
+            cr.execute("SET TRANSACTION READ ONLY")
+            # share the registry of the primary database, whatever the replica name
+            cr.transaction = api.Transaction(self.env.registry)
+            yield api.Environment(cr, self.env.uid, self.env.context, su=self.env.su)
+        finally:
+            cr.close()
+
+    def is_replica_report(self):
+        """
+        Override to return True for reports whose data may be read on the read
+        replica configured by ``report_xlsx_replica_dsn``, see
+        ``_report_fetch_env``. Such reports may lag slightly behind the primary.
+        :return: boolean
+        """
+        return False
+
+    def is_streaming_report(self):
+        """
+        Override to return True for large reports. They are rendered with the
+        ``constant_memory`` workbook option, so rows must be written in order,
+        and are streamed to the client from a spooled temporary file.
+        :return: boolean
+        """
+        return False
+
+    def is_cacheable_report(self):
+        """
+        Override to return True to keep rendered files in the result cache of
+        ``ir.actions.report``, keyed on ``_get_report_cache_key``.
+        :return: boolean
+        """
+        return False
+
+    def _get_report_fingerprint(self, objs, data):
+        """
+        Cheap value that changes whenever the data shown by the report changes.
+        Defaults to the number of records and their latest ``write_date``;
+        reports also showing data of other models should extend it.
+        :return: hashable value
+        """
+        if not objs:
+            return None
+        objs.flush_model(["write_date"])
+        self.env.cr.execute(
+            SQL(
+                "SELECT COUNT(*), MAX(write_date) FROM %s WHERE id = ANY(%s)",
+                SQL.identifier(objs._table),
+                objs.ids,
+            )
+        )
+        return tuple(self.env.cr.fetchone())
+
+    def _get_report_cache_key(self, docids, data):
+        """Key of the rendered file in the result cache: report, records, options,
+        access groups, rendering context and data fingerprint. Users with the
+        same groups share the file, so the access to the records is checked
+        here, before a cached file can be served."""
+        objs = self._get_objs_for_report(docids, data)
+        if not isinstance(objs, models.BaseModel):
+            # records given by a domain: they can't be fingerprinted cheaply
+            return None
+        objs.check_access_rights("read")
+        objs.check_access_rule("read")
+        context = self.env.context
+        return (
+            self._name,
+            tuple(objs.ids),
+            json.dumps(data or {}, sort_keys=True, default=str),
+            tuple(sorted(self.env.user.groups_id.ids)),
+            self.env.su,
+            context.get("lang"),
+            context.get("tz"),
+            tuple(context.get("allowed_company_ids") or ()),
+            str(self._get_report_fingerprint(objs, data)),
+        )
+
     def generate_xlsx_report(self, workbook, data, objs):
         raise NotImplementedError()
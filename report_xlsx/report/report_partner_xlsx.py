@@ -9,8 +9,11 @@ class PartnerXlsx(models.AbstractModel):
     _inherit = "report.report_xlsx.abstract"
     _description = "Partner XLSX Report"
 
+    def _get_xlsx_formats(self):
+        return {"bold": {"bold": True}}
+
     def generate_xlsx_report(self, workbook, data, partners):
+        formats = self._get_formats(workbook)
         sheet = workbook.add_worksheet("Report")
         for i, obj in enumerate(partners):
-            bold = workbook.add_format({"bold": True})
-            sheet.write(i, 0, obj.name, bold)
+            sheet.write(i, 0, obj.name, formats["bold"])
@@ -1,7 +1,72 @@
 /** @odoo-module **/
 
+import {_t} from "@web/core/l10n/translation";
 import {download} from "@web/core/network/download";
 import {registry} from "@web/core/registry";
+import {session} from "@web/session";
+
+const JOB_POLL_DELAY = 2000;
+// Give up polling a job after this many attempts (30 minutes)
+const JOB_POLL_MAX_ATTEMPTS = 900;
+// From this number of selected records, send their domain rather than their ids
+const DOMAIN_MIN_RECORDS = 1000;
+// Default of the web.active_ids_limit parameter
+const DEFAULT_ACTIVE_IDS_LIMIT = 20000;
+
+async function blockingDownload(env, params) {
+    env.services.ui.block();
+    try {
+        await download(params);
+    } finally {
+        env.services.ui.unblock();
+    }
+}
+
+async function isDomainSelected(env, actionContext, activeIds) {
+    // List views put their domain in active_domain whatever the selection:
+    // it is only the selection when all the records it matches are selected,
+    // or when the selected ids were cut at the active ids limit
+    const {active_domain: domain, active_model: model} = actionContext;
+    if (!domain || !model || activeIds.length < DOMAIN_MIN_RECORDS) {
+        return false;
+    }
+    const count = await env.services.orm.searchCount(model, domain, {
+        context: env.services.user.context,
+    });
+    const limit = session.active_ids_limit || DEFAULT_ACTIVE_IDS_LIMIT;
+    return (
+        count === activeIds.length || (activeIds.length >= limit && count > limit)
+    );
+}
+
+async function downloadFromJob(env, data) {
+    // Queue the report and poll its job until the file is ready
+    const jobId = await env.services.rpc("/report/xlsx/job", data);
+    env.services.notification.add(
+        _t("The report is being generated, it will be downloaded when ready."),
+        {type: "info"}
+    );
+    for (let attempt = 0; attempt < JOB_POLL_MAX_ATTEMPTS; attempt++) {
+        await new Promise((resolve) => setTimeout(resolve, JOB_POLL_DELAY));
+        const status = await env.services.rpc(`/report/xlsx/job/${jobId}`);
+        if (status.state === "done") {
+            return download({url: `/report/xlsx/job/${jobId}/download`, data: {}});
+        }
+        if (status.state === "failed") {
+            env.services.notification.add(status.error, {
+                title: _t("Report generation failed"),
+                type: "danger",
+            });
+            return;
+        }
+    }
+    env.services.notification.add(
+        _t(
+            "The report is still not generated, it may be stuck. Try again later or contact your administrator."
+        ),
+        {title: _t("Report generation timed out"), type: "warning"}
+    );
+}
 
 registry
     .category("ir.actions.report handlers")
@@ -27,17 +92,54 @@ registry
                     url += `?context=${context}`;
                 }
             }
-            env.services.ui.block();
-            try {
-                await download({
+            const context = JSON.stringify(env.services.user.context);
+            const activeIds = actionContext.active_ids || [];
+            if (action.xlsx_zip && activeIds.length > 1) {
+                // One workbook per record, zipped
+                await blockingDownload(env, {
+                    url: `/report/xlsx_zip/${action.report_name}/${activeIds.join(",")}`,
+                    data: {context},
+                });
+            } else if (
+                !(action.data && JSON.stringify(action.data) !== "{}") &&
+                (await isDomainSelected(env, actionContext, activeIds))
+            ) {
+                // Let the server search the records while writing the report
+                if (action.xlsx_async) {
+                    const options = encodeURIComponent(
+                        JSON.stringify({
+                            report_xlsx_domain: {
+                                model: actionContext.active_model,
+                                domain: actionContext.active_domain,
+                            },
+                        })
+                    );
+                    await downloadFromJob(env, {
+                        data: JSON.stringify([
+                            `/report/${type}/${action.report_name}?options=${options}&context=${encodeURIComponent(context)}`,
+                            action.report_type,
+                        ]),
+                        context,
+                    });
+                } else {
+                    await blockingDownload(env, {
+                        url: `/report/xlsx_domain/${action.report_name}`,
+                        data: {
+                            domain: JSON.stringify(actionContext.active_domain),
+                            context,
+                        },
+                    });
+                }
+            } else if (action.xlsx_async) {
+                await downloadFromJob(env, {
+                    data: JSON.stringify([url, action.report_type]),
+                    context,
+                });
+            } else {
+                await blockingDownload(env, {
                     url: "/report/download",
-                    data: {
-                        data: JSON.stringify([url, action.report_type]),
-                        context: JSON.stringify(env.services.user.context),
-                    },
+                    data: {data: JSON.stringify([url, action.report_type]), context},
                 });
-            } finally {
-                env.services.ui.unblock();
             }
             const onClose = options.onClose;
             if (action.close_on_report_download) {
@@ -2,8 +2,18 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
 import logging
+import zipfile
+from io import BytesIO
+from unittest.mock import patch
+
+import psycopg2
 
 from odoo.tests import common
+from odoo.tools import config, mute_logger
+
+from ..report.report_abstract_xlsx import XlsxColumn
+from ..tools.render_stats import RenderStats
+from ..tools.result_cache import get_result_cache
 
 _logger = logging.getLogger(__name__)
 
@@ -12,6 +22,11 @@ try:
 except ImportError:
     _logger.debug("Can not import xlrd`.")
 
+try:
+    import xlsxwriter
+except ImportError:
+    _logger.debug("Can not import xlsxwriter`.")
+
 
 class TestReport(common.TransactionCase):
     def setUp(self):
@@ -32,6 +47,188 @@ class TestReport(common.TransactionCase):
         sheet = wb.sheet_by_index(0)
         self.assertEqual(sheet.cell(0, 0).value, self.docs.name)
 
+    def test_report_lookup_cache(self):
+        self.report_object._get_report_from_name(self.report_name)
+        with self.assertQueryCount(0):
+            report = self.report_object._get_report_from_name(self.report_name)
+        self.assertEqual(report, self.report)
+        self.report.report_name = "report_xlsx.partner_xlsx_renamed"
+        self.assertFalse(self.report_object._get_report_from_name(self.report_name))
+        self.assertEqual(
+            self.report_object._get_report_from_name(
+                "report_xlsx.partner_xlsx_renamed"
+            ),
+            self.report,
+        )
+
+    def test_report_streaming(self):
+        partner_report = self.env.registry["report.report_xlsx.partner_xlsx"]
+        with patch.object(partner_report, "is_streaming_report", return_value=True):
+            rep = self.report_object._render(self.report_name, self.docs.ids, {})
+            self.assertIsInstance(rep[0], bytes)
+            stream = self.report_object.with_context(report_xlsx_stream=True)._render(
+                self.report_name, self.docs.ids, {}
+            )[0]
+        with stream:
+            self.assertEqual(stream.tell(), 0)
+            wb = open_workbook(file_contents=stream.read())
+        self.assertEqual(wb.sheet_by_index(0).cell(0, 0).value, self.docs.name)
+
+    def test_report_cache(self):
+        partner_report = self.env.registry["report.report_xlsx.partner_xlsx"]
+        stats = self.report_object.get_xlsx_cache_stats()
+        with patch.object(partner_report, "is_cacheable_report", return_value=True):
+            first = self.report_object._render(self.report_name, self.docs.ids, {})
+            with patch.object(partner_report, "generate_xlsx_report") as generate:
+                second = self.report_object._render(self.report_name, self.docs.ids, {})
+                generate.assert_not_called()
+            self.assertEqual(first[0], second[0])
+            self.docs.name = "Changed name"
+            third = self.report_object._render(self.report_name, self.docs.ids, {})
+        wb = open_workbook(file_contents=third[0])
+        self.assertEqual(wb.sheet_by_index(0).cell(0, 0).value, "Changed name")
+        new_stats = self.report_object.get_xlsx_cache_stats()
+        self.assertEqual(new_stats["hits"], stats["hits"] + 1)
+        self.assertEqual(new_stats["misses"], stats["misses"] + 2)
+
+    def test_report_etag(self):
+        partner_report = self.env.registry["report.report_xlsx.partner_xlsx"]
+        etag = self.report_object._get_xlsx_etag(self.report_name, self.docs.ids, {})
+        self.assertIsNone(etag)
+        with patch.object(partner_report, "is_cacheable_report", return_value=True):
+            with patch.object(partner_report, "generate_xlsx_report") as generate:
+                etag = self.report_object._get_xlsx_etag(
+                    self.report_name, self.docs.ids, {}
+                )
+                generate.assert_not_called()
+            self.assertEqual(
+                self.report_object._get_xlsx_etag(self.report_name, self.docs.ids, {}),
+                etag,
+            )
+            self.docs.name = "Changed name"
+            self.assertNotEqual(
+                self.report_object._get_xlsx_etag(self.report_name, self.docs.ids, {}),
+                etag,
+            )
+
+    def test_report_cache_shared(self):
+        partner_report = self.env.registry["report.report_xlsx.partner_xlsx"]
+        users = self.env["res.users"].create(
+            [
+                {
+                    "name": "XLSX Cache User %d" % i,
+                    "login": "xlsx_cache_user_%d" % i,
+                    "groups_id": [(6, 0, self.env.ref("base.group_user").ids)],
+                }
+                for i in range(2)
+            ]
+        )
+        with patch.object(partner_report, "is_cacheable_report", return_value=True):
+            first = (
+                self.report_object.with_user(users[0])
+                .sudo(False)
+                ._render_xlsx(self.report_name, self.docs.ids, {})
+            )
+            with patch.object(partner_report, "generate_xlsx_report") as generate:
+                second = (
+                    self.report_object.with_user(users[1])
+                    .sudo(False)
+                    ._render_xlsx(self.report_name, self.docs.ids, {})
+                )
+                generate.assert_not_called()
+            self.assertEqual(first[0], second[0])
+            # another worker process: served from the attachment
+            get_result_cache(self.env.cr.dbname).clear()
+            with patch.object(partner_report, "generate_xlsx_report") as generate:
+                third = self.report_object.with_user(users[1])._render_xlsx(
+                    self.report_name, self.docs.ids, {}
+                )
+                generate.assert_not_called()
+            self.assertEqual(first[0], third[0])
+
+    def test_report_cache_key_once(self):
+        partner_report = self.env.registry["report.report_xlsx.partner_xlsx"]
+        with patch.object(partner_report, "is_cacheable_report", return_value=True):
+            cache_key = self.report_object._get_xlsx_cache_key(
+                self.report_name, self.docs.ids, {}
+            )
+            self.assertIsNotNone(cache_key)
+            with patch.object(partner_report, "_get_report_cache_key") as get_key:
+                rep = self.report_object.with_context(
+                    report_xlsx_cache_key=cache_key
+                )._render_xlsx(self.report_name, self.docs.ids, {})
+                get_key.assert_not_called()
+        self.assertEqual(rep[1], "xlsx")
+
+    def test_report_etag_access(self):
+        partner_report = self.env.registry["report.report_xlsx.partner_xlsx"]
+        superusers = []
+
+        def fingerprint(report_model, objs, data):
+            superusers.append((report_model.env.su, objs.env.su))
+
+        # the controller computes it on the sudo report record
+        with patch.object(
+            partner_report, "is_cacheable_report", return_value=True
+        ), patch.object(partner_report, "_get_report_fingerprint", fingerprint):
+            self.report_object.sudo()._get_xlsx_etag(
+                self.report_name, self.docs.ids, {}
+            )
+        self.assertEqual(superusers, [(False, False)])
+
+    def test_report_replica(self):
+        partner_report = self.env.registry["report.report_xlsx.partner_xlsx"]
+        # a second connection to the same database stands in for the replica
+        options = {"report_xlsx_replica_dsn": self.env.cr.dbname}
+        with patch.dict(config.options, options), patch.object(
+            partner_report, "is_replica_report", return_value=True
+        ):
+            report_model = self.env["report.report_xlsx.partner_xlsx"]
+            with report_model._report_fetch_env() as env:
+                self.assertNotEqual(env.cr, self.env.cr)
+                self.assertEqual(env.registry, self.env.registry)
+                with self.assertRaises(
+                    psycopg2.errors.ReadOnlySqlTransaction
+                ), mute_logger("odoo.sql_db"):
+                    env.cr.execute(
+                        "UPDATE res_partner SET name = name WHERE id = %s",
+                        [self.docs.id],
+                    )
+            rep = self.report_object._render(self.report_name, self.docs.ids, {})
+            # queries of the replica cursor are counted too
+            stats = RenderStats(self.env.cr)
+            with report_model.with_context(
+                report_xlsx_stats=stats
+            )._report_fetch_env() as env:
+                with stats.phase("fetch"):
+                    env["res.partner"].browse(self.docs.ids).read(["name"])
+            self.assertGreater(stats.queries["fetch"], 0)
+        wb = open_workbook(file_contents=rep[0])
+        self.assertEqual(wb.sheet_by_index(0).cell(0, 0).value, self.docs.name)
+
+    def test_background_job(self):
+        job = self.env["report.xlsx.job"].create_job(
+            self.report, self.docs.ids, {}, {}, "partners.xlsx"
+        )
+        self.assertEqual(job.state, "pending")
+        self.env["report.xlsx.job"]._cron_process_jobs()
+        self.assertEqual(job.state, "done")
+        self.assertEqual(job.attachment_id.name, "partners.xlsx")
+        wb = open_workbook(file_contents=job.attachment_id.raw)
+        self.assertEqual(wb.sheet_by_index(0).cell(0, 0).value, self.docs.name)
+
+    def test_render_stats(self):
+        stats = RenderStats(self.env.cr)
+        rep = self.report_object.with_context(report_xlsx_stats=stats)._render(
+            self.report_name, self.docs.ids, {}
+        )
+        self.assertEqual(
+            set(stats.durations), {"fetch", "generate", "close", "attachment"}
+        )
+        self.assertEqual(stats.size, len(rep[0]))
+        self.assertAlmostEqual(stats.total, sum(stats.durations.values()))
+        self.assertIn("generate;dur=", stats.server_timing())
+
     def test_save_attachment(self):
         self.report.attachment = 'object.name + ".xlsx"'
         self.report_object._render(self.report_name, self.docs.ids, {})
@@ -41,6 +238,108 @@ class TestReport(common.TransactionCase):
         self.assertEqual(len(attachment), 1)
         self.assertEqual(attachment.name, f"{self.docs.name}.xlsx")
 
+    def test_batch_zip(self):
+        partners = self.env["res.partner"].create(
+            [{"name": "Zip 1"}, {"name": "Zip 2"}]
+        )
+        self.report.print_report_name = "object.name"
+        archive = self.report._render_xlsx_batch(
+            partners.ids, {}, save_attachments=True, workers=1
+        )
+        with zipfile.ZipFile(archive) as zip_file:
+            self.assertEqual(sorted(zip_file.namelist()), ["Zip 1.xlsx", "Zip 2.xlsx"])
+            wb = open_workbook(file_contents=zip_file.read("Zip 2.xlsx"))
+        self.assertEqual(wb.sheet_by_index(0).cell(0, 0).value, "Zip 2")
+        attachments = self.env["ir.attachment"].search(
+            [("res_model", "=", "res.partner"), ("res_id", "in", partners.ids)]
+        )
+        self.assertEqual(
+            sorted(attachments.mapped("name")), ["Zip 1.xlsx", "Zip 2.xlsx"]
+        )
+
+    def test_batch_zip_workers(self):
+        # rendered by other processes: records they can read, committed
+        partners = self.env.ref("base.main_partner") | self.env.ref(
+            "base.partner_admin"
+        )
+        self.report.print_report_name = "'Partner %s' % object.id"
+        archive = self.report._render_xlsx_batch(
+            partners.ids, {}, save_attachments=True, workers=2
+        )
+        with zipfile.ZipFile(archive) as zip_file:
+            self.assertEqual(
+                sorted(zip_file.namelist()),
+                sorted(f"Partner {partner.id}.xlsx" for partner in partners),
+            )
+            for partner in partners:
+                wb = open_workbook(
+                    file_contents=zip_file.read(f"Partner {partner.id}.xlsx")
+                )
+                self.assertEqual(wb.sheet_by_index(0).cell(0, 0).value, partner.name)
+        attachments = self.env["ir.attachment"].search(
+            [
+                ("res_model", "=", "res.partner"),
+                ("res_id", "in", partners.ids),
+                ("name", "=like", "Partner %.xlsx"),
+            ]
+        )
+        self.assertEqual(
+            sorted(attachments.mapped("name")),
+            sorted(f"Partner {partner.id}.xlsx" for partner in partners),
+        )
+
+    def test_batch_zip_failure(self):
+        partners = self.env["res.partner"].create(
+            [{"name": "Zip 1"}, {"name": "Zip 2"}]
+        )
+        render = type(self.report)._render_xlsx_batch_record
+
+        def render_first(report, docid, data):
+            if docid != partners[0].id:
+                raise ValueError("Rendering failed")
+            return render(report, docid, data)
+
+        with patch.object(
+            type(self.report), "_render_xlsx_batch_record", render_first
+        ), self.assertRaises(ValueError):
+            self.report._render_xlsx_batch(
+                partners.ids, {}, save_attachments=True, workers=1
+            )
+        # the first workbook was rendered, but not saved without the archive
+        attachments = self.env["ir.attachment"].search(
+            [("res_model", "=", "res.partner"), ("res_id", "in", partners.ids)]
+        )
+        self.assertFalse(attachments)
+
+    def test_report_domain(self):
+        partners = self.env["res.partner"].create(
+            [{"name": "Domain %s" % i} for i in range(5)]
+        )
+        data = {
+            "report_xlsx_domain": {
+                "model": "res.partner",
+                "domain": [("id", "in", partners.ids)],
+                "group_by": "name",
+            }
+        }
+        objs = self.xlsx_report._get_objs_for_report(None, data)
+        objs.chunk_size = 2
+        self.assertEqual([len(chunk) for chunk in objs.iter_chunks()], [1] * 5)
+        objs.group_by = None
+        self.assertEqual([len(chunk) for chunk in objs.iter_chunks()], [2, 2, 1])
+        self.assertEqual([record.id for record in objs], partners.ids)
+        rows = list(self.xlsx_report._iter_report_rows(objs, ["name"]))
+        self.assertEqual([row["name"] for row in rows], partners.mapped("name"))
+        rep = self.report_object._render(self.report_name, None, data)
+        wb = open_workbook(file_contents=rep[0])
+        self.assertEqual(wb.sheet_by_index(0).cell(4, 0).value, "Domain 4")
+
+    def test_report_action_flags(self):
+        self.report.xlsx_async = True
+        action = self.report.report_action(None, data={"option": 1})
+        self.assertTrue(action["xlsx_async"])
+        self.assertFalse(action["xlsx_zip"])
+
     def test_id_retrieval(self):
 
         # Typical call from WebUI with wizard
@@ -65,6 +364,124 @@ class TestReport(common.TransactionCase):
         objs = self.xlsx_report._get_objs_for_report(self.docs.ids, {})
         self.assertEqual(objs, self.docs)
 
+    def test_report_rows(self):
+        partners = self.env["res.partner"].create(
+            [
+                {"name": "Row 1", "country_id": self.env.ref("base.be").id},
+                {"name": "Row 2", "country_id": self.env.ref("base.fr").id},
+                {"name": "Row 3"},
+            ]
+        )
+        rows = list(
+            self.xlsx_report._iter_report_rows(
+                partners, ["name", "country_id.code"], chunk_size=2
+            )
+        )
+        self.assertEqual(
+            [(row["id"], row["name"], row["country_id.code"]) for row in rows],
+            [
+                (partners[0].id, "Row 1", "BE"),
+                (partners[1].id, "Row 2", "FR"),
+                (partners[2].id, "Row 3", False),
+            ],
+        )
+        self.assertEqual(rows[0]["country_id"], self.env.ref("base.be").id)
+        with self.assertRaises(ValueError):
+            list(self.xlsx_report._iter_report_rows(partners, ["child_ids.name"]))
+
+    def test_format_registry(self):
+        workbook = xlsxwriter.Workbook(BytesIO())
+        nb_formats = len(workbook.formats)
+        bold = workbook.get_format({"bold": True, "font_size": 12})
+        self.assertIs(workbook.get_format({"font_size": 12, "bold": True}), bold)
+        self.assertIsNot(workbook.get_format({"bold": True}), bold)
+        self.assertEqual(len(workbook.formats), nb_formats + 2)
+        partner_report = self.env["report.report_xlsx.partner_xlsx"]
+        formats = partner_report._get_formats(workbook)
+        self.assertIs(formats["bold"], workbook.get_format({"bold": True}))
+        workbook.close()
+
+    def test_formats_plain_workbook(self):
+        workbook = xlsxwriter.workbook.Workbook(BytesIO())
+        nb_formats = len(workbook.formats)
+        partner_report = self.env["report.report_xlsx.partner_xlsx"]
+        formats = partner_report._get_formats(workbook)
+        self.assertEqual(
+            len(workbook.formats), nb_formats + len(partner_report._get_xlsx_formats())
+        )
+        self.assertTrue(formats["bold"].bold)
+        workbook.close()
+
+    def test_write_table(self):
+        file_data = BytesIO()
+        workbook = xlsxwriter.Workbook(file_data, {"constant_memory": True})
+        sheet = workbook.add_worksheet("Table")
+        columns = [
+            XlsxColumn("Name", "name", "bold", width=30),
+            XlsxColumn("Length", lambda row: len(row["name"]), None, "sum"),
+        ]
+        rows = ({"name": name} for name in ["ab", "cde"])
+        last_sheet, next_row, totals = self.env[
+            "report.report_xlsx.partner_xlsx"
+        ]._write_table(workbook, sheet, columns, rows, first_row=1)
+        workbook.close()
+        self.assertEqual((last_sheet, next_row, totals), (sheet, 4, {1: 5}))
+        sheet = open_workbook(file_contents=file_data.getvalue()).sheet_by_index(0)
+        self.assertEqual(sheet.row_values(1), ["Name", "Length"])
+        self.assertEqual(sheet.row_values(2), ["ab", 2])
+        self.assertEqual(sheet.row_values(4), ["", 5])
+
+    def test_write_table_rollover(self):
+        file_data = BytesIO()
+        workbook = xlsxwriter.Workbook(file_data, {"constant_memory": True})
+        sheet = workbook.add_worksheet("Table")
+        columns = [
+            XlsxColumn("Name", "name"),
+            XlsxColumn("Value", "value", aggregate="sum"),
+        ]
+        rows = ({"name": "Row %s" % i, "value": i} for i in range(1, 8))
+        last_sheet, next_row, totals = self.env[
+            "report.report_xlsx.partner_xlsx"
+        ]._write_table(workbook, sheet, columns, rows, max_rows=5)
+        workbook.close()
+        self.assertEqual((last_sheet.name, next_row, totals), ("Table (3)", 4, {1: 28}))
+        book = open_workbook(file_contents=file_data.getvalue())
+        self.assertEqual(book.sheet_names(), ["Table", "Table (2)", "Table (3)"])
+        first, second, third = (book.sheet_by_index(i) for i in range(3))
+        self.assertEqual(first.col_values(1), ["Value", 1, 2, 3, 6])
+        self.assertEqual(first.cell(4, 0).value, "Carried forward")
+        self.assertEqual(second.col_values(1), ["Value", 6, 4, 5, 15])
+        self.assertEqual(second.row_values(1), ["Brought forward", 6])
+        self.assertEqual(third.col_values(1), ["Value", 15, 6, 7, 28])
+        self.assertEqual(third.cell(4, 0).value, "")
+
+    def test_truncated_sheet_names(self):
+        workbook = xlsxwriter.Workbook(BytesIO())
+        logger = "odoo.addons.report_xlsx.report.report_abstract_xlsx"
+        with self.assertLogs(logger, "WARNING") as logs:
+            first = workbook.add_worksheet("Warehouse Capacity Rate - North Site")
+            second = workbook.add_worksheet("Warehouse Capacity Rate - North Site B")
+        self.assertEqual(first.name, "Warehouse Capacity Rate - North")
+        self.assertEqual(second.name, "Warehouse Capacity Rate - No~01")
+        self.assertEqual(len(logs.output), 3)  # two truncations, one renaming
+        self.assertIn("truncated", logs.output[0])
+        self.assertIn("renamed", logs.output[2])
+        workbook.close()
+
+    @mute_logger("odoo.addons.report_xlsx.report.report_abstract_xlsx")
+    def test_duplicated_sheet_names(self):
+        workbook = xlsxwriter.Workbook(BytesIO())
+        long_name = "A client name longer than the limit"
+        names = [workbook.add_worksheet(long_name).name for __ in range(150)]
+        self.assertEqual(names[0], long_name[:31])
+        self.assertEqual(names[1], long_name[:28] + "~01")
+        self.assertEqual(names[99], long_name[:28] + "~99")
+        self.assertEqual(names[100], long_name[:27] + "~100")
+        self.assertEqual(len({name.lower() for name in names}), 150)
+        self.assertEqual(workbook.add_worksheet("REPORT").name, "REPORT")
+        self.assertEqual(workbook.add_worksheet("Report").name, "Report~01")
+        workbook.close()
+
     def test_currency_format(self):
         usd = self.env.ref("base.USD")
         self.assertEqual(
@@ -74,3 +491,27 @@ class TestReport(common.TransactionCase):
         self.assertEqual(
             self.xlsx_report._report_xlsx_currency_format(eur), "#,##0.00 €"
         )
+
+
+@common.tagged("post_install", "-at_install")
+class TestReportJobRoutes(common.HttpCase):
+    def test_job_of_other_user(self):
+        report = self.env["ir.actions.report"]._get_report_from_name(
+            "report_xlsx.partner_xlsx"
+        )
+        job = self.env["report.xlsx.job"].create_job(
+            report, self.env.user.partner_id.ids, {}, {}, "partners.xlsx"
+        )
+        self.env["report.xlsx.job"]._cron_process_jobs()
+        self.assertEqual(job.state, "done")
+        self.env["res.users"].create(
+            {
+                "name": "Other Job User",
+                "login": "other_job_user",
+                "password": "other_job_user",
+                "groups_id": [(6, 0, self.env.ref("base.group_user").ids)],
+            }
+        )
+        self.authenticate("other_job_user", "other_job_user")
+        response = self.url_open(f"/report/xlsx/job/{job.id}/download")
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,36 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from unittest.mock import patch
+
+from odoo.tests import common
+
+from ..tools.result_cache import ReportResultCache
+
+
+class TestResultCache(common.BaseCase):
+    def test_lru_eviction(self):
+        cache = ReportResultCache(max_bytes=10, max_age=60)
+        cache.set("a", b"1234")
+        cache.set("b", b"1234")
+        self.assertEqual(cache.get("a"), b"1234")  # "b" is now least recently used
+        cache.set("c", b"1234")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"1234")
+        self.assertEqual(cache.get("c"), b"1234")
+        cache.set("big", b"x" * 11)
+        self.assertIsNone(cache.get("big"))
+        self.assertEqual(
+            cache.stats(),
+            {"entries": 2, "size": 8, "hits": 3, "misses": 2, "evictions": 1},
+        )
+
+    def test_age_eviction(self):
+        cache = ReportResultCache(max_bytes=10, max_age=60)
+        with patch("time.monotonic", return_value=1000):
+            cache.set("a", b"1234")
+        with patch("time.monotonic", return_value=1059):
+            self.assertEqual(cache.get("a"), b"1234")
+        with patch("time.monotonic", return_value=1061):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()["evictions"], 1)
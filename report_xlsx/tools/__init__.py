@@ -0,0 +1,2 @@
+from . import render_stats
+from . import result_cache
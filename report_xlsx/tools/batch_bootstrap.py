@@ -0,0 +1,14 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+"""Start-up of the processes rendering batches of workbooks, see
+``ir.actions.report._render_xlsx_batch``.
+
+Run with ``runpy.run_path`` in each freshly spawned process, before anything
+of the addons is imported: ``options`` is the server configuration of the
+parent process, which gives the database and the addons path.
+"""
+
+import odoo
+
+odoo.tools.config.options.update(options)  # noqa: F821
+odoo.netsvc.init_logger()
+odoo.modules.module.initialize_sys_path()
@@ -0,0 +1,66 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import time
+from contextlib import contextmanager
+
+
+class RenderStats:
+    """Wall time and query count per phase of a report rendering.
+
+    Phases are exclusive: the time and queries of a phase entered while another
+    one is running are only accounted to the inner phase. Queries are counted on
+    ``cr`` and on the cursors added with ``add_cursor``, e.g. a replica one.
+    """
+
+    def __init__(self, cr):
+        self.cr = cr
+        self.cursors = [cr]
+        self.durations = {}
+        self.queries = {}
+        self.rows = 0
+        self.size = 0
+        self._stack = []
+
+    def add_cursor(self, cr):
+        """Count the queries of ``cr`` too, from now on."""
+        self.cursors.append(cr)
+
+    def _query_count(self):
+        return sum(cr.sql_log_count for cr in self.cursors)
+
+    @contextmanager
+    def phase(self, name):
+        frame = [name, time.perf_counter(), self._query_count(), 0.0, 0]
+        self._stack.append(frame)
+        try:
+            yield self
+        finally:
+            self._stack.pop()
+            duration = time.perf_counter() - frame[1]
+            queries = self._query_count() - frame[2]
+            self.durations[name] = self.durations.get(name, 0.0) + duration - frame[3]
+            self.queries[name] = self.queries.get(name, 0) + queries - frame[4]
+            if self._stack:
+                self._stack[-1][3] += duration
+                self._stack[-1][4] += queries
+
+    @property
+    def total(self):
+        return sum(self.durations.values())
+
+    def server_timing(self):
+        """Value of a ``Server-Timing`` response header, in milliseconds."""
+        return ", ".join(
+            f'{name};dur={duration * 1000:.1f};desc="{self.queries[name]} queries"'
+            for name, duration in self.durations.items()
+        )
+
+    def __str__(self):
+        phases = " ".join(
+            f"{name}={duration * 1000:.1f}ms/{self.queries[name]}q"
+            for name, duration in self.durations.items()
+        )
+        return (
+            f"total={self.total * 1000:.1f}ms queries={sum(self.queries.values())} "
+            f"rows={self.rows} size={self.size} {phases}"
+        )
@@ -0,0 +1,92 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import threading
+import time
+from collections import OrderedDict
+
+from odoo.tools import config
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_AGE = 600  # seconds
+
+
+class ReportResultCache:
+    """In-process LRU cache of rendered report files.
+
+    Entries are evicted least recently used first once the cumulated size goes
+    over ``max_bytes``, and are dropped on lookup once older than ``max_age``
+    seconds. Files bigger than ``max_bytes`` are never cached.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._entries = OrderedDict()  # key: (timestamp, content)
+        self._size = 0
+        self._lock = threading.RLock()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[0] > self.max_age:
+                self._pop(key)
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, content):
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (time.monotonic(), content)
+            self._size += len(content)
+            while self._size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _pop(self, key):
+        self._size -= len(self._entries.pop(key)[1])
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_result_cache(dbname):
+    """Return the result cache of database ``dbname``, sized from the server
+    options ``report_xlsx_cache_max_bytes`` and ``report_xlsx_cache_max_age``."""
+    with _caches_lock:
+        if dbname not in _caches:
+            _caches[dbname] = ReportResultCache(
+                max_bytes=int(
+                    config.get("report_xlsx_cache_max_bytes") or DEFAULT_MAX_BYTES
+                ),
+                max_age=int(config.get("report_xlsx_cache_max_age") or DEFAULT_MAX_AGE),
+            )
+        return _caches[dbname]